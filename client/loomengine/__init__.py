@@ -8,6 +8,7 @@ import os
 import requests
 from StringIO import StringIO
 import loomengine_utils.connection
+from loomengine_utils.md5calc import Md5Cache
 
 
 utils_logger = logging.getLogger(loomengine_utils.__name__)
@@ -22,6 +23,7 @@ LOOM_CONNECTION_FILES_DIR = os.path.join(
     LOOM_SETTINGS_HOME, 'connection-files')
 LOOM_CONNECTION_SETTINGS_FILE = 'client-connection-settings.conf'
 LOOM_TOKEN_FILE = 'token.txt'
+LOOM_MD5_CACHE_FILE = 'md5-cache.json'
 
 
 def _render_time(timestr):
@@ -130,3 +132,7 @@ def get_token():
     else:
         token = None
     return token
+
+
+def get_md5_cache():
+    return Md5Cache(os.path.join(LOOM_SETTINGS_HOME, LOOM_MD5_CACHE_FILE))
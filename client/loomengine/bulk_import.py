@@ -4,7 +4,7 @@ import os
 import sys
 from loomengine import server
 from loomengine import verify_has_connection_settings, get_server_url, \
-    verify_server_is_running, get_token
+    verify_server_is_running, get_token, get_md5_cache
 from loomengine_utils.exceptions import LoomengineUtilsError, APIError
 from loomengine_utils.connection import Connection
 from loomengine_utils.import_manager import ImportManager
@@ -26,7 +26,8 @@ class BulkImport(object):
         token = get_token()
         self.connection = Connection(server_url, token=token)
         self.import_manager = ImportManager(
-            connection=self.connection)
+            connection=self.connection,
+            md5_cache=get_md5_cache() if args.md5_cache else None)
 
     def _get_args(self):
         parser = self.get_parser()
@@ -40,7 +41,7 @@ class BulkImport(object):
             parser = argparse.ArgumentParser(__file__)
         parser.add_argument(
             'directory', metavar='DIRECTORY',
-            help='directory to import data from'
+            help='directory or bundle archive to import data from'
         )
         parser.add_argument(
             '-k', '--link-files', action='store_true',
@@ -51,6 +52,11 @@ class BulkImport(object):
             '-r', '--retry', action='store_true',
             default=False,
             help='allow retries if there is a failure')
+        parser.add_argument(
+            '--md5-cache', action='store_true',
+            default=False,
+            help='reuse md5 hashes of local files that are '
+            'unchanged since they were last imported')
         return parser
 
     def run(self):
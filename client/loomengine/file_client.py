@@ -6,7 +6,7 @@ import sys
 
 from loomengine import _render_time
 from loomengine import verify_server_is_running, get_server_url, \
-    verify_has_connection_settings, get_token
+    verify_has_connection_settings, get_token, get_md5_cache
 from loomengine.file_tag import FileTag
 from loomengine.file_label import FileLabel
 from loomengine_utils.connection import Connection
@@ -29,7 +29,10 @@ class AbstractFileSubcommand(object):
         self.connection = Connection(server_url, token=token)
         try:
             self.export_manager = ExportManager(connection=self.connection)
-            self.import_manager = ImportManager(connection=self.connection)
+            self.import_manager = ImportManager(
+                connection=self.connection,
+                md5_cache=get_md5_cache()
+                if getattr(args, 'md5_cache', False) else None)
         except LoomengineUtilsError as e:
             raise SystemExit("ERROR! Failed to initialize client: '%s'" % e)
 
@@ -71,6 +74,10 @@ class FileImport(AbstractFileSubcommand):
         parser.add_argument('-r', '--retry', action='store_true',
                             default=False,
                             help='allow retries if there is a failure')
+        parser.add_argument('--md5-cache', action='store_true',
+                            default=False,
+                            help='reuse md5 hashes of local files that are '
+                            'unchanged since they were last imported')
         parser.add_argument('-t', '--tag', metavar='TAG', action='append',
                             help='tag the file when it is created')
         parser.add_argument('-l', '--label', metavar='LABEL', action='append',
@@ -149,6 +156,10 @@ class FileExport(AbstractFileSubcommand):
             '-d', '--destination-directory',
             metavar='DESTINATION_DIRECTORY',
             help='destination directory')
+        parser.add_argument(
+            '-b', '--bundle', metavar='BUNDLE_URL',
+            help='export files with their metadata to one bundle archive '
+            'at this path or gs:// URL instead of a directory')
         metadata_group = parser.add_mutually_exclusive_group(required=False)
         metadata_group.add_argument(
             '-n', '--no-metadata',
@@ -193,8 +204,22 @@ class FileExport(AbstractFileSubcommand):
                     break
             if not found_at_least_one_match:
                 raise SystemExit('ERROR! No files matched "%s"' % file_id)
+        if self.args.bundle and self.args.no_metadata:
+            raise SystemExit(
+                'ERROR! A bundle always includes metadata. '
+                'Do not use "--no-metadata" with "--bundle".')
         try:
-            if len(files) > 1:
+            if self.args.bundle:
+                try:
+                    self.export_manager.export_bundle(
+                        self.args.bundle,
+                        files=files,
+                        retry=self.args.retry,
+                        link_files=self.args.link,
+                    )
+                except LoomengineUtilsError as e:
+                    raise SystemExit("ERROR! Failed to export files: '%s'" % e)
+            elif len(files) > 1:
                 try:
                     self.export_manager.bulk_export_files(
                         files,
@@ -4,6 +4,7 @@ import jsonschema
 import os
 import re
 import requests.exceptions
+import time
 import yaml
 
 from loomengine import _render_time
@@ -19,6 +20,9 @@ from loomengine_utils.import_manager import ImportManager
 from loomengine_utils.export_manager import ExportManager
 
 
+SUBMISSION_POLL_INTERVAL_SECONDS = 2
+
+
 class AbstractRunSubcommand(object):
 
     def __init__(self, args=None, silent=False):
@@ -76,6 +80,9 @@ class RunStart(AbstractRunSubcommand):
                             help='tag the run when it is started')
         parser.add_argument('-l', '--label', metavar='LABEL', action='append',
                             help='label the run when it is started')
+        parser.add_argument('--async', dest='is_async', action='store_true',
+                            help='submit the run to be created by the server '
+                            'in the background, and wait for it')
         return parser
 
     @classmethod
@@ -99,10 +106,13 @@ class RunStart(AbstractRunSubcommand):
         }
         if self.args.name:
             run_data['name'] = self.args.name
-        try:
-            run = self.connection.post_run(run_data)
-        except LoomengineUtilsError as e:
-            raise SystemExit("ERROR! Failed to start run: '%s'" % e)
+        if self.args.is_async:
+            run = self._submit_run(run_data)
+        else:
+            try:
+                run = self.connection.post_run(run_data)
+            except LoomengineUtilsError as e:
+                raise SystemExit("ERROR! Failed to start run: '%s'" % e)
 
         self._print('Created run %s@%s' % (
             run['name'],
@@ -111,6 +121,25 @@ class RunStart(AbstractRunSubcommand):
         self._apply_labels(run)
         return run
 
+    def _submit_run(self, run_data):
+        try:
+            submission = self.connection.post_run_submission(run_data)
+        except LoomengineUtilsError as e:
+            raise SystemExit("ERROR! Failed to submit run: '%s'" % e)
+        self._print('Submitted run as %s' % submission['uuid'])
+        while submission['status'] not in ('complete', 'failed'):
+            time.sleep(SUBMISSION_POLL_INTERVAL_SECONDS)
+            try:
+                submission = self.connection.get_run_submission(
+                    submission['uuid'])
+            except LoomengineUtilsError as e:
+                raise SystemExit(
+                    "ERROR! Failed to get status of run submission: '%s'" % e)
+        if submission['status'] == 'failed':
+            raise SystemExit("ERROR! Failed to start run: '%s'"
+                             % submission.get('error'))
+        return submission['run']
+
     def _get_inputs(self):
         """Converts command line args into a list of template inputs
         """
@@ -407,6 +436,10 @@ class RunExport(AbstractRunSubcommand):
             '-d', '--destination-directory',
             metavar='DESTINATION_DIRECTORY',
             help='destination directory')
+        parser.add_argument(
+            '-b', '--bundle', metavar='BUNDLE_URL',
+            help='export everything to one bundle archive at this '
+            'path or gs:// URL instead of a directory')
         parser.add_argument(
             '-k', '--link-files', action='store_true',
             default=False,
@@ -444,6 +477,16 @@ class RunExport(AbstractRunSubcommand):
                     break
             if not found_at_least_one_match:
                 raise SystemExit('ERROR! No runs matched %s"' % run_id)
+        if self.args.bundle:
+            try:
+                return self.export_manager.export_bundle(
+                    self.args.bundle,
+                    runs=runs,
+                    retry=self.args.retry,
+                    link_files=self.args.link_files
+                )
+            except LoomengineUtilsError as e:
+                raise SystemExit("ERROR! Failed to export runs: '%s'" % e)
         if len(runs) > 1:
             try:
                 return self.export_manager.bulk_export_runs(
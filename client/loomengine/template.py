@@ -145,6 +145,10 @@ class TemplateExport(AbstractTemplateSubcommand):
             '-d', '--destination-directory',
             metavar='DESTINATION_DIRECTORY',
             help='destination directory')
+        parser.add_argument(
+            '-b', '--bundle', metavar='BUNDLE_URL',
+            help='export everything to one bundle archive at this '
+            'path or gs:// URL instead of a directory')
         parser.add_argument(
             '-e', '--editable', action='store_true',
             default=False,
@@ -188,6 +192,16 @@ class TemplateExport(AbstractTemplateSubcommand):
             if not found_at_least_one_match:
                 raise SystemExit(
                     'ERROR! No templates matched "%s"' % template_id)
+        if self.args.bundle:
+            try:
+                return self.export_manager.export_bundle(
+                    self.args.bundle,
+                    templates=templates,
+                    retry=self.args.retry,
+                    link_files=self.args.link_files
+                )
+            except LoomengineUtilsError as e:
+                raise SystemExit("ERROR! Failed to export templates: '%s'" % e)
         if len(templates) > 1:
             try:
                 return self.export_manager.bulk_export_templates(
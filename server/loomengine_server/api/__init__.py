@@ -21,35 +21,19 @@ def get_storage_settings():
     }
 
 def match_and_update_by_uuid(unsaved_models, field, saved_models):
+    saved_models_by_uuid = dict((m.uuid, m) for m in saved_models)
     for unsaved_model in unsaved_models:
         if not getattr(unsaved_model, field):
             continue
         uuid = getattr(unsaved_model, field).uuid
-        match = filter(lambda m: m.uuid==uuid, saved_models)
-        assert len(match) == 1, 'Failed to match object by UUID'
-        setattr(unsaved_model, field, match[0])
+        match = saved_models_by_uuid.get(uuid)
+        assert match is not None, 'Failed to match object by UUID'
+        setattr(unsaved_model, field, match)
     return unsaved_models
 
-def reload_models(ModelClass, models):
-    # bulk_create doesn't give PK's, so we have to reload the models.                    
-    # We can look them up by uuid, which is also unique                                  
-    uuids = [model.uuid for model in models]
-    models = ModelClass.objects.filter(uuid__in=uuids)
-    return models
-
-def connect_data_nodes_to_parents(data_nodes, parent_child_relationships):
-    params = []
+def connect_to_parents(models, parent_child_relationships):
+    # Sets "parent" on models before they are saved. Models must have ids,
+    # e.g. from allocate_ids, and parents must be saved before children.
+    models_by_uuid = dict((m.uuid, m) for m in models)
     for parent_uuid, child_uuid in parent_child_relationships:
-        child = filter(
-            lambda r: r.uuid==child_uuid, data_nodes)[0]
-        parent = filter(
-            lambda r: r.uuid==parent_uuid, data_nodes)[0]
-        params.append((child.id, parent.id))
-    if params:
-        case_statement = ' '.join(
-            ['WHEN id=%s THEN %s' % pair for pair in params])
-        id_list = ', '.join(['%s' % pair[0] for pair in params])
-        sql = 'UPDATE api_datanode SET parent_id= CASE %s END WHERE id IN (%s)'\
-                                                  % (case_statement, id_list)
-        with django.db.connection.cursor() as cursor:
-            cursor.execute(sql)
+        models_by_uuid[child_uuid].parent = models_by_uuid[parent_uuid]
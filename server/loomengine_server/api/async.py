@@ -13,6 +13,8 @@ import time
 
 from api import get_setting, get_storage_settings
 from api.exceptions import ConcurrentModificationError
+# Connects the Celery signal handlers that record task queries
+import api.query_stats
 
 
 """This module contains asynchronous tasks
@@ -62,6 +64,23 @@ def check_for_stalled_tasks():
         if task.is_timed_out():
             task.timeout_error()
 
+@periodic_task(run_every=timedelta(minutes=SYSTEM_CHECK_INTERVAL_MINUTES))
+def check_for_stalled_push_inputs():
+    """Replace push_all_inputs jobs that were lost, e.g. when a worker died,
+    so that runs waiting on them still get their inputs
+    """
+    from api.models.runs import Run
+    for run in Run.get_expired_push_inputs_locks():
+        run.request_push_all_inputs()
+
+@periodic_task(run_every=timedelta(minutes=SYSTEM_CHECK_INTERVAL_MINUTES))
+def check_for_stalled_run_submissions():
+    """Fail RunSubmissions whose job was lost, e.g. when a worker died,
+    so that clients polling them do not wait forever
+    """
+    from api.models import RunSubmission
+    RunSubmission.fail_stalled_submissions()
+
 @periodic_task(run_every=timedelta(minutes=SYSTEM_CHECK_INTERVAL_MINUTES))
 def check_for_missed_cleanup():
     """Check for TaskAttempts that were never cleaned up
@@ -105,18 +124,25 @@ def delete_file_resource(file_resource_id):
     file_resource = FileResource.objects.get(id=file_resource_id)
     file_resource.setattrs_and_save_with_retries({'upload_status': 'deleting'})
 
-    if not file_resource.link:
-        # Replace start of URL with path inside Docker container.
-        file_url = file_resource.file_url
-        if file_url.startswith('file:///'):
-            file_url = re.sub(
-                '^'+get_setting('STORAGE_ROOT_WITH_PREFIX'),
-                get_setting('INTERNAL_STORAGE_ROOT_WITH_PREFIX'),
-                file_url)
+    if file_resource.link:
+        file_resource.delete()
+        return
+
+    # Files with the same md5 share one file in storage,
+    # which is deleted along with the last FileResource that uses it
+    if file_resource.delete_if_file_is_shared():
+        return
 
-        file = File(file_url, get_storage_settings(), retry=True)
-        file.delete(pruneto=get_setting('INTERNAL_STORAGE_ROOT'))
+    # Replace start of URL with path inside Docker container.
+    file_url = file_resource.file_url
+    if file_url.startswith('file:///'):
+        file_url = re.sub(
+            '^'+get_setting('STORAGE_ROOT_WITH_PREFIX'),
+            get_setting('INTERNAL_STORAGE_ROOT_WITH_PREFIX'),
+            file_url)
 
+    file = File(file_url, get_storage_settings(), retry=True)
+    file.delete(pruneto=get_setting('INTERNAL_STORAGE_ROOT'))
     file_resource.delete()
 
 @periodic_task(run_every=timedelta(minutes=14))
@@ -129,7 +155,7 @@ def cleanup_orphaned_file_resources():
     count = queryset.count()
     logger.info('Periodic cleanup of unused files. %s files found.' % count)
     for file_resource in queryset.all():
-        _delete_file_resource(file_resource.id)
+        execute(delete_file_resource, file_resource.id)
 
 @periodic_task(run_every=timedelta(minutes=13))
 def cleanup_orphaned_task_attempts():
@@ -207,7 +233,36 @@ def postprocess_run(run_uuid):
             fingerprint = task.get_fingerprint()
             fingerprint.update_task_attempt_maybe(task.task_attempt)
     if not run.has_terminal_status():
-        run.push_all_inputs()
+        run.request_push_all_inputs()
+
+@shared_task
+def push_all_inputs(run_uuid):
+    # Use Run.request_push_all_inputs to schedule this job
+    from api.models.runs import Run
+    Run.run_push_all_inputs_job(run_uuid)
+
+@shared_task
+def create_run_from_submission(submission_uuid):
+    # Use RunSubmission.submit to schedule this job
+    from rest_framework.exceptions import ValidationError
+    from api.models import RunSubmission
+    from api.serializers import RunSerializer
+    submission = RunSubmission.claim(submission_uuid)
+    if submission is None:
+        logger.debug('Run submission %s was already claimed' % submission_uuid)
+        return
+    s = RunSerializer(data=submission.run_data,
+                      context={'server_url': submission.server_url})
+    try:
+        s.is_valid(raise_exception=True)
+        run = s.save()
+    except ValidationError as e:
+        submission.set_failed(e.detail)
+        return
+    except Exception as e:
+        submission.set_failed(str(e))
+        raise
+    submission.set_complete(run)
 
 @shared_task
 def finish_task_attempt(task_attempt_uuid):
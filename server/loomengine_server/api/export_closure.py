@@ -0,0 +1,159 @@
+import json
+from rest_framework.utils.encoders import JSONEncoder
+
+from api.models import Run, Template
+from api.serializers import RunSerializer, TemplateSerializer
+
+
+"""This module finds everything needed to export a set of Runs and
+Templates: the Runs, the Template of each Run, and every file DataObject
+(with its FileResource) that they refer to. Each object is included once,
+however many times it is referred to.
+
+Records are yielded one at a time so the view can stream them. Each
+record is {"type": "data_object"|"template"|"run", "data": {...}}, with the
+same representation as the detail endpoint for that type. A Run or
+Template follows the DataObjects it refers to, and a Run follows its
+Template.
+"""
+
+# Number of Runs or Templates loaded from the database in one query
+BATCH_SIZE = 100
+
+
+class ObjectNotFound(Exception):
+
+    def __init__(self, kind, uuids):
+        super(ObjectNotFound, self).__init__(
+            'No %s found with UUID "%s"' % (kind, '", "'.join(sorted(uuids))))
+
+
+def get_runs(uuids):
+    return _get_objects(Run, 'run', uuids)
+
+
+def get_templates(uuids):
+    return _get_objects(Template, 'template', uuids)
+
+
+def _get_objects(Model, kind, uuids):
+    # Check that all exist before the response starts streaming, since
+    # errors cannot be returned after that. Only IDs are loaded here.
+    uuids = _unique(uuids)
+    found = set(Model.objects.filter(
+        uuid__in=uuids).values_list('uuid', flat=True))
+    missing = set(uuids).difference(found)
+    if missing:
+        raise ObjectNotFound(kind, missing)
+    return uuids
+
+
+def iter_closure(run_uuids, template_uuids, context):
+    seen = set()
+    for batch in _iter_batches(template_uuids):
+        templates = _get_in_order(Template.objects.all(), batch)
+        for template in templates:
+            for record in _iter_template(template, context, seen):
+                yield record
+    for batch in _iter_batches(run_uuids):
+        runs = _get_in_order(Run.objects.select_related('template'), batch)
+        for run in runs:
+            for record in _iter_template(run.template, context, seen):
+                yield record
+            data = RunSerializer(run, context=context).data
+            if _add_if_unseen(seen, 'run', data):
+                for record in _iter_data_objects(
+                        _get_files_from_run(data), seen):
+                    yield record
+                yield _get_record('run', data)
+
+
+def iter_json_lines(records):
+    for record in records:
+        yield json.dumps(record, cls=JSONEncoder) + '\n'
+
+
+def _iter_template(template, context, seen):
+    if ('template', template.uuid) in seen:
+        return
+    data = TemplateSerializer(template, context=context).data
+    _add_if_unseen(seen, 'template', data)
+    for record in _iter_data_objects(_get_files_from_template(data), seen):
+        yield record
+    yield _get_record('template', data)
+
+
+def _iter_data_objects(data_objects, seen):
+    for data_object in data_objects:
+        if _add_if_unseen(seen, 'data_object', data_object):
+            yield _get_record('data_object', data_object)
+
+
+def _add_if_unseen(seen, kind, data):
+    key = (kind, data['uuid'])
+    if key in seen:
+        return False
+    seen.add(key)
+    return True
+
+
+def _get_record(kind, data):
+    return {'type': kind, 'data': data}
+
+
+def _get_files_from_template(template):
+    files = _get_files_from_inputs_outputs(template)
+    for step in template.get('steps', []):
+        files.extend(_get_files_from_template(step))
+    return files
+
+
+def _get_files_from_run(run):
+    files = _get_files_from_inputs_outputs(run)
+    for step in run.get('steps', []):
+        files.extend(_get_files_from_run(step))
+    for task in run.get('tasks', []):
+        files.extend(_get_files_from_inputs_outputs(task))
+        for task_attempt in task.get('all_task_attempts', []):
+            files.extend(_get_files_from_inputs_outputs(task_attempt))
+            for log_file in task_attempt.get('log_files', []):
+                if log_file.get('data_object'):
+                    files.append(log_file['data_object'])
+    return files
+
+
+def _get_files_from_inputs_outputs(data):
+    files = []
+    for channel in data.get('inputs', []) + data.get('outputs', []):
+        if channel.get('type') == 'file' and channel.get('data'):
+            _get_files_from_contents(channel['data'].get('contents'), files)
+    return files
+
+
+def _get_files_from_contents(contents, files):
+    if isinstance(contents, list):
+        for item in contents:
+            _get_files_from_contents(item, files)
+    elif isinstance(contents, dict) and contents.get('uuid'):
+        files.append(contents)
+
+
+def _get_in_order(queryset, uuids):
+    objects = dict((obj.uuid, obj)
+                   for obj in queryset.filter(uuid__in=uuids))
+    return [objects[uuid] for uuid in uuids]
+
+
+def _iter_batches(items):
+    for i in range(0, len(items), BATCH_SIZE):
+        yield items[i:i+BATCH_SIZE]
+
+
+def _unique(items):
+    seen = set()
+    unique = []
+    for item in items:
+        if item not in seen:
+            seen.add(item)
+            unique.append(item)
+    return unique
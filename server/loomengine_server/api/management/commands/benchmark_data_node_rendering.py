@@ -0,0 +1,100 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Time rendering the contents of a scattered DataNode with one '\
+           'DataObjectSerializer per leaf and with DataNodeContentsRenderer, '\
+           'and check that both give the same result. Test data is created '\
+           'in a transaction that is rolled back.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--leaves', type=int, default=10000,
+            help='Number of leaves in the DataNode (default 10000)')
+        parser.add_argument(
+            '--type', choices=['string', 'file'], default='file',
+            help='Type of the DataObjects (default file)')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self._run(options['leaves'], options['type'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def _run(self, leaf_count, data_type):
+        from api.models import DataNode
+        from api.serializers.data_nodes import DataNodeContentsRenderer
+
+        self.stdout.write('Creating DataNode with %s leaves of type %s...'
+                          % (leaf_count, data_type))
+        data_node = self._create_data_node(leaf_count, data_type)
+        context = {'request': Request(APIRequestFactory().get('/'))}
+
+        start = time.time()
+        data_node = DataNode.objects.get(id=data_node.id)
+        data_node.prefetch()
+        expected = self._render_per_leaf(data_node, context)
+        self.stdout.write('Per-leaf serializers: %.2fs' % (time.time() - start))
+
+        start = time.time()
+        data_node = DataNode.objects.get(id=data_node.id)
+        contents = DataNodeContentsRenderer(context).render(
+            [data_node])[data_node.id]
+        self.stdout.write('DataNodeContentsRenderer: %.2fs'
+                          % (time.time() - start))
+
+        start = time.time()
+        data_node = DataNode.objects.get(id=data_node.id)
+        data_node.prefetch()
+        prefetched_contents = DataNodeContentsRenderer(context).render(
+            [data_node])[data_node.id]
+        self.stdout.write('DataNodeContentsRenderer with prefetch: %.2fs'
+                          % (time.time() - start))
+
+        if contents != expected or prefetched_contents != expected:
+            raise CommandError('Rendered contents do not match')
+
+    def _create_data_node(self, leaf_count, data_type):
+        from api.models import DataNode, DataObject
+        data_node = DataNode.objects.create(type=data_type, degree=leaf_count)
+        for i in range(leaf_count):
+            if data_type == 'file':
+                data_object = DataObject.create_and_initialize_file_resource(
+                    filename='file%s.txt' % i,
+                    md5='d41d8cd98f00b204e9800998ecf8427e',
+                    source_type='imported',
+                    file_url='file:///data/file%s.txt' % i,
+                    upload_status='complete')
+            else:
+                data_object = DataObject.get_by_value('word%s' % i, 'string')
+            DataNode.objects.create(
+                parent=data_node, index=i, type=data_type,
+                data_object=data_object)
+        return data_node
+
+    def _render_per_leaf(self, data_node, context):
+        # How DataNodeSerializer rendered contents before
+        # DataNodeContentsRenderer
+        from api.serializers.data_objects import DataObjectSerializer
+        if data_node._is_blank_node():
+            return None
+        elif data_node._is_empty_branch():
+            return []
+        if data_node.is_leaf:
+            return DataObjectSerializer(
+                data_node.data_object,
+                context=dict(context, nested=True)).data
+        contents = [None] * data_node.degree
+        for child in data_node.children.all():
+            contents[child.index] = self._render_per_leaf(child, context)
+        return contents
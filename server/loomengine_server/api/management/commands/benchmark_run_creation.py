@@ -0,0 +1,74 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Time creating a Run from a Template with many steps, and count '\
+           'the database queries used. Test data is created in a '\
+           'transaction that is rolled back.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--steps', type=int, default=1000,
+            help='Number of steps in the Template (default 1000)')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self._run(options['steps'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def _run(self, step_count):
+        from api.serializers import TemplateSerializer, RunSerializer
+
+        self.stdout.write('Creating Template with %s steps...' % step_count)
+        s = TemplateSerializer(data=self._get_template_data(step_count))
+        s.is_valid(raise_exception=True)
+        template = s.save()
+
+        s = RunSerializer(data={'template': '@%s' % template.uuid})
+        with CaptureQueriesContext(connection) as queries:
+            start = time.time()
+            s.is_valid(raise_exception=True)
+        self.stdout.write('Validate: %.2fs, %s queries'
+                          % (time.time() - start, len(queries)))
+
+        # Call bulk_create_all directly rather than save(), which also
+        # schedules postprocessing
+        with CaptureQueriesContext(connection) as queries:
+            start = time.time()
+            run = s._unsaved_object_manager.bulk_create_all()
+        self.stdout.write('Save: %.2fs, %s queries'
+                          % (time.time() - start, len(queries)))
+        self.stdout.write('Created Run with %s steps'
+                          % run.steps.count())
+
+    def _get_template_data(self, step_count):
+        steps = []
+        for i in range(step_count):
+            steps.append({
+                'name': 'step_%s' % i,
+                'command': 'cat {{ a }} > {{ b%s }}' % i,
+                'environment': {'docker_image': 'ubuntu'},
+                'resources': {'cores': '1', 'memory': '1',
+                              'disk_size': '1024'},
+                'inputs': [{'type': 'string', 'channel': 'a'}],
+                'outputs': [{'source': {'filename': 'b%s.txt' % i},
+                             'type': 'file',
+                             'channel': 'b%s' % i}],
+            })
+        # Steps share input 'a', so it is given once on the Template
+        return {'name': 'benchmark',
+                'inputs': [{'type': 'string',
+                            'data': {'contents': 'a word or two'},
+                            'channel': 'a'}],
+                'outputs': [{'channel': 'b0', 'type': 'file'}],
+                'steps': steps}
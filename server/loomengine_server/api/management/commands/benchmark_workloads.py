@@ -0,0 +1,379 @@
+import datetime
+import json
+import os
+import resource
+import subprocess
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import override_settings
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+
+class Rollback(Exception):
+    pass
+
+
+class QueryCounter(object):
+    """Stands in for connection.queries_log, keeping only the number of
+    queries and their total time. Unlike queries_log it has no maximum
+    length, and it does not add the statements to the memory being measured.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+
+    def append(self, query):
+        self.count += 1
+        self.time += float(query['time'])
+
+    def clear(self):
+        pass
+
+
+class Command(BaseCommand):
+    help = 'Run synthetic workflows through their full lifecycle in '\
+           'process, and report wall time, database queries and memory '\
+           'for each phase: run creation, input calculation, task '\
+           'creation, task finish propagation and serialization. Memory '\
+           'is the peak resident size during each phase, and how far it '\
+           'rose above the resident size when the phase started. Where '\
+           'the peak cannot be reset (it needs /proc/self/clear_refs on '\
+           'Linux) it is the peak of the whole process so far. Tasks '\
+           'are not executed. Each TaskAttempt is given string outputs '\
+           'and finished directly. Test data is created in a transaction '\
+           'that is rolled back. Use with the default SQLite database, '\
+           'i.e. without LOOM_MYSQL_HOST, for results that can be compared '\
+           'between commits.'
+
+    WORKLOADS = ['wide_scatter', 'deep_nesting',
+                 'gather_of_scatter', 'cross_product']
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workloads', nargs='+', choices=self.WORKLOADS,
+            default=self.WORKLOADS,
+            help='Workloads to run (default all)')
+        parser.add_argument(
+            '--width', type=int, default=100,
+            help='Number of scattered tasks in wide_scatter and '\
+            'gather_of_scatter (default 100)')
+        parser.add_argument(
+            '--depth', type=int, default=5,
+            help='Levels of nested workflows in deep_nesting (default 5)')
+        parser.add_argument(
+            '--cross-width', type=int, default=10,
+            help='Length of each input in cross_product, which creates '\
+            'the square of this many tasks (default 10)')
+        parser.add_argument(
+            '--output',
+            help='Write results as JSON to this file')
+        parser.add_argument(
+            '--compare',
+            help='Compare results with a JSON file written by --output')
+
+    def handle(self, *args, **options):
+        previous = None
+        if options['compare']:
+            with open(options['compare']) as f:
+                previous = json.load(f)
+        results = {
+            'commit': self._get_commit(),
+            'database': connection.vendor,
+            'datetime': datetime.datetime.utcnow().isoformat(),
+            'workloads': {},
+        }
+        parameters = {
+            'wide_scatter': {'width': options['width']},
+            'deep_nesting': {'depth': options['depth']},
+            'gather_of_scatter': {'width': options['width']},
+            'cross_product': {'width': options['cross_width']},
+        }
+        for workload in options['workloads']:
+            self.stdout.write('Workload %s %s' % (
+                workload, json.dumps(parameters[workload], sort_keys=True)))
+            results['workloads'][workload] = {
+                'parameters': parameters[workload],
+                'phases': self._run_workload(workload, parameters[workload]),
+            }
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+            self.stdout.write('Wrote results to %s' % options['output'])
+        if previous is not None:
+            self._compare(previous, results)
+
+    def _run_workload(self, workload, parameters):
+        template_data = getattr(self, '_get_%s' % workload)(**parameters)
+        phases = []
+        with override_settings(TEST_DISABLE_ASYNC_DELAY=True,
+                               TEST_NO_RUN_TASK_ATTEMPT=True,
+                               TEST_NO_TASK_ATTEMPT_CLEANUP=True,
+                               DISABLE_REPRESENTATION_CACHE=True):
+            try:
+                with transaction.atomic():
+                    self._run_phases(template_data, phases)
+                    raise Rollback
+            except Rollback:
+                pass
+        return phases
+
+    def _run_phases(self, template_data, phases):
+        from api.models import Run
+        from api.serializers import TemplateSerializer
+
+        s = TemplateSerializer(data=template_data)
+        s.is_valid(raise_exception=True)
+        template = s.save()
+
+        with override_settings(TEST_NO_PUSH_INPUTS=True):
+            run = self._measure(
+                phases, 'run_creation', lambda: self._create_run(template))
+        # Later phases need the Run as saved, not the instance built by
+        # the serializer
+        run = Run.objects.get(id=run.id)
+        leaves = run.get_leaves()
+        self._measure(phases, 'input_calculation',
+                      lambda: self._calculate_inputs(leaves))
+        self._measure(phases, 'task_creation', run.push_all_inputs)
+        self._measure(phases, 'task_finish_propagation',
+                      lambda: self._finish_all_tasks(leaves))
+        run = Run.objects.get(id=run.id)
+        if not run.status_is_finished:
+            raise CommandError('Run %s did not finish. Status is "%s"'
+                               % (run.uuid, run.status))
+        self._measure(phases, 'serialization',
+                      lambda: self._serialize(run))
+
+    def _measure(self, phases, phase, function):
+        counter = QueryCounter()
+        queries_log = connection.queries_log
+        force_debug_cursor = connection.force_debug_cursor
+        connection.queries_log = counter
+        connection.force_debug_cursor = True
+        is_phase_peak = self._reset_max_rss()
+        max_rss_before = self._get_max_rss_mb()
+        try:
+            start = time.time()
+            value = function()
+            seconds = time.time() - start
+        finally:
+            connection.queries_log = queries_log
+            connection.force_debug_cursor = force_debug_cursor
+        max_rss_mb = self._get_max_rss_mb()
+        phases.append({
+            'phase': phase,
+            'seconds': seconds,
+            'queries': counter.count,
+            'db_seconds': counter.time,
+            'max_rss_mb': max_rss_mb,
+            'max_rss_increase_mb': max_rss_mb - max_rss_before,
+            'max_rss_scope': 'phase' if is_phase_peak else 'process',
+        })
+        self.stdout.write('  %s: %.2fs, %s queries (%.2fs), '\
+                          '%s peak memory %.0f MB (+%.0f MB)' % (
+                              phase, seconds, counter.count, counter.time,
+                              'phase' if is_phase_peak else 'process',
+                              max_rss_mb, max_rss_mb - max_rss_before))
+        return value
+
+    def _reset_max_rss(self):
+        # On Linux, writing 5 to clear_refs resets VmHWM, the peak resident
+        # size, to the current resident size. Returns False if it cannot
+        # be reset.
+        try:
+            with open('/proc/self/clear_refs', 'w') as f:
+                f.write('5')
+        except (IOError, OSError):
+            return False
+        return self._get_vm_hwm_mb() is not None
+
+    def _get_max_rss_mb(self):
+        max_rss_mb = self._get_vm_hwm_mb()
+        if max_rss_mb is not None:
+            return max_rss_mb
+        # ru_maxrss is the peak for the whole process so far, in KB on
+        # Linux. It never goes down, so a phase that uses less memory than
+        # an earlier one shows no increase.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+    def _get_vm_hwm_mb(self):
+        try:
+            with open('/proc/self/status') as f:
+                for line in f:
+                    if line.startswith('VmHWM:'):
+                        # e.g. "VmHWM:    123456 kB"
+                        return int(line.split()[1]) / 1024.0
+        except (IOError, OSError):
+            pass
+        return None
+
+    def _create_run(self, template):
+        from api.serializers import RunSerializer
+        s = RunSerializer(data={'template': '@%s' % template.uuid})
+        s.is_valid(raise_exception=True)
+        return s.save()
+
+    def _calculate_inputs(self, leaves):
+        from api.models.input_calculator import InputCalculator
+        count = 0
+        for leaf in leaves:
+            if leaf.inputs.exists():
+                for input_set in InputCalculator(leaf).iter_input_sets():
+                    count += 1
+        return count
+
+    def _finish_all_tasks(self, leaves):
+        # Finishing a TaskAttempt pushes its outputs downstream, which
+        # may create more Tasks. Repeat until none are left.
+        from api.models import TaskAttempt
+        while True:
+            task_attempts = TaskAttempt.objects.filter(
+                active_on_tasks__run__in=leaves,
+                status_is_finished=False,
+                status_is_failed=False,
+                status_is_killed=False).distinct()
+            if not task_attempts.exists():
+                return
+            for task_attempt in task_attempts:
+                self._finish_task_attempt(task_attempt)
+
+    def _finish_task_attempt(self, task_attempt):
+        # Same as a worker reporting its outputs and then finishing
+        from api.serializers import TaskAttemptOutputUpdateSerializer
+        for output in task_attempt.outputs.all():
+            s = TaskAttemptOutputUpdateSerializer(
+                output,
+                data={'data': {'contents': 'output of %s' % output.channel}},
+                partial=True)
+            s.is_valid(raise_exception=True)
+            s.save()
+        task_attempt.finish()
+
+    def _serialize(self, run):
+        from api.models import Run
+        from api.serializers import RunSerializer
+        run = Run.objects.get(id=run.id)
+        context = {'request': Request(APIRequestFactory().get('/'))}
+        return RunSerializer(run, context=context).data
+
+    def _compare(self, previous, results):
+        self.stdout.write('Compared with commit %s:' % previous.get('commit'))
+        for workload, result in sorted(results['workloads'].items()):
+            previous_result = previous['workloads'].get(workload)
+            if previous_result is None:
+                continue
+            if previous_result['parameters'] != result['parameters']:
+                self.stdout.write('  %s: parameters differ, skipped'
+                                  % workload)
+                continue
+            previous_phases = dict(
+                (phase['phase'], phase)
+                for phase in previous_result['phases'])
+            for phase in result['phases']:
+                before = previous_phases.get(phase['phase'])
+                if before is None:
+                    continue
+                self.stdout.write(
+                    '  %s %s: %.2fs -> %.2fs, %s -> %s queries' % (
+                        workload, phase['phase'], before['seconds'],
+                        phase['seconds'], before['queries'],
+                        phase['queries']))
+
+    def _get_commit(self):
+        try:
+            return subprocess.check_output(
+                ['git', 'rev-parse', 'HEAD'],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                stderr=subprocess.STDOUT).strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def _get_step(self, name, inputs, outputs):
+        return {
+            'name': name,
+            'command': 'echo %s' % ' '.join(
+                '{{ %s }}' % input['channel'] for input in inputs),
+            'environment': {'docker_image': 'ubuntu'},
+            'resources': {'cores': '1', 'memory': '1', 'disk_size': '1'},
+            'inputs': inputs,
+            'outputs': [{'channel': channel,
+                         'type': 'string',
+                         'source': {'stream': 'stdout'}}
+                        for channel in outputs],
+        }
+
+    def _get_words(self, count, prefix='word'):
+        return ['%s%s' % (prefix, i) for i in range(count)]
+
+    def _get_wide_scatter(self, width):
+        # One step run once for each of width inputs
+        return {
+            'name': 'wide_scatter',
+            'inputs': [{'channel': 'word', 'type': 'string',
+                        'data': {'contents': self._get_words(width)}}],
+            'outputs': [{'channel': 'echoed', 'type': 'string'}],
+            'steps': [self._get_step(
+                'echo', [{'channel': 'word', 'type': 'string'}],
+                ['echoed'])],
+        }
+
+    def _get_deep_nesting(self, depth):
+        # Each level has one step and a nested workflow for the next level
+        workflow = self._get_step(
+            'step_%s' % depth, [{'channel': 'word', 'type': 'string'}],
+            ['out_%s' % depth])
+        for level in reversed(range(depth)):
+            workflow = {
+                'name': 'level_%s' % level,
+                'inputs': [{'channel': 'word', 'type': 'string'}],
+                'outputs': [{'channel': 'out_%s' % level,
+                             'type': 'string'}],
+                'steps': [
+                    self._get_step(
+                        'step_%s' % level,
+                        [{'channel': 'word', 'type': 'string'}],
+                        ['out_%s' % level]),
+                    workflow,
+                ],
+            }
+        workflow['inputs'][0]['data'] = {'contents': 'word'}
+        return workflow
+
+    def _get_gather_of_scatter(self, width):
+        # Scattered tasks whose outputs are gathered by one task.
+        # The gathering task is created only when all others have finished.
+        return {
+            'name': 'gather_of_scatter',
+            'inputs': [{'channel': 'word', 'type': 'string',
+                        'data': {'contents': self._get_words(width)}}],
+            'outputs': [{'channel': 'joined', 'type': 'string'}],
+            'steps': [
+                self._get_step(
+                    'echo', [{'channel': 'word', 'type': 'string'}],
+                    ['echoed']),
+                self._get_step(
+                    'join', [{'channel': 'echoed', 'type': 'string',
+                              'mode': 'gather'}],
+                    ['joined']),
+            ],
+        }
+
+    def _get_cross_product(self, width):
+        # Inputs in different groups give one task for each combination
+        return {
+            'name': 'cross_product',
+            'inputs': [
+                {'channel': 'left', 'type': 'string', 'group': 0,
+                 'data': {'contents': self._get_words(width, 'left')}},
+                {'channel': 'right', 'type': 'string', 'group': 1,
+                 'data': {'contents': self._get_words(width, 'right')}}],
+            'outputs': [{'channel': 'pair', 'type': 'string'}],
+            'steps': [self._get_step(
+                'pair',
+                [{'channel': 'left', 'type': 'string', 'group': 0},
+                 {'channel': 'right', 'type': 'string', 'group': 1}],
+                ['pair'])],
+        }
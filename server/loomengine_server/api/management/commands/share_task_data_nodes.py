@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from django.db import models
+
+
+class Command(BaseCommand):
+    help = 'Point TaskAttemptInputs at the DataNode of the matching TaskInput '\
+           'and delete the copies written by earlier versions of Loom.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Count the DataNodes that would be shared, but change nothing')
+
+    def handle(self, *args, **options):
+        from api.models import TaskAttempt, TaskAttemptInput
+        shared_count = 0
+        deleted_count = 0
+        task_attempts = TaskAttempt.objects.filter(status_is_initializing=False)\
+            .prefetch_related('inputs__data_node')\
+            .prefetch_related('tasks__inputs__data_node')
+        for task_attempt in task_attempts:
+            tasks = task_attempt.tasks.all()
+            if not tasks:
+                continue
+            task = tasks[0]
+            task_inputs = {i.channel: i for i in task.inputs.all()}
+            for attempt_input in task_attempt.inputs.all():
+                task_input = task_inputs.get(attempt_input.channel)
+                if task_input is None \
+                   or attempt_input.data_node_id == task_input.data_node_id:
+                    continue
+                if attempt_input.data_node.get_contents_fingerprint() \
+                   != task_input.data_node.get_contents_fingerprint():
+                    continue
+                shared_count += 1
+                if options['dry_run']:
+                    continue
+                old_data_node = attempt_input.data_node
+                TaskAttemptInput.objects.filter(id=attempt_input.id).update(
+                    data_node=task_input.data_node)
+                try:
+                    old_data_node.delete()
+                    deleted_count += 1
+                except models.ProtectedError:
+                    pass
+        self.stdout.write('Shared %s TaskAttemptInput DataNodes. '
+                          'Deleted %s copies.' % (shared_count, deleted_count))
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import api.models.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_auto_20190617_1524'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datanode',
+            name='contents_fingerprint',
+            field=models.CharField(blank=True, max_length=32, null=True, validators=[api.models.validators.validate_md5]),
+        ),
+        migrations.AddField(
+            model_name='dataobject',
+            name='contents_fingerprint',
+            field=models.CharField(blank=True, max_length=32, null=True, validators=[api.models.validators.validate_md5]),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_contents_fingerprints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='run',
+            name='push_inputs_changed',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='run',
+            name='push_inputs_pending',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='run',
+            name='push_inputs_status',
+            field=models.CharField(choices=[(b'idle', b'Idle'), (b'scheduled', b'Scheduled'), (b'in_progress', b'In Progress')], default=b'idle', max_length=255),
+        ),
+    ]
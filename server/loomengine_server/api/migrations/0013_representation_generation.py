@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_run_push_inputs_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataobject',
+            name='representation_generation',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='run',
+            name='representation_generation',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='template',
+            name='representation_generation',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import api.models
+import api.models.base
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_representation_generation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RunSubmission',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('_change', models.IntegerField(default=0)),
+                ('uuid', models.CharField(default=api.models.uuidstr, editable=False, max_length=255, unique=True)),
+                ('datetime_created', models.DateTimeField(default=django.utils.timezone.now, editable=False)),
+                ('datetime_started', models.DateTimeField(blank=True, null=True)),
+                ('datetime_finished', models.DateTimeField(blank=True, null=True)),
+                ('status', models.CharField(choices=[(b'queued', b'Queued'), (b'in_progress', b'In Progress'), (b'complete', b'Complete'), (b'failed', b'Failed')], default=b'queued', max_length=255)),
+                ('run_data', jsonfield.fields.JSONField()),
+                ('server_url', models.CharField(blank=True, max_length=1000)),
+                ('error', jsonfield.fields.JSONField(blank=True, null=True)),
+                ('run', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='submissions', to='api.Run')),
+            ],
+            options={
+                'abstract': False,
+            },
+            bases=(models.Model, api.models.base._FilterMixin),
+        ),
+    ]
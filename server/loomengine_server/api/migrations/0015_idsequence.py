@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import api.models.base
+from django.db import migrations, models
+from django.db.models import Max
+
+
+# Models with PREASSIGN_IDS
+MODEL_NAMES = ['DataObject', 'DataNode', 'Run', 'Task', 'TaskAttempt']
+
+
+def forward(apps, schema_editor):
+    # Create the sequences up front, so that reserving ids never
+    # has to create one
+    IdSequence = apps.get_model('api', 'IdSequence')
+    for model_name in MODEL_NAMES:
+        Model = apps.get_model('api', model_name)
+        name = Model._meta.db_table
+        if IdSequence.objects.filter(name=name).exists():
+            continue
+        max_id = Model.objects.aggregate(Max('id'))['id__max'] or 0
+        IdSequence.objects.create(name=name, next_id=max_id + 1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_runsubmission'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdSequence',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('_change', models.IntegerField(default=0)),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('next_id', models.BigIntegerField()),
+            ],
+            options={
+                'abstract': False,
+            },
+            bases=(models.Model, api.models.base._FilterMixin),
+        ),
+        migrations.RunPython(forward, migrations.RunPython.noop),
+    ]
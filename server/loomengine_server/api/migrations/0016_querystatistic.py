@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import api.models.base
+from django.db import migrations, models
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_idsequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueryStatistic',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('_change', models.IntegerField(default=0)),
+                ('kind', models.CharField(choices=[(b'request', b'Request'), (b'task', b'Task')], max_length=255)),
+                ('name', models.CharField(max_length=255)),
+                ('calls', models.BigIntegerField(default=0)),
+                ('queries', models.BigIntegerField(default=0)),
+                ('db_time', models.FloatField(default=0.0)),
+                ('max_queries', models.IntegerField(default=0)),
+                ('slowest', jsonfield.fields.JSONField(default=list)),
+            ],
+            bases=(models.Model, api.models.base._FilterMixin),
+        ),
+        migrations.AlterUniqueTogether(
+            name='querystatistic',
+            unique_together=set([('kind', 'name')]),
+        ),
+    ]
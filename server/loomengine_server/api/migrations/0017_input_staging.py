@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_querystatistic'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='runinput',
+            name='staging',
+            field=models.CharField(blank=True, choices=[(b'copy', b'Copy'), (b'stream', b'Stream')], max_length=255),
+        ),
+        migrations.AddField(
+            model_name='taskattemptinput',
+            name='staging',
+            field=models.CharField(blank=True, choices=[(b'copy', b'Copy'), (b'stream', b'Stream')], max_length=255),
+        ),
+        migrations.AddField(
+            model_name='taskinput',
+            name='staging',
+            field=models.CharField(blank=True, choices=[(b'copy', b'Copy'), (b'stream', b'Stream')], max_length=255),
+        ),
+        migrations.AddField(
+            model_name='templateinput',
+            name='staging',
+            field=models.CharField(blank=True, choices=[(b'copy', b'Copy'), (b'stream', b'Stream')], max_length=255),
+        ),
+    ]
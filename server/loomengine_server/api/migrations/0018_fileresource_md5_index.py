@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import api.models.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_input_staging'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='fileresource',
+            name='md5',
+            field=models.CharField(db_index=True, max_length=32, validators=[api.models.validators.validate_md5]),
+        ),
+    ]
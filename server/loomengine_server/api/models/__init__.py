@@ -2,21 +2,58 @@ from collections import OrderedDict, defaultdict
 import hashlib
 import json
 import jinja2
+import threading
 import uuid
+from django.db.models import Count, Sum
 import loomengine_utils.md5calc
 
+from api import get_setting
+
 
 def uuidstr():
     return str(uuid.uuid4())
 
 
+_jinja_environment = jinja2.Environment(undefined=jinja2.StrictUndefined)
+_compiled_templates = OrderedDict()
+_compiled_templates_lock = threading.Lock()
+
+
+def get_compiled_template(raw_text):
+    """Returns raw_text compiled as a jinja template. Templates are kept in
+    a process-wide LRU cache keyed on the raw text, since the same command
+    is rendered for every Task in a scatter.
+    """
+    with _compiled_templates_lock:
+        template = _compiled_templates.pop(raw_text, None)
+        if template is not None:
+            _compiled_templates[raw_text] = template
+            return template
+    # Compile outside the lock. A duplicate compile in another thread
+    # is harmless.
+    template = _jinja_environment.from_string(raw_text)
+    with _compiled_templates_lock:
+        _compiled_templates[raw_text] = template
+        while len(_compiled_templates) > get_setting(
+                'JINJA_TEMPLATE_CACHE_SIZE'):
+            _compiled_templates.popitem(last=False)
+    return template
+
+
 def render_from_template(raw_text, context):
     if not raw_text:
 	return ''
-    loader = jinja2.DictLoader({'template': raw_text})
-    env = jinja2.Environment(loader=loader, undefined=jinja2.StrictUndefined)
-    template = env.get_template('template')
-    return template.render(**context)
+    return get_compiled_template(raw_text).render(**context)
+
+
+def render_many_from_template(raw_text, contexts):
+    """Renders raw_text once for each context in contexts, compiling it
+    only once.
+    """
+    if not raw_text:
+        return ['' for context in contexts]
+    template = get_compiled_template(raw_text)
+    return [template.render(**context) for context in contexts]
 
 
 def render_string_or_list(value, context):
@@ -27,7 +64,18 @@ def render_string_or_list(value, context):
         return render_from_template(value, context)
 
 
+class ContentsFingerprint(str):
+    """A hash previously returned by calculate_contents_fingerprint.
+    When nested in other contents it is used as-is rather than hashed
+    again, so stored hashes of subtrees can be combined without
+    traversing the data they were calculated from.
+    """
+    pass
+
+
 def calculate_contents_fingerprint(contents):
+    if isinstance(contents, ContentsFingerprint):
+        return str(contents)
     if isinstance(contents, dict):
         # Sort keys
         contents_string = json.dumps(
@@ -46,6 +94,44 @@ def calculate_contents_fingerprint(contents):
     return hashlib.md5(contents_string).hexdigest()
 
 
+def combine_contents_fingerprints(fingerprints):
+    # Hash of an ordered list of child hashes. Matches
+    # calculate_contents_fingerprint on a string of the frozen list,
+    # which is how DataNode branches preserve the order of their children.
+    return hashlib.md5(
+        json.dumps(list(fingerprints), separators=(',',':'))).hexdigest()
+
+
+def get_queryset_version(queryset):
+    # Row count and sum of _change counters. This changes whenever a row
+    # is created, deleted, or saved, but not on QuerySet.update().
+    # Some backends return Sum as a Decimal, so normalize to int.
+    result = queryset.aggregate(count=Count('id'), change=Sum('_change'))
+    return [result['count'], int(result['change'] or 0)]
+
+
+def combine_versions(versions):
+    # Hash of an ordered list of versions, counts, and counters
+    return hashlib.md5(json.dumps(versions)).hexdigest()
+
+
+def get_prefetch_lookups(lookups_by_field, fields=None):
+    # lookups_by_field is a list of (fieldname, [lookups]) pairs giving the
+    # related lookups needed to render each field.
+    # Returns lookups for the given fields, or for all fields if None.
+    lookups = []
+    for field, field_lookups in lookups_by_field:
+        if fields is None or field in fields:
+            lookups.extend(field_lookups)
+    return lookups
+
+
+def prefix_prefetch_lookups(prefix, lookups_by_field):
+    # Lookups to prefetch a relation and everything rendered under it
+    return [prefix] + ['%s__%s' % (prefix, lookup)
+                       for lookup in get_prefetch_lookups(lookups_by_field)]
+
+
 def flatten_nodes(node, children_fieldname, node_list=None):
     # Converts a tree to a flat list of nodes
     # Returns new list of nodes or appends to existing node_list
@@ -66,9 +152,14 @@ def copy_prefetch(
     # as a list of field names.
     # If child_field is given, traverse the tree and copy prefetch
     # data to children.
+    if not isinstance(source_nodes, dict):
+        # Index by uuid once rather than searching the list for each node
+        source_nodes_by_uuid = defaultdict(list)
+        for node in source_nodes:
+            source_nodes_by_uuid[node.uuid].append(node)
+        source_nodes = source_nodes_by_uuid
     for instance in dest_nodes:
-        uuid = instance.uuid
-        matches = filter(lambda n: n.uuid==uuid, source_nodes)
+        matches = source_nodes.get(instance.uuid, [])
         assert len(matches) == 1, 'no unique match found'
         if hasattr(matches[0], '_prefetched_objects_cache'):
             if not hasattr(instance, '_prefetched_objects_cache'):
@@ -98,8 +189,11 @@ class positiveIntegerDefaultDict(defaultdict):
 
 from .data_objects import *
 from .data_nodes import *
+from .id_sequences import *
 from .labels import *
+from .query_statistics import *
 from .runs import *
+from .run_submissions import *
 from .tags import *
 from .task_attempts import *
 from .tasks import *
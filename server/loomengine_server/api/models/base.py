@@ -1,5 +1,8 @@
+import bisect
+from collections import defaultdict
 import django.db.utils
 from django.db import models, transaction
+from django.db.models import Q
 import re
 
 from api.exceptions import ConcurrentModificationError, SaveRetriesExceededError
@@ -24,32 +27,18 @@ class FilterHelper(object):
     def __init__(self, Model):
         self.Model = Model
 
+    QUERY_CHUNK_SIZE = 500
+
     def filter_multiple_by_name_or_id_or_tag_or_hash(
             self, query_strings, queryset=None):
         assert isinstance(query_strings, (list, set))
         query_strings = set(query_strings)
         if len(query_strings) == 0:
             return {}
-        results = self.Model.objects.none()
-        for query_string in query_strings:
-            results = results | self.filter_by_name_or_id_or_tag_or_hash(
-                query_string, queryset=queryset)
-        return self._sort_by_name_or_id_or_tag_or_hash(
-            query_strings, results)
-
-    def _sort_by_name_or_id_or_tag_or_hash(self, query_strings, results):
-        models = [r for r in results]
-        sorted_results = {}
-        for query_string in query_strings:
-            name, uuid, tag, hash_value \
-                = self._parse_as_name_or_id_or_tag_or_hash(query_string)
-            matches = list(filter(
-                lambda model: self._does_model_match(
-                    model, name=name, uuid=uuid,
-                    tag=tag, hash_value=hash_value),
-                results))
-            sorted_results[query_string] = matches
-        return sorted_results
+        return self._filter_multiple(dict(
+            (query_string,
+             self._parse_as_name_or_id_or_tag_or_hash(query_string))
+            for query_string in query_strings), queryset=queryset)
 
     def filter_multiple_by_name_or_id_or_tag(
             self, query_strings, queryset=None):
@@ -57,46 +46,110 @@ class FilterHelper(object):
         query_strings = set(query_strings)
         if len(query_strings) == 0:
             return {}
-        results = self.Model.objects.none()
-        for query_string in query_strings:
-            results = results | self.filter_by_name_or_id_or_tag(
-                query_string, queryset=queryset)
-        return self._sort_by_name_or_id_or_tag(
-            query_strings, results)
-
-    def _sort_by_name_or_id_or_tag(self, query_strings, results):
-        models = [r for r in results]
-        sorted_results = {}
+        parsed_queries = {}
         for query_string in query_strings:
             name, uuid, tag = self._parse_as_name_or_id_or_tag(query_string)
-            matches = list(filter(
-                lambda model: self._does_model_match(
-                    model, name=name, uuid=uuid,
-                    tag=tag),
-                results))
-            sorted_results[query_string] = matches
-        return sorted_results
-
-    @classmethod
-    def _does_model_match(cls, model, name=None, uuid=None, tag=None, hash_value=None):
-        if name and not cls._get_field_value(
-                model, model.NAME_FIELD)==name:
-            return False
-        if uuid and not cls._get_field_value(
-                model, model.ID_FIELD).startswith(uuid):
-            return False
-        if tag and not tag in [t.tag for t in model.tags.all()]:
-            return False
-        if hash_value and not cls._get_field_value(model, model.HASH_FIELD)==hash_value:
-            return False
-        return True
-
-    @classmethod
-    def _get_field_value(cls, model, field):
-        value = model
-        for attr in field.split('__'):
-            value = getattr(value, attr)
-        return value
+            parsed_queries[query_string] = (name, uuid, tag, None)
+        return self._filter_multiple(parsed_queries, queryset=queryset)
+
+    def _filter_multiple(self, parsed_queries, queryset=None):
+        """Finds the matches for many queries with a few grouped db queries.
+        parsed_queries is a dict of (name, uuid, tag, hash_value) by
+        query string. Candidates for all queries are fetched together,
+        then matched to each query through in-memory indexes.
+        Returns a dict of lists of models by query string.
+        """
+        if queryset is None:
+            queryset = self.Model.objects.all()
+        index = _CandidateIndex(
+            self._get_candidates(parsed_queries.values(), queryset))
+        matches = {}
+        for query_string, (name, uuid, tag, hash_value) \
+            in parsed_queries.iteritems():
+            matches[query_string] = index.match(
+                name=name, uuid=uuid, tag=tag, hash_value=hash_value)
+        models = self._get_models_by_id(
+            set(id for ids in matches.values() for id in ids), queryset)
+        return dict(
+            (query_string, [models[id] for id in sorted(ids)])
+            for query_string, ids in matches.iteritems())
+
+    def _get_candidates(self, parsed_queries, queryset):
+        # Returns (id, uuid, name, hash_value, tags) for every model
+        # that might match one of the queries
+        fields = [self.Model.ID_FIELD, self.Model.NAME_FIELD,
+                  self.Model.TAG_FIELD]
+        if self.Model.HASH_FIELD:
+            fields.append(self.Model.HASH_FIELD)
+        candidates = {}
+        for filter_q in self._get_candidate_filters(parsed_queries, queryset):
+            for row in queryset.filter(filter_q).values_list('id', *fields):
+                if self.Model.HASH_FIELD:
+                    (id, uuid, name, tag, hash_value) = row
+                else:
+                    (id, uuid, name, tag) = row
+                    hash_value = None
+                candidate = candidates.setdefault(
+                    id, (id, uuid, name, hash_value, set()))
+                if tag is not None:
+                    candidate[4].add(tag)
+        return candidates.values()
+
+    def _get_candidate_filters(self, parsed_queries, queryset):
+        # Each query is looked up by its most selective part.
+        # The other parts are checked in memory.
+        uuids = set()
+        names = set()
+        hashes = set()
+        tags = set()
+        for (name, uuid, tag, hash_value) in parsed_queries:
+            if uuid:
+                uuids.add(uuid)
+            elif name:
+                names.add(name)
+            elif hash_value:
+                hashes.add(hash_value)
+            elif tag:
+                tags.add(tag)
+            else:
+                # An empty query matches everything
+                return [Q()]
+        filters = []
+        filters.extend(self._get_prefix_filters(
+            self.Model.ID_FIELD, uuids, queryset))
+        filters.extend(self._get_prefix_filters(
+            self.Model.HASH_FIELD, hashes, queryset))
+        for chunk in _iter_chunks(names, self.QUERY_CHUNK_SIZE):
+            filters.append(Q(**{self.Model.NAME_FIELD+'__in': chunk}))
+        for chunk in _iter_chunks(tags, self.QUERY_CHUNK_SIZE):
+            filters.append(Q(**{self.Model.TAG_FIELD+'__in': chunk}))
+        return filters
+
+    def _get_prefix_filters(self, field, prefixes, queryset):
+        # IDs and hashes are usually given in full, so they are looked up
+        # exactly first. They have a fixed length, so a value that matches
+        # exactly is not a prefix of any other. The rest are truncated.
+        filters = []
+        found = set()
+        for chunk in _iter_chunks(prefixes, self.QUERY_CHUNK_SIZE):
+            filters.append(Q(**{field+'__in': chunk}))
+            found.update(queryset.filter(filters[-1])\
+                         .values_list(field, flat=True))
+        for chunk in _iter_chunks(
+                prefixes.difference(found), self.QUERY_CHUNK_SIZE):
+            filter_q = Q()
+            for prefix in chunk:
+                filter_q |= Q(**{field+'__startswith': prefix})
+            filters.append(filter_q)
+        return filters
+
+    def _get_models_by_id(self, ids, queryset):
+        models = {}
+        for chunk in _iter_chunks(ids, self.QUERY_CHUNK_SIZE):
+            for model in self.Model._prefetch_for_filter(
+                    queryset.filter(id__in=chunk)):
+                models[model.id] = model
+        return models
 
     def filter_by_name_or_id_or_tag_or_hash(self, query_string, queryset=None):
         assert self.Model.NAME_FIELD, \
@@ -179,6 +232,74 @@ class FilterHelper(object):
         return name, uuid, tag
 
 
+def _iter_chunks(iterable, chunk_size):
+    # Imported here since input_calculator depends on models using this module
+    from api.models.input_calculator import iter_chunks
+    return iter_chunks(iterable, chunk_size)
+
+
+class _CandidateIndex(object):
+    """Indexes (id, uuid, name, hash_value, tags) tuples for FilterHelper,
+    so each query is matched without comparing it to every candidate.
+    IDs and hashes may be truncated, so they are kept sorted and matched
+    by prefix.
+    """
+
+    def __init__(self, candidates):
+        self._candidates = {}
+        self._by_name = defaultdict(list)
+        self._by_tag = defaultdict(list)
+        self._sorted_uuids = []
+        self._sorted_hashes = []
+        for candidate in candidates:
+            (id, uuid, name, hash_value, tags) = candidate
+            self._candidates[id] = candidate
+            self._by_name[name].append(id)
+            for tag in tags:
+                self._by_tag[tag].append(id)
+            self._sorted_uuids.append((uuid, id))
+            if hash_value:
+                self._sorted_hashes.append((hash_value, id))
+        self._sorted_uuids.sort()
+        self._sorted_hashes.sort()
+
+    def match(self, name=None, uuid=None, tag=None, hash_value=None):
+        """Returns the ids of candidates that match all given values
+        """
+        if uuid:
+            ids = self._match_prefix(self._sorted_uuids, uuid)
+        elif name:
+            ids = self._by_name.get(name, [])
+        elif hash_value:
+            ids = self._match_prefix(self._sorted_hashes, hash_value)
+        elif tag:
+            ids = self._by_tag.get(tag, [])
+        else:
+            ids = self._candidates.keys()
+        return [id for id in ids if self._does_candidate_match(
+            self._candidates[id], name, uuid, tag, hash_value)]
+
+    def _match_prefix(self, sorted_values, prefix):
+        ids = []
+        i = bisect.bisect_left(sorted_values, (prefix,))
+        while i < len(sorted_values) and sorted_values[i][0].startswith(prefix):
+            ids.append(sorted_values[i][1])
+            i += 1
+        return ids
+
+    def _does_candidate_match(self, candidate, name, uuid, tag, hash_value):
+        (id, candidate_uuid, candidate_name, candidate_hash, tags) = candidate
+        if name and candidate_name != name:
+            return False
+        if uuid and not candidate_uuid.startswith(uuid):
+            return False
+        if tag and tag not in tags:
+            return False
+        if hash_value and not (candidate_hash or '').startswith(hash_value):
+            return False
+        return True
+
+
 class _FilterMixin(object):
 
     NAME_FIELD = None
@@ -218,6 +339,16 @@ class _FilterMixin(object):
 class BaseModel(models.Model, _FilterMixin):
     _change = models.IntegerField(default=0)
 
+    # If True, ids are reserved from IdSequence instead of assigned by the
+    # database, so that new objects can be given ids with allocate_ids and
+    # saved with bulk_create without being reloaded.
+    PREASSIGN_IDS = False
+
+    # Fields that are changed only with queryset updates, for example to
+    # use as a lock. Saving an existing object does not write them, so
+    # saving a stale instance cannot overwrite their current values.
+    UPDATE_ONLY_FIELDS = ()
+
     class Meta:
         abstract = True
         app_label = 'api'
@@ -236,7 +367,23 @@ class BaseModel(models.Model, _FilterMixin):
             if not rows:
                 raise ConcurrentModificationError(cls.__name__, self.pk)
             self._change += 1
-
+            if cls.UPDATE_ONLY_FIELDS and 'update_fields' not in kwargs:
+                kwargs['update_fields'] = [
+                    field.name for field in cls._meta.concrete_fields
+                    if not field.primary_key
+                    and field.name not in cls.UPDATE_ONLY_FIELDS]
+        elif cls.PREASSIGN_IDS:
+            cls.allocate_ids([self])
+            kwargs['force_insert'] = True
+            try:
+                return self._save_with_retries(*args, **kwargs)
+            except Exception:
+                # Not saved, so the next save must insert again
+                self.pk = None
+                raise
+        return self._save_with_retries(*args, **kwargs)
+
+    def _save_with_retries(self, *args, **kwargs):
         count = 0
         max_retries=3
         while True:
@@ -247,6 +394,33 @@ class BaseModel(models.Model, _FilterMixin):
                     raise
                 count += 1
 
+    @classmethod
+    def allocate_ids(cls, instances):
+        """Assigns ids to unsaved instances of a model with PREASSIGN_IDS
+        """
+        from api.models.id_sequences import IdSequence
+        assert cls.PREASSIGN_IDS, \
+            'PREASSIGN_IDS is not set on model %s' % cls.__name__
+        unsaved = [instance for instance in instances if instance.pk is None]
+        if not unsaved:
+            return
+        ids = IdSequence.get_ids(cls, len(unsaved))
+        for instance, id in zip(unsaved, ids):
+            instance.pk = id
+
+    @classmethod
+    def bulk_create_with_ids(cls, instances):
+        """bulk_create instances that were given ids by allocate_ids.
+        Django marks only instances without ids as saved after bulk_create,
+        so these are marked here. Otherwise full_clean on a later save
+        would find that their ids already exist.
+        """
+        cls.objects.bulk_create(instances)
+        db = cls.objects.db
+        for instance in instances:
+            instance._state.adding = False
+            instance._state.db = db
+
     def setattrs_and_save_with_retries(self, assignments, max_retries=5):
         """
         If the object is being edited by other processes,
@@ -287,3 +461,29 @@ class BaseModel(models.Model, _FilterMixin):
                 if count >= max_retries:
                     raise
                 count += 1
+
+
+class InvalidatesRepresentationMixin(object):
+    """For models such as tags and labels that belong to another object.
+    Saving or deleting them invalidates the cached representation of the
+    object named by TARGET_FIELD.
+    """
+    TARGET_FIELD = None
+
+    def save(self, *args, **kwargs):
+        result = super(InvalidatesRepresentationMixin, self).save(
+            *args, **kwargs)
+        self._invalidate_target_representation()
+        return result
+
+    def delete(self, *args, **kwargs):
+        result = super(InvalidatesRepresentationMixin, self).delete(
+            *args, **kwargs)
+        self._invalidate_target_representation()
+        return result
+
+    def _invalidate_target_representation(self):
+        from api import representation_cache
+        target = getattr(self, self.TARGET_FIELD)
+        if target is not None:
+            representation_cache.invalidate(target)
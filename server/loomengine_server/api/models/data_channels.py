@@ -23,6 +23,14 @@ input/output ports on Runs, Templates, and Tasks.
 
 
 class DataChannel(BaseModel):
+
+    # How the worker gives a file input to the task. With "copy" or blank,
+    # the file is copied into the working dir before the task starts.
+    # With "stream", it is written to a named pipe while the task runs.
+    # Only file inputs without gather can be streamed. Others are copied.
+    STAGING_CHOICES = (('copy', 'Copy'),
+                       ('stream', 'Stream'))
+
     channel = models.CharField(max_length=255)
     data_node = models.ForeignKey(
         'DataNode',
@@ -1,3 +1,4 @@
+from collections import OrderedDict
 import copy
 import json
 from django.core.exceptions import ObjectDoesNotExist
@@ -5,10 +6,10 @@ import django.db
 from django.db import models
 
 from . import calculate_contents_fingerprint, flatten_nodes, \
-    copy_prefetch
+    copy_prefetch, combine_contents_fingerprints, ContentsFingerprint
 from .base import BaseModel
 from .data_objects import DataObject
-from api import get_setting, reload_models, connect_data_nodes_to_parents
+from api import get_setting
 from api.models import uuidstr
 from api.models import validators
 
@@ -51,6 +52,8 @@ class DegreeMismatchException(Exception):
 
 class DataNode(BaseModel):
 
+    PREASSIGN_IDS = True
+
     uuid = models.CharField(default=uuidstr,
                             unique=True, max_length=255)
     tree_id = models.CharField(default=uuidstr, max_length=255)
@@ -74,6 +77,10 @@ class DataNode(BaseModel):
     type = models.CharField(
         max_length=255,
         choices=DataObject.DATA_TYPE_CHOICES)
+    # Hash of the data below this node. Set once the subtree is complete.
+    contents_fingerprint = models.CharField(
+        null=True, blank=True, max_length=32,
+        validators=[validators.validate_md5])
 
     EMPTY_BRANCH_VALUE = []
 
@@ -384,17 +391,20 @@ class DataNode(BaseModel):
             if save:
                 clone.setattrs_and_save_with_retries({
                     'degree': self.degree,
-                    'data_object': self.data_object})
+                    'data_object': self.data_object,
+                    'contents_fingerprint': self.contents_fingerprint})
             else:
                 clone.degree = self.degree
                 clone.data_object = self.data_object
+                clone.contents_fingerprint = self.contents_fingerprint
         else:
             clone = DataNode(
                 parent=parent,
                 index=self.index,
                 degree=self.degree,
                 data_object=self.data_object,
-                type=self.type)
+                type=self.type,
+                contents_fingerprint=self.contents_fingerprint)
             if save:
                 clone.full_clean()
                 clone.save()
@@ -411,21 +421,33 @@ class DataNode(BaseModel):
             return self.clone(save=save)
 
         leaves = self._get_leaves()
+        leaf_fingerprints = self._get_leaf_fingerprints(leaves)
+        if leaf_fingerprints:
+            contents_fingerprint = combine_contents_fingerprints(
+                leaf_fingerprints)
+        else:
+            contents_fingerprint = None
 
         clone = DataNode(
             degree=len(leaves),
-            type=self.type)
+            type=self.type,
+            contents_fingerprint=contents_fingerprint)
         if save:
             clone.full_clean()
             clone.save()
 
         index_counter = 0
         for leaf in leaves:
+            if leaf_fingerprints:
+                leaf_fingerprint = leaf_fingerprints[index_counter]
+            else:
+                leaf_fingerprint = None
             data_node = DataNode(
                 parent=clone,
                 index=index_counter,
                 data_object=leaf.data_object,
-                type=leaf.type)
+                type=leaf.type,
+                contents_fingerprint=leaf_fingerprint)
             if save:
                 data_node.full_clean()
                 data_node.save()
@@ -433,6 +455,21 @@ class DataNode(BaseModel):
             clone._add_unsaved_child(data_node)
         return clone
 
+    def get_flat_node(self, save=False):
+        """Returns a node with the same leaves as self and no more than one
+        level of branching. If self is already flat it is returned as-is,
+        so that Tasks and TaskAttempts share the existing DataNodes rather
+        than writing new ones. Otherwise a flattened_clone is made.
+        """
+        if self.is_flat():
+            return self
+        return self.flattened_clone(save=save)
+
+    def is_flat(self):
+        if self.is_leaf:
+            return True
+        return all([child.is_leaf for child in self.get_children()])
+
     def _get_leaves(self):
         if self.is_leaf:
             return [self]
@@ -442,12 +479,56 @@ class DataNode(BaseModel):
             leaves.extend(child._get_leaves())
         return leaves
 
+    @classmethod
+    def _get_leaf_fingerprints(cls, leaves):
+        # Returns None unless every leaf has data to fingerprint
+        if not leaves:
+            return None
+        if any([leaf.data_object is None for leaf in leaves]):
+            return None
+        return [leaf.data_object.get_contents_fingerprint()
+                for leaf in leaves]
+
     def calculate_contents_fingerprint(self):
         return calculate_contents_fingerprint(
             self.get_fingerprintable_contents())
 
     def get_fingerprintable_contents(self):
-        return {'contents': self._get_fingerprintable_data_node_struct()}
+        return {'contents': ContentsFingerprint(
+            self.get_contents_fingerprint())}
+
+    def get_contents_fingerprint(self):
+        """Returns the same value as
+        calculate_contents_fingerprint(self._get_fingerprintable_data_node_struct())
+        Leaves use the hash stored on the DataObject, and branches combine
+        the hashes of their children. The result is stored once the subtree
+        is complete, so later calls do not traverse the tree.
+        """
+        if self.contents_fingerprint:
+            return self.contents_fingerprint
+        assert not self._is_blank_node(), 'Node not ready. No fingerprint.'
+        assert not self._is_empty_branch(), 'Node not ready. No fingerprint.'
+        if self.is_leaf:
+            fingerprint = self.data_object.get_contents_fingerprint()
+            is_complete = True
+        else:
+            children = self.get_children()
+            fingerprint = combine_contents_fingerprints(
+                [child.get_contents_fingerprint() for child in children])
+            # A child stores its fingerprint only if its subtree is complete
+            is_complete = len(children) == self.degree and all(
+                [child.contents_fingerprint for child in children])
+        if is_complete:
+            self._save_contents_fingerprint(fingerprint)
+        return fingerprint
+
+    def _save_contents_fingerprint(self, fingerprint):
+        self.contents_fingerprint = fingerprint
+        if self.id is not None:
+            # Use update() rather than save() since this is derived data
+            # and should not conflict with concurrent edits to the model.
+            DataNode.objects.filter(id=self.id).update(
+                contents_fingerprint=fingerprint)
 
     def _get_fingerprintable_data_node_struct(self):
         assert not self._is_blank_node(), 'Node not ready. No fingerprint.'
@@ -509,23 +590,33 @@ class DataNode(BaseModel):
 
     @classmethod
     def save_list_with_children(cls, root_instances):
-        unsorted_data_nodes, parent_child_relationships \
-            = cls._strip_parent_child_relationships(root_instances)
-        unsaved_data_nodes = {}
+        # New nodes are given ids before they are saved, so links to their
+        # parents are written by bulk_create. Parents come before children.
+        data_nodes, parent_child_relationships \
+            = cls._flatten_parent_child_relationships(root_instances)
+        unsaved_data_nodes = []
         preexisting_data_nodes = {}
-        for data_node in unsorted_data_nodes.values():
+        for data_node in data_nodes.values():
             if data_node.id is not None:
                 preexisting_data_nodes[data_node.uuid] = data_node
             else:
-                unsaved_data_nodes[data_node.uuid] = data_node
-        bulk_data_nodes = DataNode.objects.bulk_create(unsaved_data_nodes.values())
-        new_data_nodes = reload_models(DataNode, bulk_data_nodes)
-        all_data_nodes = [n for n in new_data_nodes]
-        all_data_nodes.extend(preexisting_data_nodes.values())
-        connect_data_nodes_to_parents(all_data_nodes, parent_child_relationships)
+                unsaved_data_nodes.append(data_node)
+        cls.allocate_ids(unsaved_data_nodes)
+        moved_data_nodes = []
+        for parent_uuid, child_uuid in parent_child_relationships:
+            child = data_nodes[child_uuid]
+            parent = data_nodes[parent_uuid]
+            if child.parent_id != parent.id:
+                if child.uuid in preexisting_data_nodes:
+                    moved_data_nodes.append(child)
+                child.parent = parent
+        DataNode.bulk_create_with_ids(unsaved_data_nodes)
+        for data_node in moved_data_nodes:
+            DataNode.objects.filter(id=data_node.id).update(
+                parent_id=data_node.parent_id)
         cls._update_degree(preexisting_data_nodes)
         cls._update_data_object(preexisting_data_nodes)
-        return all_data_nodes
+        return data_nodes.values()
 
     @classmethod
     def _update_degree(cls, preexisting_data_nodes):
@@ -560,13 +651,15 @@ class DataNode(BaseModel):
                 cursor.execute(sql)
 
     @classmethod
-    def _strip_parent_child_relationships(cls, instances):
-        flattened_instances = {}
+    def _flatten_parent_child_relationships(cls, instances):
+        # Returns nodes by uuid, each parent before its children,
+        # and a list of (parent_uuid, child_uuid)
+        flattened_instances = OrderedDict()
         parent_child_relationships = []
         if isinstance(instances, list):
             for item in instances:
                 item_instances, item_relationships \
-                    = cls._strip_parent_child_relationships(item)
+                    = cls._flatten_parent_child_relationships(item)
                 flattened_instances.update(item_instances)
                 parent_child_relationships.extend(item_relationships)
         else:
@@ -575,9 +668,8 @@ class DataNode(BaseModel):
             children = parent.get_children()
             for child in children:
                 child_instances, child_relationships \
-                    = cls._strip_parent_child_relationships(child)
+                    = cls._flatten_parent_child_relationships(child)
                 flattened_instances.update(child_instances)
                 parent_child_relationships.extend(child_relationships)
                 parent_child_relationships.append((parent.uuid, child.uuid))
-                child.parent = None
         return flattened_instances, parent_child_relationships
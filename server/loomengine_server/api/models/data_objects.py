@@ -1,5 +1,5 @@
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
 import jsonfield
 import os
@@ -26,6 +26,7 @@ for traceability.
 
 class DataObject(BaseModel):
 
+    PREASSIGN_IDS = True
     NAME_FIELD = 'file_resource__filename'
     HASH_FIELD = 'file_resource__md5'
     ID_FIELD = 'uuid'
@@ -47,6 +48,15 @@ class DataObject(BaseModel):
     datetime_created = models.DateTimeField(
         default=timezone.now)
     data = jsonfield.JSONField(blank=True)
+    contents_fingerprint = models.CharField(
+        null=True, blank=True, max_length=32,
+        validators=[validators.validate_md5])
+
+    # Incremented to invalidate cached representations.
+    # See api/representation_cache.py
+    representation_generation = models.IntegerField(default=0)
+
+    UPDATE_ONLY_FIELDS = ('representation_generation',)
 
     def clean(self):
         validators.DataObjectValidator.validate_model(self)
@@ -87,23 +97,40 @@ class DataObject(BaseModel):
     def _get_file_by_value(cls, value):
         """Look up a file DataObject by name, uuid, and/or md5.
         """
-        # Ignore any FileResource with no DataObject. This is a typical state
+        return cls.get_files_by_values([value])[value]
+
+    @classmethod
+    def get_files_by_values(cls, values):
+        """Look up file DataObjects for many references to name, uuid,
+        and/or md5 at once. Returns a dict of DataObjects by reference.
+        Every reference that matches no file or more than one file is
+        reported in a single ValidationError.
+        """
+        # Ignore any DataObject with no FileResource. This is a typical state
         # for a deleted file that has not yet been cleaned up.
-        queryset = FileResource.objects.exclude(data_object__isnull=True)
-        matches = FileResource.filter_by_name_or_id_or_tag_or_hash(
-            value, queryset=queryset)
-        if matches.count() == 0:
-            raise ValidationError(
-                'No file found that matches value "%s"' % value)
-        elif matches.count() > 1:
-            match_id_list = ['%s@%s' % (match.filename, match.get_uuid())
-                             for match in matches]
-            match_id_string = ('", "'.join(match_id_list))
-            raise ValidationError(
-                'Multiple files were found matching value "%s": "%s". '\
-                'Use a more precise identifier to select just one file.' % (
-                    value, match_id_string))
-        return matches.first().data_object
+        queryset = cls.objects.filter(type='file', file_resource__isnull=False)
+        matches = cls.filter_multiple_by_name_or_id_or_tag_or_hash(
+            set(values), queryset=queryset)
+        errors = []
+        data_objects = {}
+        for value in sorted(matches.keys()):
+            if len(matches[value]) == 0:
+                errors.append(
+                    'No file found that matches value "%s"' % value)
+            elif len(matches[value]) > 1:
+                match_id_list = ['%s@%s' % (match.file_resource.filename,
+                                            match.uuid)
+                                 for match in matches[value]]
+                match_id_string = ('", "'.join(match_id_list))
+                errors.append(
+                    'Multiple files were found matching value "%s": "%s". '\
+                    'Use a more precise identifier to select just one file.' % (
+                        value, match_id_string))
+            else:
+                data_objects[value] = matches[value][0]
+        if errors:
+            raise ValidationError(errors)
+        return data_objects
 
     @property
     def _value_info(self):
@@ -244,6 +271,19 @@ class DataObject(BaseModel):
             node.delete()
 
             
+    def get_version(self):
+        if self.type != 'file' or self.file_resource is None:
+            return str(self._change)
+        return '%s.%s' % (self._change, self.file_resource._change)
+
+    def get_representation_version(self):
+        """Returns None until the DataObject is complete and no longer changes
+        """
+        if self.type == 'file' and (
+                self.file_resource is None or not self.file_resource.is_ready):
+            return None
+        return self.get_version()
+
     def get_fingerprintable_contents(self):
         if self.type == 'file':
             return {
@@ -258,6 +298,22 @@ class DataObject(BaseModel):
         return calculate_contents_fingerprint(
             self.get_fingerprintable_contents())
 
+    def get_contents_fingerprint(self):
+        """Same value as calculate_contents_fingerprint, but stored after
+        the first call. Contents of a DataObject never change once it has
+        a value, so the stored hash does not need to be invalidated.
+        """
+        if self.contents_fingerprint:
+            return self.contents_fingerprint
+        fingerprint = self.calculate_contents_fingerprint()
+        self.contents_fingerprint = fingerprint
+        if self.id is not None:
+            # Use update() rather than save() since this is derived data
+            # and should not conflict with concurrent edits to the model.
+            DataObject.objects.filter(id=self.id).update(
+                contents_fingerprint=fingerprint)
+        return fingerprint
+
     @classmethod
     def _prefetch_for_filter(cls, queryset=None):
         if queryset is None:
@@ -295,7 +351,7 @@ class FileResource(BaseModel):
     file_relative_path = models.TextField(
         validators=[validators.validate_relative_file_path], default='', blank=True)
     md5 = models.CharField(
-        max_length=32, validators=[validators.validate_md5])
+        max_length=32, validators=[validators.validate_md5], db_index=True)
     import_comments = models.TextField(blank=True)
     imported_from_url = models.TextField(
         blank=True,
@@ -326,19 +382,91 @@ class FileResource(BaseModel):
     @classmethod
     def initialize(cls, **kwargs):
         if not kwargs.get('file_url'):
-            file_root = cls.get_file_root()
-            if not kwargs.get('file_relative_path'):
-                file_relative_path = cls._get_relative_path_for_import(
-                    kwargs.get('filename'),
-                    kwargs.get('source_type'),
-                    kwargs.get('data_object'),
-                    kwargs.pop('task_attempt', None)
-                )
-                kwargs['file_relative_path']  = file_relative_path
-            kwargs['file_url'] = os.path.join(file_root, kwargs['file_relative_path'])
+            task_attempt = kwargs.pop('task_attempt', None)
+            file_relative_path = kwargs.pop('file_relative_path', None)
+            stored_file = cls._get_stored_file(kwargs.get('md5'))
+            if stored_file is not None:
+                # Share the file that is already in storage,
+                # so that it is not uploaded again
+                file_resource = cls(
+                    file_url=stored_file.file_url,
+                    file_relative_path=stored_file.file_relative_path,
+                    upload_status='complete',
+                    **kwargs)
+                # The stored file may be deleted before this is saved,
+                # so save checks again. See _save_shared_file.
+                file_resource._upload_path_args = (
+                    file_relative_path, task_attempt)
+                return file_resource
+            file_resource = cls(**kwargs)
+            file_resource._set_upload_path(file_relative_path, task_attempt)
+            return file_resource
         file_resource = cls(**kwargs)
         return file_resource
 
+    def _set_upload_path(self, file_relative_path, task_attempt):
+        if not file_relative_path:
+            file_relative_path = self._get_relative_path_for_import(
+                self.filename,
+                self.source_type,
+                self.data_object,
+                task_attempt
+            )
+        self.file_relative_path = file_relative_path
+        self.file_url = os.path.join(self.get_file_root(), file_relative_path)
+
+    def save(self, *args, **kwargs):
+        if self._state.adding and hasattr(self, '_upload_path_args'):
+            return self._save_shared_file(*args, **kwargs)
+        return super(FileResource, self).save(*args, **kwargs)
+
+    def _save_shared_file(self, *args, **kwargs):
+        with transaction.atomic():
+            # Takes the same locks as delete_if_file_is_shared, so
+            # the file is not found unused while this is being saved.
+            sharing = list(FileResource.objects.select_for_update().filter(
+                md5=self.md5, file_url=self.file_url,
+                upload_status='complete').order_by('id'))
+            if not sharing:
+                # The stored file was deleted after initialize found it.
+                # Upload the file again.
+                self._set_upload_path(*self._upload_path_args)
+                self.upload_status = 'incomplete'
+            del self._upload_path_args
+            return super(FileResource, self).save(*args, **kwargs)
+
+    @classmethod
+    def _get_stored_file(cls, md5):
+        """Returns a FileResource whose file in storage has the given md5,
+        or None. Linked files are not shared, since they are outside storage.
+        """
+        if not md5 or not get_setting('DEDUPLICATE_FILE_UPLOADS'):
+            return None
+        return cls.objects.filter(
+            md5=md5,
+            upload_status='complete',
+            link=False,
+            file_url__startswith=cls.get_file_root()).order_by('id').first()
+
+    def delete_if_file_is_shared(self):
+        """If another FileResource shares this one's file, delete this one
+        and return True. Otherwise return False and keep this one, so that
+        it can be deleted after its file. If deleting the file fails, the
+        FileResource is still there to try again.
+        """
+        with transaction.atomic():
+            # Lock all FileResources that share the file, in a fixed order.
+            # Of two being deleted at once, the second will find
+            # the first already gone. Files that share a URL always have
+            # the same md5, and filtering on the indexed md5 locks only
+            # the rows with that md5.
+            sharing = list(FileResource.objects.select_for_update().filter(
+                md5=self.md5, file_url=self.file_url).order_by('id'))
+            if all(file_resource.id == self.id for file_resource in sharing):
+                return False
+            self.delete()
+        return True
+
     @classmethod
     def _get_relative_path_for_import(
             cls, filename, source_type, data_object, task_attempt):
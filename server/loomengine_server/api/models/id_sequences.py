@@ -0,0 +1,90 @@
+import os
+import threading
+from django.db import models, transaction, IntegrityError
+from django.db.models import F, Max
+
+from .base import BaseModel
+
+
+# Ids reserved at a time by each process for its own saves, so that most
+# saves do not touch the shared IdSequence row
+ID_BLOCK_SIZE = 100
+
+# {table name: (pid, next_id, end)} for the block this process is using.
+# The pid detects blocks inherited by a forked worker.
+_id_blocks = {}
+_id_blocks_lock = threading.Lock()
+
+
+class IdSequence(BaseModel):
+    """The next unused primary key for a model with PREASSIGN_IDS.
+    Ids for these models are always reserved here rather than assigned
+    by the database, so objects can be given ids before they are saved
+    and bulk_create can write foreign keys to them directly.
+    """
+
+    name = models.CharField(max_length=255, unique=True)
+    next_id = models.BigIntegerField()
+
+    @classmethod
+    def get_ids(cls, model_class, count):
+        """Returns a list of count unused ids for model_class.
+        Small requests outside a transaction are served from a block of
+        ids reserved by this process.
+        """
+        name = model_class._meta.db_table
+        ids = cls._take_from_block(name, count)
+        if ids is not None:
+            return ids
+        if count >= ID_BLOCK_SIZE \
+           or transaction.get_connection().in_atomic_block:
+            # Ids reserved in a transaction are released if it is rolled
+            # back, so none are kept for later
+            first_id = cls.reserve(model_class, count)
+            return range(first_id, first_id + count)
+        first_id = cls.reserve(model_class, ID_BLOCK_SIZE)
+        with _id_blocks_lock:
+            _id_blocks[name] = (
+                os.getpid(), first_id + count, first_id + ID_BLOCK_SIZE)
+        return range(first_id, first_id + count)
+
+    @classmethod
+    def _take_from_block(cls, name, count):
+        with _id_blocks_lock:
+            block = _id_blocks.get(name)
+            if block is None:
+                return None
+            pid, next_id, end = block
+            if pid != os.getpid() or end - next_id < count:
+                return None
+            _id_blocks[name] = (pid, next_id + count, end)
+        return range(next_id, next_id + count)
+
+    @classmethod
+    def reserve(cls, model_class, count):
+        """Reserves count consecutive ids for model_class and returns the first
+        """
+        name = model_class._meta.db_table
+        # The update locks the row until the end of the transaction, so
+        # the value read after it includes only this reservation
+        with transaction.atomic(savepoint=False):
+            sequences = cls.objects.filter(name=name)
+            if not sequences.update(next_id=F('next_id') + count):
+                cls._create(model_class, name)
+                sequences.update(next_id=F('next_id') + count)
+            next_id = sequences.values_list('next_id', flat=True).get()
+        return next_id - count
+
+    @classmethod
+    def _create(cls, model_class, name):
+        # Start after any ids assigned before this sequence existed
+        max_id = model_class.objects.aggregate(Max('id'))['id__max'] or 0
+        # A block from an earlier sequence for this table is not safe to use
+        with _id_blocks_lock:
+            _id_blocks.pop(name, None)
+        try:
+            with transaction.atomic():
+                cls.objects.create(name=name, next_id=max_id + 1)
+        except IntegrityError:
+            # Created by another process
+            pass
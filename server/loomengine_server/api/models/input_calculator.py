@@ -1,4 +1,4 @@
-import copy
+import itertools
 import re
 
 from data_nodes import DegreeMismatchError
@@ -43,6 +43,10 @@ cross-products across inputs. A dot-product is performed for all inputs
 in the same group (and all are required to have the same number of 
 iterations). A cross-product is performed between all groups, with the 
 order of the cross-product corresponding to the order of group numbers.
+
+InputSets are produced lazily by iter_input_sets, so a large cross-product
+can be consumed in chunks without holding every InputSet in memory.
+Data paths are kept internally as tuples of (index, degree) pairs.
 """
 
 
@@ -79,8 +83,10 @@ class InputCalculator(object):
         self.generator = combined_generator
 
     def get_input_sets(self):
-        seed_path = []
-        return self.generator.get_input_sets(seed_path)
+        return list(self.iter_input_sets())
+
+    def iter_input_sets(self):
+        return self.generator.iter_input_sets(())
 
 
 class InputSetGeneratorNode(object):
@@ -125,10 +131,11 @@ class InputSetGeneratorNode(object):
         generator = InputSetGeneratorNode()
         for (data_path, data_node) in data_channel.get_ready_data_nodes(
                 [], gather_depth):
-            flat_data_node = data_node.flattened_clone(save=False)
+            flat_data_node = data_node.get_flat_node(save=False)
             input_item = InputItem(
                 flat_data_node, data_channel.channel,
-                data_channel.as_channel, mode=data_channel.mode)
+                data_channel.as_channel, mode=data_channel.mode,
+                staging=data_channel.staging)
             generator._add_input_item(data_path, input_item)
         return generator
 
@@ -149,28 +156,25 @@ class InputSetGeneratorNode(object):
         return self._add_input_items(data_path, [input_item,])
 
     def _add_input_items(self, data_path, input_items):
-        if len(data_path) == 0:
-            self.input_items.extend(input_items)
-            return
-
-        (index, degree) = data_path.pop(0)
-
-        if self.degree is None:
-            self.degree = degree
-        assert degree == self.degree, 'Degree mismatch'
-        if not self.children.get(index):
-            self.children[index] = InputSetGeneratorNode(index=index)
-        self.children[index]._add_input_items(data_path, input_items)
+        node = self
+        for (index, degree) in data_path:
+            if node.degree is None:
+                node.degree = degree
+            assert degree == node.degree, 'Degree mismatch'
+            if not node.children.get(index):
+                node.children[index] = InputSetGeneratorNode(index=index)
+            node = node.children[index]
+        node.input_items.extend(input_items)
 
     def dot_product(self, generator_B):
         generator_A_dot_B = InputSetGeneratorNode()
-        for input_set_A in self.get_input_sets([]):
-            seed_node_B = generator_B.get_node(input_set_A.data_path)
+        for input_set_A in self.iter_input_sets(()):
+            seed_node_B = generator_B.get_node(input_set_A.path)
             if seed_node_B is None:
                 continue
-            for input_set_B in seed_node_B.get_input_sets(input_set_A.data_path):
+            for input_set_B in seed_node_B.iter_input_sets(input_set_A.path):
                 data_path = self._select_longer_path(
-                    input_set_A.data_path, input_set_B.data_path)
+                    input_set_A.path, input_set_B.path)
                 input_items = input_set_A.input_items + input_set_B.input_items
                 generator_A_dot_B._add_input_items(data_path, input_items)
         return generator_A_dot_B
@@ -186,28 +190,21 @@ class InputSetGeneratorNode(object):
         return longer_path
 
     def cross_product(self, generator_B):
-        generator_A_cross_B = InputSetGeneratorNode()
-        for input_set_A in self.get_input_sets([]):
-            for input_set_B in generator_B.get_input_sets([]):
-                data_path = input_set_A.data_path + input_set_B.data_path
-                input_items = input_set_A.input_items + input_set_B.input_items
-                generator_A_cross_B._add_input_items(data_path, input_items)
-        return generator_A_cross_B
+        return CrossProductGenerator(self, generator_B)
 
     def get_input_sets(self, seed_path):
+        return list(self.iter_input_sets(seed_path))
+
+    def iter_input_sets(self, seed_path):
+        seed_path = tuple(tuple(pair) for pair in seed_path)
         if self._is_leaf:
-            path = copy.deepcopy(seed_path)
-            if not self.input_items:
-                return []
-            else:
-                return [InputSet(path, self.input_items)]
+            if self.input_items:
+                yield InputSet(seed_path, self.input_items)
         else:
-            input_sets = []
-            for child in self.children.values():
-                path = copy.deepcopy(seed_path)
-                path.append([child.index, self.degree])
-                input_sets.extend(child.get_input_sets(path))
-            return input_sets
+            for index in sorted(self.children.keys()):
+                path = seed_path + ((index, self.degree),)
+                for input_set in self.children[index].iter_input_sets(path):
+                    yield input_set
 
     @property
     def _is_leaf(self):
@@ -218,14 +215,50 @@ class InputSetGeneratorNode(object):
             return self
         if len(path) == 0:
             return self
-        path = copy.copy(path)
-        index, degree = path.pop(0)
+        index, degree = path[0]
         assert degree == self.degree, 'degree mismatch in get_node'
         child = self.children.get(index)
         if not child:
             return None
         else:
-            return child.get_node(path)
+            return child.get_node(path[1:])
+
+
+class CrossProductGenerator(object):
+    """Cross product of two generators, evaluated lazily.
+    Sets from generator_B are re-enumerated for each set from generator_A,
+    so memory does not grow with the size of the product.
+    """
+
+    def __init__(self, generator_A, generator_B):
+        self.generator_A = generator_A
+        self.generator_B = generator_B
+
+    def cross_product(self, generator_B):
+        return CrossProductGenerator(self, generator_B)
+
+    def get_input_sets(self, seed_path):
+        return list(self.iter_input_sets(seed_path))
+
+    def iter_input_sets(self, seed_path):
+        seed_path = tuple(tuple(pair) for pair in seed_path)
+        for input_set_A in self.generator_A.iter_input_sets(seed_path):
+            for input_set_B in self.generator_B.iter_input_sets(()):
+                yield InputSet(
+                    input_set_A.path + input_set_B.path,
+                    input_set_A.input_items + input_set_B.input_items)
+
+
+def iter_chunks(iterable, chunk_size):
+    """Yields lists of up to chunk_size items from iterable
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
 
 class InputSet(object):
     """All the information needed to create a Task from a given StepRun.
@@ -234,10 +267,16 @@ class InputSet(object):
     def __iter__(self):
         return self.input_items.__iter__()
 
-    def __init__(self, data_path, input_items):
-        self.data_path = data_path
+    def __init__(self, path, input_items):
+        # path is a tuple of (index, degree) tuples
+        self.path = path
         self.input_items = input_items
 
+    @property
+    def data_path(self):
+        # List form, as stored on Task.data_path
+        return [list(pair) for pair in self.path]
+
 
 class InputItem(object):
     """All the information needed by the Task to construct one TaskInput.
@@ -247,11 +286,12 @@ class InputItem(object):
     refrain from creating a new ArrayDataObject for no reason.
     """
 
-    def __init__(self, data_node, channel, as_channel, mode):
+    def __init__(self, data_node, channel, as_channel, mode, staging=''):
         self.channel = channel
         self.as_channel = as_channel
         self.data_node = data_node
         self.mode = mode
+        self.staging = staging
 
     @property
     def type(self):
@@ -2,12 +2,13 @@ from django.core.validators import RegexValidator
 from django.db import models
 from django.utils import timezone
 
-from .base import BaseModel
+from .base import BaseModel, InvalidatesRepresentationMixin
 
 label_validator = RegexValidator(r'^[0-9a-zA-Z_\-]*$',
                                'Only alphanumeric characters are allowed.')
 
-class DataLabel(BaseModel):
+class DataLabel(InvalidatesRepresentationMixin, BaseModel):
+    TARGET_FIELD = 'data_object'
     label = models.CharField(max_length=255, validators=[label_validator,])
     data_object = models.ForeignKey('DataObject',
                             related_name='labels',
@@ -18,7 +19,8 @@ class DataLabel(BaseModel):
         unique_together=(('label', 'data_object'))
 
 
-class TemplateLabel(BaseModel):
+class TemplateLabel(InvalidatesRepresentationMixin, BaseModel):
+    TARGET_FIELD = 'template'
     label = models.CharField(max_length=255, validators=[label_validator,])
     template = models.ForeignKey('Template',
                                  related_name='labels',
@@ -29,7 +31,8 @@ class TemplateLabel(BaseModel):
         unique_together=(('label', 'template'))
 
 
-class RunLabel(BaseModel):
+class RunLabel(InvalidatesRepresentationMixin, BaseModel):
+    TARGET_FIELD = 'run'
     label = models.CharField(max_length=255, validators=[label_validator,])
     run = models.ForeignKey('Run',
                             related_name='labels',
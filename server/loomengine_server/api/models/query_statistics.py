@@ -0,0 +1,70 @@
+from django.db import IntegrityError, models, transaction
+import jsonfield
+
+from .base import BaseModel
+
+
+class QueryStatistic(BaseModel):
+    """Database queries made by one API endpoint or asynchronous task,
+    summed over all calls since the statistics were last reset.
+    Rows are written by api.query_stats.
+    """
+
+    KIND_CHOICES = (('request', 'Request'),
+                    ('task', 'Task'))
+    SLOWEST_COUNT = 5
+
+    kind = models.CharField(max_length=255, choices=KIND_CHOICES)
+    name = models.CharField(max_length=255)
+    calls = models.BigIntegerField(default=0)
+    queries = models.BigIntegerField(default=0)
+    db_time = models.FloatField(default=0.0)
+    max_queries = models.IntegerField(default=0)
+    # List of {'time': seconds, 'sql': statement}, slowest first
+    slowest = jsonfield.JSONField(default=list)
+
+    class Meta:
+        unique_together = (('kind', 'name'),)
+
+    @classmethod
+    def add(cls, kind, name, calls, queries, db_time, max_queries, slowest):
+        with transaction.atomic():
+            try:
+                statistic = cls.objects.select_for_update().get(
+                    kind=kind, name=name)
+            except cls.DoesNotExist:
+                try:
+                    with transaction.atomic():
+                        statistic = cls.objects.create(kind=kind, name=name)
+                except IntegrityError:
+                    # Created by another process
+                    statistic = cls.objects.select_for_update().get(
+                        kind=kind, name=name)
+            statistic.calls += calls
+            statistic.queries += queries
+            statistic.db_time += db_time
+            statistic.max_queries = max(statistic.max_queries, max_queries)
+            statistic.slowest = merge_slowest(statistic.slowest, slowest)
+            statistic.save()
+
+    def to_dict(self):
+        return {
+            'kind': self.kind,
+            'name': self.name,
+            'calls': self.calls,
+            'queries': self.queries,
+            'mean_queries': float(self.queries) / self.calls
+            if self.calls else 0.0,
+            'max_queries': self.max_queries,
+            'db_time': self.db_time,
+            'mean_db_time': self.db_time / self.calls if self.calls else 0.0,
+            'slowest': self.slowest,
+        }
+
+
+def merge_slowest(*statement_lists):
+    statements = []
+    for statement_list in statement_lists:
+        statements.extend(statement_list)
+    statements.sort(key=lambda statement: statement['time'], reverse=True)
+    return statements[:QueryStatistic.SLOWEST_COUNT]
@@ -0,0 +1,92 @@
+from datetime import timedelta
+from django.db import models
+from django.db.models import F
+from django.utils import timezone
+import jsonfield
+
+from .base import BaseModel
+from api import async, get_setting
+from api.models import uuidstr
+
+
+class RunSubmission(BaseModel):
+    """A request to create a Run. The Run is built by an asynchronous job,
+    so large workflows do not hold up the request that submits them.
+    Clients poll the RunSubmission for its status and the new Run.
+    """
+
+    STATUS_CHOICES = (('queued', 'Queued'),
+                      ('in_progress', 'In Progress'),
+                      ('complete', 'Complete'),
+                      ('failed', 'Failed'))
+
+    uuid = models.CharField(default=uuidstr, editable=False,
+                            unique=True, max_length=255)
+    datetime_created = models.DateTimeField(default=timezone.now,
+                                            editable=False)
+    # When a job claimed the submission. A submission in progress for
+    # longer than RUN_SUBMISSION_TIMEOUT_SECONDS is assumed to have lost
+    # its job, e.g. when a worker died, and is marked failed.
+    datetime_started = models.DateTimeField(null=True, blank=True)
+    datetime_finished = models.DateTimeField(null=True, blank=True)
+    status = models.CharField(max_length=255, default='queued',
+                              choices=STATUS_CHOICES)
+    run_data = jsonfield.JSONField()
+    # Base URL of the server, used in run notifications
+    server_url = models.CharField(max_length=1000, blank=True)
+    run = models.ForeignKey('Run',
+                            related_name='submissions',
+                            null=True,
+                            blank=True,
+                            on_delete=models.SET_NULL)
+    # Validation errors in the same form as a synchronous POST to runs
+    error = jsonfield.JSONField(null=True, blank=True)
+
+    @classmethod
+    def submit(cls, run_data, server_url=''):
+        submission = cls.objects.create(
+            run_data=run_data, server_url=server_url)
+        async.execute(async.create_run_from_submission, submission.uuid)
+        return submission
+
+    @classmethod
+    def claim(cls, submission_uuid):
+        """Mark a queued submission as in progress. Returns the submission,
+        or None if another job has already claimed it.
+        """
+        submissions = cls.objects.filter(uuid=submission_uuid)
+        if not submissions.filter(status='queued').update(
+                status='in_progress', datetime_started=timezone.now()):
+            return None
+        return submissions.get()
+
+    @classmethod
+    def fail_stalled_submissions(cls):
+        """Mark submissions failed if they have been in progress for longer
+        than RUN_SUBMISSION_TIMEOUT_SECONDS. Returns the number failed.
+        """
+        timeout = get_setting('RUN_SUBMISSION_TIMEOUT_SECONDS')
+        now = timezone.now()
+        # A conditional update, so that a submission completed meanwhile
+        # is not marked failed
+        return cls.objects.filter(
+            status='in_progress',
+            datetime_started__lt=now - timedelta(seconds=timeout)).update(
+                status='failed',
+                error='Run creation did not finish within %s seconds'
+                % int(timeout),
+                datetime_finished=now,
+                _change=F('_change')+1)
+
+    def set_complete(self, run):
+        self.setattrs_and_save_with_retries({
+            'status': 'complete',
+            'run': run,
+            'error': None,
+            'datetime_finished': timezone.now()})
+
+    def set_failed(self, error):
+        self.setattrs_and_save_with_retries({
+            'status': 'failed',
+            'error': error,
+            'datetime_finished': timezone.now()})
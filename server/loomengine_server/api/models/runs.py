@@ -1,7 +1,9 @@
 from django.core import mail
 from django.core.exceptions import ObjectDoesNotExist, MultipleObjectsReturned, \
     ValidationError
+from datetime import timedelta
 from django.db import models
+from django.db.models import Q
 from django.template.loader import render_to_string
 from django.utils import timezone
 import logging
@@ -9,7 +11,8 @@ import jsonfield
 import requests
 
 from .base import BaseModel
-from . import flatten_nodes, copy_prefetch
+from . import flatten_nodes, copy_prefetch, combine_versions, \
+    get_queryset_version, get_prefetch_lookups, prefix_prefetch_lookups
 from api import get_setting
 from api import async
 from api.exceptions import *
@@ -18,8 +21,9 @@ from api.models import validators
 from api.models.data_objects import DataObject
 from api.models.data_channels import DataChannel
 from api.models.data_nodes import DataNode
-from api.models.input_calculator import InputCalculator
-from api.models.tasks import Task, TaskInput, TaskOutput, TaskAlreadyExistsException
+from api.models.input_calculator import InputCalculator, iter_chunks
+from api.models.tasks import Task, TaskInput, TaskOutput, TaskEvent, \
+    TaskAlreadyExistsException
 from api.models.task_attempts import TaskAttempt
 from api.models.templates import Template
 from api.exceptions import ConcurrentModificationError
@@ -48,6 +52,7 @@ class Run(BaseModel):
     Workflow composed of one or more Steps.
     """
 
+    PREASSIGN_IDS = True
     NAME_FIELD = 'name'
     ID_FIELD = 'uuid'
     TAG_FIELD = 'tags__tag'
@@ -100,6 +105,27 @@ class Run(BaseModel):
 
     force_rerun = models.BooleanField(default=False)
 
+    # Used to coalesce requests to push inputs. See request_push_all_inputs
+    push_inputs_status = models.CharField(
+        max_length=255,
+        default='idle',
+        choices=(('idle', 'Idle'),
+                 ('scheduled', 'Scheduled'),
+                 ('in_progress', 'In Progress'))
+    )
+    push_inputs_pending = models.BooleanField(default=False)
+    # When push_inputs_status last changed. A job that is scheduled or in
+    # progress for longer than PUSH_INPUTS_LOCK_TIMEOUT_SECONDS is assumed
+    # lost, and the next request replaces it.
+    push_inputs_changed = models.DateTimeField(default=timezone.now)
+
+    # Incremented to invalidate cached representations.
+    # See api/representation_cache.py
+    representation_generation = models.IntegerField(default=0)
+
+    UPDATE_ONLY_FIELDS = ('push_inputs_status', 'push_inputs_pending',
+                          'push_inputs_changed', 'representation_generation')
+
     @property
     def status(self):
         if self.status_is_failed:
@@ -213,42 +239,123 @@ class Run(BaseModel):
     def push_all_inputs(self):
         if get_setting('TEST_NO_PUSH_INPUTS'):
             return
+        for leaf in self.get_leaves():
+            existing_paths = set(
+                tuple(tuple(pair) for pair in task.data_path)
+                for task in leaf.tasks.all())
+            if leaf.inputs.exists():
+                input_sets = (
+                    input_set for input_set
+                    in InputCalculator(leaf).iter_input_sets()
+                    if input_set.path not in existing_paths)
+            elif () not in existing_paths:
+                # Special case: No inputs on leaf node
+                input_sets = [[]]
+            else:
+                continue
+            # Tasks are created in chunks so that memory use is bounded
+            # and early Tasks can start before all InputSets are enumerated.
+            for chunk in iter_chunks(
+                    input_sets, get_setting('TASK_CREATION_CHUNK_SIZE')):
+                leaf._create_tasks(chunk)
+
+    def _create_tasks(self, input_sets):
         unsaved_tasks = {}
         unsaved_task_inputs = []
         unsaved_task_outputs = []
         unsaved_data_nodes = {}
-        for leaf in self.get_leaves():
-            if leaf.inputs.exists():
-                leaf_outputs = leaf.outputs.all()
-                for input_set in InputCalculator(leaf)\
-                    .get_input_sets():
-                    task, task_inputs, task_outputs, data_nodes \
-                        = Task.create_unsaved_task_from_input_set(
-                            input_set, leaf, leaf_outputs)
-                    if task is None:
-                        # Task already exists, none to create
-                        continue
-                    unsaved_tasks[task.uuid] = task
-                    unsaved_task_inputs.extend(task_inputs)
-                    unsaved_task_outputs.extend(task_outputs)
-                    unsaved_data_nodes.update(data_nodes)
-            else:
-                # Special case: No inputs on leaf node
-                task, task_inputs, task_outputs, data_nodes \
-                    = Task.create_unsaved_task_from_input_set([], leaf)
-                if task is None:
-                    continue
-                unsaved_tasks[task.uuid] = task
-                unsaved_task_inputs.extend(task_inputs)
-                unsaved_task_outputs.extend(task_outputs)
-                unsaved_data_nodes.update(data_nodes)
+        # Reload outputs for each chunk, since nodes added to the output
+        # trees by the previous chunk are not reflected in memory.
+        run_outputs = self.outputs.all()
+        tasks_to_render = []
+        for input_set in input_sets:
+            task, task_inputs, task_outputs, data_nodes \
+                = Task.create_unsaved_task_from_input_set(
+                    input_set, self, run_outputs, render_command=False)
+            tasks_to_render.append((task, task_inputs, task_outputs))
+            unsaved_tasks[task.uuid] = task
+            unsaved_task_inputs.extend(task_inputs)
+            unsaved_task_outputs.extend(task_outputs)
+            unsaved_data_nodes.update(data_nodes)
+        Task.render_commands(self, tasks_to_render)
         Task.bulk_create_tasks(unsaved_tasks, unsaved_task_inputs,
                                unsaved_task_outputs, unsaved_data_nodes,
                                self.force_rerun)
 
     def push_all_outputs(self):
         for run in self._get_downstream_runs():
-            run.push_all_inputs()
+            run.request_push_all_inputs()
+
+    def request_push_all_inputs(self):
+        """Schedule push_all_inputs, coalescing with any other requests
+        for this run. At most one job is scheduled or in progress at a time.
+        Requests that arrive while the job is in progress cause it to
+        run once more after it finishes, so no new data is missed.
+        A job that has not finished within PUSH_INPUTS_LOCK_TIMEOUT_SECONDS
+        is assumed lost, and is replaced by a new one.
+        """
+        runs = Run.objects.filter(id=self.id)
+        while True:
+            now = timezone.now()
+            available = Q(push_inputs_status='idle') | Q(
+                push_inputs_changed__lt=self._get_push_inputs_expiration(now))
+            if runs.filter(available).update(
+                    push_inputs_status='scheduled', push_inputs_pending=False,
+                    push_inputs_changed=now):
+                async.execute_with_delay(
+                    async.push_all_inputs, self.uuid,
+                    delay=get_setting('PUSH_INPUTS_DEBOUNCE_SECONDS'))
+                return
+            if runs.filter(push_inputs_status='in_progress').update(
+                    push_inputs_pending=True):
+                return
+            if runs.filter(push_inputs_status='scheduled').exists():
+                # The scheduled job has not started, so it will see new data
+                return
+            # Status changed since we checked. Try again.
+
+    @classmethod
+    def _get_push_inputs_expiration(cls, now=None):
+        if now is None:
+            now = timezone.now()
+        return now - timedelta(
+            seconds=get_setting('PUSH_INPUTS_LOCK_TIMEOUT_SECONDS'))
+
+    @classmethod
+    def get_expired_push_inputs_locks(cls):
+        return cls.objects.exclude(push_inputs_status='idle').filter(
+            push_inputs_changed__lt=cls._get_push_inputs_expiration())
+
+    @classmethod
+    def run_push_all_inputs_job(cls, run_uuid):
+        runs = Run.objects.filter(uuid=run_uuid)
+        claimed = timezone.now()
+        if not runs.filter(push_inputs_status='scheduled').update(
+                push_inputs_status='in_progress', push_inputs_pending=False,
+                push_inputs_changed=claimed):
+            # Another job claimed this run
+            return
+        # Updates match the time this job last claimed the run, so they
+        # do nothing if the lock expired and another job replaced this one
+        lock = runs.filter(push_inputs_changed=claimed)
+        try:
+            while True:
+                runs.get().push_all_inputs()
+                if lock.filter(push_inputs_pending=False).update(
+                        push_inputs_status='idle',
+                        push_inputs_changed=timezone.now()):
+                    return
+                # More data arrived while running. Renew the lock and
+                # run again.
+                claimed = timezone.now()
+                if not lock.update(push_inputs_pending=False,
+                                   push_inputs_changed=claimed):
+                    return
+                lock = runs.filter(push_inputs_changed=claimed)
+        except Exception:
+            lock.update(push_inputs_status='idle', push_inputs_pending=False,
+                        push_inputs_changed=timezone.now())
+            raise
 
     def _get_downstream_runs(self):
         runs = set()
@@ -309,89 +416,129 @@ class Run(BaseModel):
                 step.get_leaves(leaf_list=leaf_list)
         return leaf_list
 
-    def prefetch(self):
+    def get_representation_version(self):
+        """Returns None while the run is still active. Runs with a
+        terminal status may still receive events or have children killed,
+        so the version covers the whole subtree.
+        """
+        if not self.has_terminal_status():
+            return None
+        return self.get_subtree_version()
+
+    def get_version(self):
+        return self.get_subtree_version()
+
+    def get_subtree_version(self):
+        """Returns a string that changes when this run or any step, task,
+        task attempt or event rendered with it is saved, created or deleted.
+        This uses aggregate queries (one per level of steps plus a few
+        more) rather than loading the tree. The result is kept on the
+        instance, so callers in one request share the queries.
+        """
+        if hasattr(self, '_cached_subtree_version'):
+            return self._cached_subtree_version
+        run_ids = [self.id]
+        run_changes = [self._change]
+        level_ids = [self.id]
+        while level_ids:
+            steps = list(Run.objects.filter(parent_id__in=level_ids)\
+                         .values_list('id', '_change'))
+            level_ids = [step_id for (step_id, change) in steps]
+            run_ids.extend(level_ids)
+            run_changes.extend([change for (step_id, change) in steps])
+        task_attempts = TaskAttempt.objects.filter(
+            tasks__run_id__in=run_ids).distinct()
+        self._cached_subtree_version = combine_versions([
+            len(run_ids), sum(run_changes),
+            get_queryset_version(RunEvent.objects.filter(run_id__in=run_ids)),
+            get_queryset_version(Task.objects.filter(run_id__in=run_ids)),
+            get_queryset_version(
+                TaskEvent.objects.filter(task__run_id__in=run_ids)),
+            get_queryset_version(task_attempts),
+        ] + TaskAttempt.get_related_versions(task_attempts))
+        return self._cached_subtree_version
+
+    # Related lookups needed to render each field. Rendering 'steps'
+    # renders every field of every step, and 'template' is prefetched
+    # separately with select_related.
+    PREFETCH_LOOKUPS = [
+        ('inputs', ['inputs', 'inputs__data_node']),
+        ('outputs', ['outputs', 'outputs__data_node']),
+        ('user_inputs', ['user_inputs', 'user_inputs__data_node']),
+        ('events', ['events']),
+        ('tasks', prefix_prefetch_lookups('tasks', Task.PREFETCH_LOOKUPS)),
+    ]
+
+    def prefetch(self, fields=None):
         if not hasattr(self, '_prefetched_objects_cache'):
-            self.prefetch_list([self,])
+            self.prefetch_list([self,], fields=fields)
 
     @classmethod
-    def prefetch_list(cls, instances):
-        queryset = Run\
-                   .objects\
-                   .filter(uuid__in=[i.uuid for i in instances])
-        MAXIMUM_TREE_DEPTH = get_setting('MAXIMUM_TREE_DEPTH')
-        # Prefetch 'children', 'children__children', etc. up to max depth               
-        # This incurs 1 query per level up to actual depth.                             
-        # No extra queries incurred if we go too deep.)                                 
-        for i in range(1, MAXIMUM_TREE_DEPTH+1):
-            queryset = queryset.prefetch_related('__'.join(['steps']*i))
-        # Transfer prefetched steps to original instances
-        queried_runs_1 = [run for run in queryset]
-        copy_prefetch(queried_runs_1, instances)
-        # Flatten tree so we can simultaneously prefetch related models on all nodes
-        node_list = []
-        for instance in instances:
-            node_list.extend(flatten_nodes(instance, 'steps'))
+    def prefetch_list(cls, instances, fields=None):
+        """Prefetch data needed to render the given fields,
+        or all fields if None.
+        """
+        if fields is None or 'steps' in fields:
+            queryset = Run\
+                       .objects\
+                       .filter(uuid__in=[i.uuid for i in instances])
+            MAXIMUM_TREE_DEPTH = get_setting('MAXIMUM_TREE_DEPTH')
+            # Prefetch 'children', 'children__children', etc. up to max depth
+            # This incurs 1 query per level up to actual depth.
+            # No extra queries incurred if we go too deep.)
+            for i in range(1, MAXIMUM_TREE_DEPTH+1):
+                queryset = queryset.prefetch_related('__'.join(['steps']*i))
+            # Transfer prefetched steps to original instances
+            queried_runs_1 = [run for run in queryset]
+            copy_prefetch(queried_runs_1, instances)
+            # Flatten tree so we can simultaneously prefetch related models
+            # on all nodes. Steps are rendered with all fields.
+            node_list = []
+            for instance in instances:
+                node_list.extend(flatten_nodes(instance, 'steps'))
+            child_field = 'steps'
+            lookups = get_prefetch_lookups(cls.PREFETCH_LOOKUPS)
+        else:
+            node_list = instances
+            child_field = None
+            lookups = get_prefetch_lookups(cls.PREFETCH_LOOKUPS, fields)
         queryset = Run.objects.filter(uuid__in=[n.uuid for n in node_list])\
-            .select_related('template')\
-            .prefetch_related('inputs')\
-            .prefetch_related('inputs__data_node')\
-            .prefetch_related('outputs')\
-            .prefetch_related('outputs__data_node')\
-            .prefetch_related('user_inputs')\
-            .prefetch_related('user_inputs__data_node')\
-            .prefetch_related('events')\
-            .prefetch_related('tasks')\
-            .prefetch_related('tasks__inputs')\
-            .prefetch_related('tasks__inputs__data_node')\
-            .prefetch_related('tasks__outputs')\
-            .prefetch_related('tasks__outputs__data_node')\
-            .prefetch_related('tasks__events')\
-            .prefetch_related('tasks__all_task_attempts')\
-            .prefetch_related('tasks__all_task_attempts__inputs')\
-            .prefetch_related('tasks__all_task_attempts__inputs__data_node')\
-            .prefetch_related('tasks__all_task_attempts__outputs')\
-            .prefetch_related('tasks__all_task_attempts__outputs__data_node')\
-            .prefetch_related('tasks__all_task_attempts__events')\
-            .prefetch_related('tasks__all_task_attempts__log_files')\
-            .prefetch_related('tasks__all_task_attempts__log_files__data_object')\
-            .prefetch_related(
-                'tasks__all_task_attempts__log_files__data_object__file_resource')\
-            .prefetch_related('tasks__task_attempt')\
-            .prefetch_related('tasks__task_attempt__inputs')\
-            .prefetch_related('tasks__task_attempt__inputs__data_node')\
-            .prefetch_related('tasks__task_attempt__outputs')\
-            .prefetch_related('tasks__task_attempt__outputs__data_node')\
-            .prefetch_related('tasks__task_attempt__events')\
-            .prefetch_related('tasks__task_attempt__log_files')\
-            .prefetch_related('tasks__task_attempt__log_files__data_object')\
-            .prefetch_related(
-                'tasks__task_attempt__log_files__data_object__file_resource')
+            .prefetch_related(*lookups)
+        one_to_x_fields = []
+        if fields is None or 'steps' in fields or 'template' in fields:
+            queryset = queryset.select_related('template')
+            one_to_x_fields.append('template')
         # Transfer prefetched data to child nodes on original instances
         queried_runs_2 = [run for run in queryset]
         copy_prefetch(queried_runs_2, node_list,
-                      child_field='steps', one_to_x_fields=['template',])
+                      child_field=child_field, one_to_x_fields=one_to_x_fields)
         # Prefetch all data nodes
-	data_nodes = []
-	for instance in instances:
-            instance._get_data_nodes(data_nodes)
-	DataNode.prefetch_list(data_nodes)
+        data_nodes = []
+        for instance in instances:
+            instance._get_data_nodes(data_nodes, fields=fields)
+        DataNode.prefetch_list(data_nodes)
 
-    def _get_data_nodes(self, data_nodes=None):
+    def _get_data_nodes(self, data_nodes=None, fields=None):
         if data_nodes is None:
             data_nodes = []
-        for input in self.inputs.all():
-            if input.data_node:
-                data_nodes.append(input.data_node)
-        for output in self.outputs.all():
-            if output.data_node:
-                data_nodes.append(output.data_node)
-        for user_input in self.user_inputs.all():
-            if user_input.data_node:
-                data_nodes.append(user_input.data_node)
-        for task in self.tasks.all():
-            task._get_data_nodes(data_nodes)
-        for run in self.steps.all():
-            run._get_data_nodes(data_nodes)
+        if fields is None or 'inputs' in fields:
+            for input in self.inputs.all():
+                if input.data_node:
+                    data_nodes.append(input.data_node)
+        if fields is None or 'outputs' in fields:
+            for output in self.outputs.all():
+                if output.data_node:
+                    data_nodes.append(output.data_node)
+        if fields is None or 'user_inputs' in fields:
+            for user_input in self.user_inputs.all():
+                if user_input.data_node:
+                    data_nodes.append(user_input.data_node)
+        if fields is None or 'tasks' in fields:
+            for task in self.tasks.all():
+                task._get_data_nodes(data_nodes)
+        if fields is None or 'steps' in fields:
+            for run in self.steps.all():
+                run._get_data_nodes(data_nodes)
         return data_nodes
 
     @classmethod
@@ -499,6 +646,8 @@ class RunInput(DataChannel):
     mode = models.CharField(max_length=255, blank=True)
     group = models.IntegerField(null=True, blank=True)
     as_channel = models.CharField(max_length=255, null=True, blank=True)
+    staging = models.CharField(max_length=255, blank=True,
+                               choices=DataChannel.STAGING_CHOICES)
 
     def is_ready(self, data_path=None):
         if self.data_node:
@@ -3,12 +3,13 @@ from django.db import models
 from django.utils import timezone
 import re
 
-from .base import BaseModel
+from .base import BaseModel, InvalidatesRepresentationMixin
 
 tag_validator = RegexValidator(r'^[0-9a-zA-Z_\-]*$',
                                message='Only alphanumeric characters are allowed.')
 
-class DataTag(BaseModel):
+class DataTag(InvalidatesRepresentationMixin, BaseModel):
+    TARGET_FIELD = 'data_object'
     tag = models.CharField(max_length=255, unique=True, validators=[tag_validator,])
     data_object = models.ForeignKey('DataObject',
                             related_name='tags',
@@ -17,7 +18,8 @@ class DataTag(BaseModel):
                             blank=True)
 
 
-class TemplateTag(BaseModel):
+class TemplateTag(InvalidatesRepresentationMixin, BaseModel):
+    TARGET_FIELD = 'template'
     tag = models.CharField(max_length=255, unique=True, validators=[tag_validator,])
     template = models.ForeignKey('Template',
                                  related_name='tags',
@@ -26,7 +28,8 @@ class TemplateTag(BaseModel):
                                  blank=False)
 
 
-class RunTag(BaseModel):
+class RunTag(InvalidatesRepresentationMixin, BaseModel):
+    TARGET_FIELD = 'run'
     tag = models.CharField(max_length=255, unique=True, validators=[tag_validator,])
     run = models.ForeignKey('Run',
                             related_name='tags',
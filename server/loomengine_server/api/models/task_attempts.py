@@ -11,7 +11,8 @@ import subprocess
 import threading
 import time
 
-from . import render_from_template, render_string_or_list, copy_prefetch
+from . import render_from_template, render_string_or_list, copy_prefetch, \
+    combine_versions, get_queryset_version, get_prefetch_lookups
 from .base import BaseModel
 from .data_channels import DataChannel
 from .data_nodes import DataNode
@@ -27,6 +28,8 @@ logger = logging.getLogger(__name__)
 
 class TaskAttempt(BaseModel):
 
+    PREASSIGN_IDS = True
+
     uuid = models.CharField(default=uuidstr, editable=False,
                             unique=True, max_length=255)
     tasks = models.ManyToManyField('Task', through='TaskMembership',
@@ -156,7 +159,8 @@ class TaskAttempt(BaseModel):
                 type=input.type,
                 channel=input.channel,
                 mode=input.mode,
-                data_node=input.data_node.flattened_clone(save=True))
+                staging=input.staging,
+                data_node=input.data_node.get_flat_node(save=True))
             task_attempt_input.full_clean()
             task_attempt_input.save()
 
@@ -238,41 +242,82 @@ class TaskAttempt(BaseModel):
                 last_heartbeat = self.heartbeat()
             time.sleep(polling_interval)
 
-    def prefetch(self):
+    def get_version(self):
+        """Returns a string that changes when this TaskAttempt or its
+        events, log files, or outputs are saved, created or deleted.
+        """
+        return combine_versions(
+            [self._change] + self.get_related_versions(
+                TaskAttempt.objects.filter(id=self.id)))
+
+    @classmethod
+    def get_related_versions(cls, task_attempts):
+        """Returns versions of the rows rendered with a queryset of
+        TaskAttempts, not including the TaskAttempts: their events, log
+        files and outputs, and the FileResources of log files and outputs,
+        whose upload status is rendered.
+        """
+        output_trees = DataNode.objects.filter(
+            taskattemptoutput__task_attempt__in=task_attempts)\
+            .values('tree_id')
+        return [
+            get_queryset_version(TaskAttemptEvent.objects.filter(
+                task_attempt__in=task_attempts)),
+            get_queryset_version(TaskAttemptLogFile.objects.filter(
+                task_attempt__in=task_attempts)),
+            get_queryset_version(FileResource.objects.filter(
+                data_object__task_attempt_log_file__task_attempt__in=\
+                task_attempts)),
+            get_queryset_version(TaskAttemptOutput.objects.filter(
+                task_attempt__in=task_attempts)),
+            get_queryset_version(FileResource.objects.filter(
+                data_object__data_nodes__tree_id__in=output_trees)\
+                .distinct()),
+        ]
+
+    # Related lookups needed to render each field
+    PREFETCH_LOOKUPS = [
+        ('inputs', ['inputs', 'inputs__data_node']),
+        ('outputs', ['outputs', 'outputs__data_node']),
+        ('events', ['events']),
+        ('log_files', ['log_files',
+                       'log_files__data_object',
+                       'log_files__data_object__file_resource']),
+    ]
+
+    def prefetch(self, fields=None):
         if not hasattr(self, '_prefetched_objects_cache'):
-            self.prefetch_list([self,])
+            self.prefetch_list([self,], fields=fields)
 
-    def prefetch_list(cls, instances):
+    def prefetch_list(cls, instances, fields=None):
+        """Prefetch data needed to render the given fields,
+        or all fields if None.
+        """
         queryset = TaskAttempt\
                    .objects\
                    .filter(uuid__in=[i.uuid for i in instances])\
-                   .prefetch_related('inputs')\
-                   .prefetch_related('inputs__data_node')\
-                   .prefetch_related('outputs')\
-                   .prefetch_related('outputs__data_node')\
-                   .prefetch_related('events')\
-                   .prefetch_related('log_files')\
-                   .prefetch_related('log_files__data_object')\
                    .prefetch_related(
-                       'log_files__data_object__file_resource')
+                       *get_prefetch_lookups(cls.PREFETCH_LOOKUPS, fields))
         # Transfer prefetch data to original instances
         queried_task_attempts = [item for item in queryset]
         copy_prefetch(queried_task_attempts, instances)
         # Prefetch all data nodes
         data_nodes = []
         for instance in instances:
-            instance._get_data_nodes(data_nodes)
+            instance._get_data_nodes(data_nodes, fields=fields)
         DataNode.prefetch_list(data_nodes)
 
-    def _get_data_nodes(self, data_nodes=None):
+    def _get_data_nodes(self, data_nodes=None, fields=None):
         if data_nodes is None:
             data_nodes = []
-        for input in self.inputs.all():
-            if input.data_node:
-                data_nodes.append(input.data_node)
-        for output in self.outputs.all():
-            if output.data_node:
-                data_nodes.append(output.data_node)
+        if fields is None or 'inputs' in fields:
+            for input in self.inputs.all():
+                if input.data_node:
+                    data_nodes.append(input.data_node)
+        if fields is None or 'outputs' in fields:
+            for output in self.outputs.all():
+                if output.data_node:
+                    data_nodes.append(output.data_node)
         return data_nodes
 
 
@@ -282,6 +327,8 @@ class TaskAttemptInput(DataChannel):
                              related_name='inputs',
                              on_delete=models.CASCADE)
     mode = models.CharField(max_length=255)
+    staging = models.CharField(max_length=255, blank=True,
+                               choices=DataChannel.STAGING_CHOICES)
 
 
 class TaskAttemptOutput(DataChannel):
@@ -5,11 +5,14 @@ import logging
 import jsonfield
 import time
 
-from . import render_from_template, render_string_or_list, \
-    calculate_contents_fingerprint, positiveIntegerDefaultDict
+from . import render_from_template, render_many_from_template, \
+    render_string_or_list, \
+    calculate_contents_fingerprint, positiveIntegerDefaultDict, \
+    combine_versions, get_queryset_version, get_prefetch_lookups, \
+    prefix_prefetch_lookups
 from .base import BaseModel
 from .data_channels import DataChannel
-from api import get_setting, reload_models, match_and_update_by_uuid
+from api import get_setting, match_and_update_by_uuid
 from api import async
 from api.exceptions import ConcurrentModificationError
 from api.models import uuidstr
@@ -28,6 +31,9 @@ class Task(BaseModel):
     For non-parallel steps, each Run will have one task. For parallel,
     each Run will have one task for each set of inputs.
     """
+
+    PREASSIGN_IDS = True
+
     uuid = models.CharField(default=uuidstr, editable=False,
                             unique=True, max_length=255)
     interpreter = models.CharField(max_length=1024)
@@ -67,12 +73,16 @@ class Task(BaseModel):
             force_rerun=force_rerun,
             delay=delay)
 
-    def get_fingerprintable_contents(self):
+    def get_fingerprintable_contents(self, inputs=None, outputs=None):
+        if inputs is None:
+            inputs = self.inputs.all()
+        if outputs is None:
+            outputs = self.outputs.all()
         # Avoid sorted_by because it triggers extra queries
-        inputs = sorted(self.inputs.all(), key=lambda i: i.channel)
+        inputs = sorted(inputs, key=lambda i: i.channel)
         input_fingerprints = [i.get_fingerprintable_contents()
                               for i in inputs]
-        outputs = sorted(self.outputs.all(), key=lambda o: o.channel)
+        outputs = sorted(outputs, key=lambda o: o.channel)
         output_fingerprints = [o.get_fingerprintable_contents()
                                for o in outputs]
         return {
@@ -84,8 +94,9 @@ class Task(BaseModel):
             'outputs': output_fingerprints,
         }
 
-    def calculate_contents_fingerprint(self):
-        return calculate_contents_fingerprint(self.get_fingerprintable_contents())
+    def calculate_contents_fingerprint(self, inputs=None, outputs=None):
+        return calculate_contents_fingerprint(
+            self.get_fingerprintable_contents(inputs=inputs, outputs=outputs))
 
     def get_fingerprint(self):
         fingerprint_value = self.calculate_contents_fingerprint()
@@ -243,15 +254,19 @@ class Task(BaseModel):
                           unsaved_task_outputs, unsaved_data_nodes, force_rerun):
         if get_setting('TEST_NO_CREATE_TASK'):
             return
+        # Inputs may share existing DataNodes. Only new ones need matching.
+        task_inputs_with_new_data_nodes = filter(
+            lambda i: i.data_node.id is None, unsaved_task_inputs)
         all_data_nodes = DataNode.save_list_with_children(unsaved_data_nodes.values())
 
-        bulk_tasks = Task.objects.bulk_create(unsaved_tasks.values())
-        tasks = reload_models(Task, bulk_tasks)
+        tasks = unsaved_tasks.values()
+        Task.allocate_ids(tasks)
+        Task.bulk_create_with_ids(tasks)
 
         match_and_update_by_uuid(
             unsaved_task_inputs, 'task', tasks)
         match_and_update_by_uuid(
-            unsaved_task_inputs, 'data_node', all_data_nodes)
+            task_inputs_with_new_data_nodes, 'data_node', all_data_nodes)
         TaskInput.objects.bulk_create(unsaved_task_inputs)
 
         match_and_update_by_uuid(
@@ -263,18 +278,64 @@ class Task(BaseModel):
         for task in tasks:
             task.run.set_running_status()
 
+        force_rerun = force_rerun or get_setting('FORCE_RERUN')
+        if force_rerun:
+            cached_task_attempts = {}
+        else:
+            cached_task_attempts = cls._get_cached_task_attempts(
+                tasks, unsaved_task_inputs, unsaved_task_outputs)
         for task in tasks:
-            task.execute(force_rerun=force_rerun)
+            task_attempt = cached_task_attempts.get(task.uuid)
+            if task_attempt is not None:
+                # Reuse a valid TaskAttempt without dispatching execute_task
+                task.activate_task_attempt(task_attempt)
+            else:
+                task.execute(force_rerun=force_rerun)
         return tasks
 
     @classmethod
-    def create_unsaved_task_from_input_set(cls, input_set, run, run_outputs):
+    def _get_cached_task_attempts(cls, tasks, task_inputs, task_outputs):
+        """Returns {task.uuid: task_attempt} for tasks whose fingerprint
+        already has an active TaskAttempt that might succeed.
+        Fingerprints are calculated from the unsaved inputs and outputs
+        that were just created, so no queries are needed per task.
+        Tasks with no match are left for execute_task to handle.
+        """
+        inputs_by_task = {task.uuid: [] for task in tasks}
+        for task_input in task_inputs:
+            inputs_by_task[task_input.task.uuid].append(task_input)
+        outputs_by_task = {task.uuid: [] for task in tasks}
+        for task_output in task_outputs:
+            outputs_by_task[task_output.task.uuid].append(task_output)
+        fingerprint_values = {}
+        for task in tasks:
+            fingerprint_values[task.uuid] = task.calculate_contents_fingerprint(
+                inputs=inputs_by_task[task.uuid],
+                outputs=outputs_by_task[task.uuid])
+        fingerprints = TaskFingerprint.objects.filter(
+            value__in=set(fingerprint_values.values()),
+            active_task_attempt__isnull=False)\
+            .select_related('active_task_attempt')
+        task_attempts = {}
+        for fingerprint in fingerprints:
+            if fingerprint.active_task_attempt.might_succeed():
+                task_attempts[fingerprint.value] \
+                    = fingerprint.active_task_attempt
+        cached_task_attempts = {}
+        for task_uuid, value in fingerprint_values.items():
+            if value in task_attempts:
+                cached_task_attempts[task_uuid] = task_attempts[value]
+        return cached_task_attempts
+
+    @classmethod
+    def create_unsaved_task_from_input_set(cls, input_set, run, run_outputs,
+                                           render_command=True):
+        # Caller is responsible for skipping input_sets that already have a Task.
+        # With render_command=False the caller must set the command,
+        # e.g. with render_commands.
         try:
             if input_set:
                 data_path = input_set.data_path
-                if len(filter(lambda t: t.data_path==data_path, run.tasks.all())) > 0:
-                    # No-op. Task already exists.
-                    return None, [], [], {}
             else:
                 # If run has no inputs, we get an empty input_set.
                 # Task will go on the root node.
@@ -294,15 +355,18 @@ class Task(BaseModel):
             task_outputs = []
             data_nodes = {}
             for input_item in input_set:
-                data_node = input_item.data_node.flattened_clone(save=False)
+                data_node = input_item.data_node.get_flat_node(save=False)
                 task_inputs.append(TaskInput(
                     task=task,
                     channel=input_item.channel,
                     as_channel=input_item.as_channel,
+                    staging=input_item.staging,
                     type=input_item.type,
                     mode=input_item.mode,
                     data_node = data_node))
-                data_nodes[data_node.uuid] = data_node
+                if data_node.id is None:
+                    # Existing nodes are shared, not saved again
+                    data_nodes[data_node.uuid] = data_node
             for run_output in run_outputs:
                 data_node = run_output.data_node.get_or_create_node(
                     data_path, save=False)
@@ -317,12 +381,34 @@ class Task(BaseModel):
                     data_node=data_node))
                 data_nodes[run_output.data_node.uuid] = run_output.data_node
                 data_nodes[data_node.uuid] = data_node
-            task.command = task.render_command(task_inputs, task_outputs, data_path)
+            if render_command:
+                task.command = task.render_command(
+                    task_inputs, task_outputs, data_path)
             return task, task_inputs, task_outputs, data_nodes
         except Exception as e:
             run.fail(detail='Error creating Task: "%s"' % str(e))
             raise
 
+    @classmethod
+    def render_commands(cls, run, unsaved_tasks):
+        """Sets the command on unsaved Tasks from one step, given as a list
+        of (task, task_inputs, task_outputs). The step's command is compiled
+        once for all of them.
+        """
+        try:
+            contexts = [
+                task.get_full_context(inputs=task_inputs,
+                                      outputs=task_outputs,
+                                      data_path=task.data_path)
+                for (task, task_inputs, task_outputs) in unsaved_tasks]
+            commands = render_many_from_template(run.command, contexts)
+        except Exception as e:
+            run.fail(detail='Error creating Task: "%s"' % str(e))
+            raise
+        for (task, task_inputs, task_outputs), command \
+            in zip(unsaved_tasks, commands):
+            task.command = command
+
     def create_and_activate_task_attempt(self):
         try:
             task_attempt = TaskAttempt.create_from_task(self)
@@ -439,61 +525,67 @@ class Task(BaseModel):
         else:
             return str(self.uuid)
 
-    def prefetch(self):
+    def get_version(self):
+        """Returns a string that changes when this Task or its events,
+        TaskAttempts, or anything rendered with them are saved, created
+        or deleted.
+        """
+        return combine_versions([
+            self._change,
+            get_queryset_version(self.events.all()),
+            get_queryset_version(self.all_task_attempts.all()),
+        ] + TaskAttempt.get_related_versions(self.all_task_attempts.all()))
+
+    # Related lookups needed to render each field
+    PREFETCH_LOOKUPS = [
+        ('inputs', ['inputs', 'inputs__data_node']),
+        ('outputs', ['outputs', 'outputs__data_node']),
+        ('events', ['events']),
+        ('all_task_attempts', prefix_prefetch_lookups(
+            'all_task_attempts', TaskAttempt.PREFETCH_LOOKUPS)),
+        ('task_attempt', prefix_prefetch_lookups(
+            'task_attempt', TaskAttempt.PREFETCH_LOOKUPS)),
+    ]
+
+    def prefetch(self, fields=None):
         if not hasattr(self, '_prefetched_objects_cache'):
-            self.prefetch_list([self,])
+            self.prefetch_list([self,], fields=fields)
 
     @classmethod
-    def prefetch_list(cls, instances):
+    def prefetch_list(cls, instances, fields=None):
+        """Prefetch data needed to render the given fields,
+        or all fields if None.
+        """
         queryset = Task\
                    .objects\
                    .filter(uuid__in=[i.uuid for i in instances])\
-                   .prefetch_related('inputs')\
-                   .prefetch_related('inputs__data_node')\
-                   .prefetch_related('outputs')\
-                   .prefetch_related('events')\
-                   .prefetch_related('all_task_attempts')\
-                   .prefetch_related('all_task_attempts__inputs')\
-                   .prefetch_related('all_task_attempts__inputs__data_node')\
-                   .prefetch_related('all_task_attempts__outputs')\
-                   .prefetch_related('all_task_attempts__outputs__data_node')\
-                   .prefetch_related('all_task_attempts__events')\
-                   .prefetch_related('all_task_attempts__log_files')\
-                   .prefetch_related('all_task_attempts__log_files__data_object')\
-                   .prefetch_related(
-                       'all_task_attempts__log_files__data_object__file_resource')\
-                   .prefetch_related('task_attempt')\
-                   .prefetch_related('task_attempt__inputs')\
-                   .prefetch_related('task_attempt__inputs__data_node')\
-                   .prefetch_related('task_attempt__outputs')\
-                   .prefetch_related('task_attempt__outputs__data_node')\
-                   .prefetch_related('task_attempt__events')\
-                   .prefetch_related('task_attempt__log_files')\
-                   .prefetch_related('task_attempt__log_files__data_object')\
                    .prefetch_related(
-                       'task_attempt__log_files__data_object__file_resource')
+                       *get_prefetch_lookups(cls.PREFETCH_LOOKUPS, fields))
         # Transfer prefetch data to original instances
         for task in queryset:
             for instance in filter(lambda i: i.uuid==task.uuid, instances):
                 instance._prefetched_objects_cache = task._prefetched_objects_cache
         # Prefetch all data nodes
         data_nodes = []
-	for instance in instances:
-            instance._get_data_nodes(data_nodes)
-	DataNode.prefetch_list(data_nodes)
+        for instance in instances:
+            instance._get_data_nodes(data_nodes, fields=fields)
+        DataNode.prefetch_list(data_nodes)
 
-    def _get_data_nodes(self, data_nodes=None):
+    def _get_data_nodes(self, data_nodes=None, fields=None):
         if data_nodes is None:
             data_nodes = []
-        for input in self.inputs.all():
-            if input.data_node:
-                data_nodes.append(input.data_node)
-        for output in self.outputs.all():
-            if output.data_node:
-                data_nodes.append(output.data_node)
-        for task_attempt in self.all_task_attempts.all():
-            task_attempt._get_data_nodes(data_nodes)
-        if self.task_attempt:
+        if fields is None or 'inputs' in fields:
+            for input in self.inputs.all():
+                if input.data_node:
+                    data_nodes.append(input.data_node)
+        if fields is None or 'outputs' in fields:
+            for output in self.outputs.all():
+                if output.data_node:
+                    data_nodes.append(output.data_node)
+        if fields is None or 'all_task_attempts' in fields:
+            for task_attempt in self.all_task_attempts.all():
+                task_attempt._get_data_nodes(data_nodes)
+        if (fields is None or 'task_attempt' in fields) and self.task_attempt:
             self.task_attempt._get_data_nodes(data_nodes)
         return data_nodes
 
@@ -505,6 +597,8 @@ class TaskInput(DataChannel):
                              on_delete=models.CASCADE)
     mode = models.CharField(max_length=255)
     as_channel = models.CharField(max_length=255, null=True, blank=True)
+    staging = models.CharField(max_length=255, blank=True,
+                               choices=DataChannel.STAGING_CHOICES)
 
     def get_internal_channel(self):
         if self.as_channel:
@@ -3,7 +3,7 @@ from django.core.exceptions import ObjectDoesNotExist
 from django.utils import timezone
 import jsonfield
 
-from . import flatten_nodes, copy_prefetch
+from . import flatten_nodes, copy_prefetch, get_prefetch_lookups
 from .base import BaseModel
 from .data_channels import DataChannel
 from .data_nodes import DataNode
@@ -66,6 +66,12 @@ class Template(BaseModel):
     )
     raw_data = jsonfield.JSONField(blank=True)
 
+    # Incremented to invalidate cached representations.
+    # See api/representation_cache.py
+    representation_generation = models.IntegerField(default=0)
+
+    UPDATE_ONLY_FIELDS = ('representation_generation',)
+
     def get_name_and_id(self):
         return "%s@%s" % (self.name, self.id)
 
@@ -141,46 +147,73 @@ class Template(BaseModel):
             except models.ProtectedError:
                 pass
 
-    def prefetch(self):
+    def get_version(self):
+        return str(self._change)
+
+    def get_representation_version(self):
+        # Templates do not change after they are created
+        return self.get_version()
+
+    # Related lookups needed to render each field.
+    # Rendering 'steps' renders every field of every step.
+    PREFETCH_LOOKUPS = [
+        ('inputs', ['inputs', 'inputs__data_node']),
+    ]
+
+    def prefetch(self, fields=None):
         if not hasattr(self, '_prefetched_objects_cache'):
-            self.prefetch_list([self,])
+            self.prefetch_list([self,], fields=fields)
 
     @classmethod
-    def prefetch_list(cls, instances):
-        queryset = Template\
-                   .objects\
-                   .filter(uuid__in=[i.uuid for i in instances])
-        MAXIMUM_TREE_DEPTH = get_setting('MAXIMUM_TREE_DEPTH')
-        # Prefetch 'children', 'children__children', etc. up to max depth
-        # This incurs 1 query per level up to actual depth.
-        # No extra queries incurred if we go too deep.)
-        for i in range(1, MAXIMUM_TREE_DEPTH+1):
-            queryset = queryset.prefetch_related('__'.join(['steps']*i))
-        # Transfer prefetched steps to original instances
-        queried_templates_1 = [template for template in queryset]
-        copy_prefetch(queried_templates_1, instances)
-        # Flatten tree so we can simultaneously prefetch related models on all nodes
-        node_list = []
-        for instance in instances:
-            node_list.extend(flatten_nodes(instance, 'steps'))
-        queryset = Template.objects.filter(uuid__in=[n.uuid for n in node_list])\
-            .prefetch_related('inputs')\
-            .prefetch_related('inputs__data_node')
-        # Transfer prefetched data to child nodes on original instances
-        queried_templates_2 = [template for template in queryset]
-        copy_prefetch(queried_templates_2, instances, child_field='steps')
+    def prefetch_list(cls, instances, fields=None):
+        """Prefetch data needed to render the given fields,
+        or all fields if None.
+        """
+        if fields is None or 'steps' in fields:
+            queryset = Template\
+                       .objects\
+                       .filter(uuid__in=[i.uuid for i in instances])
+            MAXIMUM_TREE_DEPTH = get_setting('MAXIMUM_TREE_DEPTH')
+            # Prefetch 'children', 'children__children', etc. up to max depth
+            # This incurs 1 query per level up to actual depth.
+            # No extra queries incurred if we go too deep.)
+            for i in range(1, MAXIMUM_TREE_DEPTH+1):
+                queryset = queryset.prefetch_related('__'.join(['steps']*i))
+            # Transfer prefetched steps to original instances
+            queried_templates_1 = [template for template in queryset]
+            copy_prefetch(queried_templates_1, instances)
+            # Flatten tree so we can simultaneously prefetch related models
+            # on all nodes. Steps are rendered with all fields.
+            node_list = []
+            for instance in instances:
+                node_list.extend(flatten_nodes(instance, 'steps'))
+            child_field = 'steps'
+            lookups = get_prefetch_lookups(cls.PREFETCH_LOOKUPS)
+        else:
+            node_list = instances
+            child_field = None
+            lookups = get_prefetch_lookups(cls.PREFETCH_LOOKUPS, fields)
+        if lookups:
+            queryset = Template.objects.filter(
+                uuid__in=[n.uuid for n in node_list])\
+                .prefetch_related(*lookups)
+            # Transfer prefetched data to child nodes on original instances
+            queried_templates_2 = [template for template in queryset]
+            copy_prefetch(queried_templates_2, instances,
+                          child_field=child_field)
         # Prefetch all data nodes
         data_nodes = []
-	for instance in instances:
-            instance._get_data_nodes(data_nodes=data_nodes)
-	DataNode.prefetch_list(data_nodes)
+        for instance in instances:
+            instance._get_data_nodes(data_nodes=data_nodes, fields=fields)
+        DataNode.prefetch_list(data_nodes)
 
-    def _get_data_nodes(self, data_nodes=None):
+    def _get_data_nodes(self, data_nodes=None, fields=None):
         if data_nodes is None:
             data_nodes = []
-        for input in self.inputs.all():
-            if input.data_node:
-                data_nodes.append(input.data_node)
+        if fields is None or 'inputs' in fields:
+            for input in self.inputs.all():
+                if input.data_node:
+                    data_nodes.append(input.data_node)
         return data_nodes
 
     @classmethod
@@ -199,6 +232,8 @@ class TemplateInput(DataChannel):
     mode = models.CharField(max_length=255, blank=True)
     group = models.IntegerField(null=True, blank=True)
     as_channel = models.CharField(max_length=255, null=True, blank=True)
+    staging = models.CharField(max_length=255, blank=True,
+                               choices=DataChannel.STAGING_CHOICES)
 
     class Meta:
         app_label = 'api'
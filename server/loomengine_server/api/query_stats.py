@@ -0,0 +1,174 @@
+from celery.signals import task_prerun, task_postrun
+from django.db import connection
+from django.utils.deprecation import MiddlewareMixin
+import logging
+import threading
+import time
+
+from api import get_setting
+
+
+"""This module records the number of database queries, the total
+database time, and the slowest statements for each API endpoint and
+asynchronous task, when the QUERY_STATS setting is True.
+
+Totals are kept in memory by each process and added to QueryStatistic
+at most every QUERY_STATS_FLUSH_INTERVAL_SECONDS, so recording does not
+add queries to every request. Totals not yet flushed are lost if the
+process exits.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+class QueryLog(object):
+    """Stands in for connection.queries_log while queries are recorded,
+    keeping the number of queries, their total time and the slowest
+    statements. connection.queries_log keeps only the most recent 9000
+    queries and is cleared only when a request starts, so in a Celery
+    worker it stops growing once it is full.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        self.slowest = []
+
+    def append(self, query):
+        from api.models import QueryStatistic, merge_slowest
+        query_time = float(query['time'])
+        self.count += 1
+        self.time += query_time
+        if len(self.slowest) < QueryStatistic.SLOWEST_COUNT \
+           or query_time > self.slowest[-1]['time']:
+            self.slowest = merge_slowest(
+                self.slowest, [{'time': query_time, 'sql': query['sql']}])
+
+    def clear(self):
+        pass
+
+
+class QueryRecorder(object):
+    """Records queries made on the default connection between start and stop
+    """
+
+    def start(self):
+        # Connect first, so that queries made while connecting
+        # are not counted
+        connection.ensure_connection()
+        self._force_debug_cursor = connection.force_debug_cursor
+        self._queries_log = connection.queries_log
+        self.queries = QueryLog()
+        connection.force_debug_cursor = True
+        connection.queries_log = self.queries
+
+    def stop(self):
+        connection.force_debug_cursor = self._force_debug_cursor
+        connection.queries_log = self._queries_log
+        return self.queries
+
+
+class _PendingStatistics(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = {}
+        self._last_flush = time.time()
+
+    def add(self, kind, name, queries):
+        # queries is a QueryLog
+        from api.models import merge_slowest
+        with self._lock:
+            totals = self._totals.setdefault((kind, name), {
+                'calls': 0,
+                'queries': 0,
+                'db_time': 0.0,
+                'max_queries': 0,
+                'slowest': []})
+            totals['calls'] += 1
+            totals['queries'] += queries.count
+            totals['db_time'] += queries.time
+            totals['max_queries'] = max(totals['max_queries'], queries.count)
+            totals['slowest'] = merge_slowest(
+                totals['slowest'], queries.slowest)
+            flush_due = time.time() - self._last_flush \
+                >= get_setting('QUERY_STATS_FLUSH_INTERVAL_SECONDS')
+        if flush_due:
+            self.flush()
+
+    def flush(self):
+        from api.models import QueryStatistic
+        with self._lock:
+            totals, self._totals = self._totals, {}
+            self._last_flush = time.time()
+        for (kind, name), values in totals.items():
+            try:
+                QueryStatistic.add(kind, name, **values)
+            except Exception as e:
+                logger.error('Failed to save query statistics for %s "%s": %s'
+                             % (kind, name, str(e)))
+
+    def clear(self):
+        with self._lock:
+            self._totals = {}
+
+
+pending_statistics = _PendingStatistics()
+
+
+def flush():
+    pending_statistics.flush()
+
+
+def reset():
+    from api.models import QueryStatistic
+    pending_statistics.clear()
+    QueryStatistic.objects.all().delete()
+
+
+def _get_request_name(request):
+    # Group requests by view rather than by URL, so that
+    # details of different objects are counted together
+    resolver_match = getattr(request, 'resolver_match', None)
+    if resolver_match is None:
+        view_name = 'unresolved'
+    else:
+        view_name = resolver_match.view_name or resolver_match._func_path
+    return '%s %s' % (request.method, view_name)
+
+
+class QueryStatsMiddleware(MiddlewareMixin):
+
+    def process_request(self, request):
+        if not get_setting('QUERY_STATS'):
+            return
+        request._query_recorder = QueryRecorder()
+        request._query_recorder.start()
+
+    def process_response(self, request, response):
+        recorder = getattr(request, '_query_recorder', None)
+        if recorder is not None:
+            queries = recorder.stop()
+            pending_statistics.add(
+                'request', _get_request_name(request), queries)
+        return response
+
+
+_task_recorders = {}
+
+
+@task_prerun.connect
+def _start_task_recorder(task_id=None, task=None, **kwargs):
+    if not get_setting('QUERY_STATS'):
+        return
+    recorder = QueryRecorder()
+    recorder.start()
+    _task_recorders[task_id] = recorder
+
+
+@task_postrun.connect
+def _stop_task_recorder(task_id=None, task=None, **kwargs):
+    recorder = _task_recorders.pop(task_id, None)
+    if recorder is not None:
+        queries = recorder.stop()
+        pending_statistics.add('task', task.name, queries)
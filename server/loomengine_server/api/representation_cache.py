@@ -0,0 +1,72 @@
+import hashlib
+from django.core.cache import caches
+from django.db.models import F
+
+from api import get_setting
+
+
+"""This module caches the rendered representations of objects that no
+longer change, such as Templates, completed DataObjects, and Runs that
+have reached a terminal status.
+
+Keys include the object's UUID and id, a version string supplied by the
+caller, and the object's representation_generation, so an entry is never
+read after the object changes. Changes that do not alter the version (e.g.
+adding a tag or label) call invalidate, which increments
+representation_generation. It is stored with the object rather than in the
+cache, where it could be culled and start again from 0. An object that is
+deleted and imported again has a new id.
+
+The cache backend is configured by CACHES['representations'] in settings.
+"""
+
+CACHE_NAME = 'representations'
+
+
+def _get_cache():
+    return caches[CACHE_NAME]
+
+
+def _get_key(kind, instance, version, context):
+    # Representations include absolute URLs, so the key depends on the host
+    request = context.get('request')
+    if request is not None:
+        base_url = request.build_absolute_uri('/')
+    else:
+        base_url = ''
+    key = '%s:%s:%s:%s:%s:%s' % (
+        kind, instance.uuid, instance.id, version,
+        instance.representation_generation, base_url)
+    return 'representation:%s' % hashlib.md5(key).hexdigest()
+
+
+def get_or_render(kind, instance, version, context, render):
+    """Returns the cached representation of instance for this version, or
+    calls render() and caches the result.
+    kind distinguishes serializers that render the same instance differently.
+    A version of None means the object may still change, so it is not cached.
+    """
+    if version is None or get_setting('DISABLE_REPRESENTATION_CACHE'):
+        return render()
+    cache = _get_cache()
+    key = _get_key(kind, instance, version, context)
+    representation = cache.get(key)
+    if representation is None:
+        representation = render()
+        cache.set(key, representation)
+    return representation
+
+
+def invalidate(instance):
+    """Stops cached representations of instance from being used, and
+    reloads instance.representation_generation so that it gets new keys.
+    """
+    objects = instance.__class__.objects.filter(id=instance.id)
+    # update() does not change _change, so other processes can still save
+    # the object. Saves do not write representation_generation.
+    objects.update(
+        representation_generation=F('representation_generation') + 1)
+    generation = objects.values_list(
+        'representation_generation', flat=True).first()
+    if generation is not None:
+        instance.representation_generation = generation
@@ -25,10 +25,70 @@ def reload_models(ModelClass, models):
 class RecursiveField(rest_framework.serializers.Serializer):
 
     def to_representation(self, value):
-        serializer = self.parent.parent.__class__(value, context=self.context)
+        serializer = self.parent.parent.__class__(
+            value, context=dict(self.context, nested=True))
         return serializer.data
 
 
+def is_nested(serializer):
+    """True if the serializer is rendering part of a larger representation.
+    Serializers created by RecursiveField have no parent but are flagged
+    as nested in their context.
+    """
+    return serializer.parent is not None \
+        or serializer.context.get('nested', False)
+
+
+class SparseFieldsMixin(object):
+    """Renders only the fields listed in context['fields'], and none of the
+    fields listed in context['exclude']. Views set these from the "fields"
+    and "exclude" query parameters. Only the top-level representation, or
+    each item of a top-level list, is affected. Nested objects are rendered
+    in full.
+    """
+
+    def get_rendered_fields(self):
+        """Returns the names of fields to render, or None for all fields
+        """
+        fields = self.context.get('fields')
+        exclude = self.context.get('exclude')
+        if not (fields or exclude) or not self._is_top_level():
+            return None
+        readable = [name for (name, field) in self.fields.items()
+                    if not field.write_only]
+        unknown = set(fields or []).union(exclude or []).difference(readable)
+        if unknown:
+            raise rest_framework.serializers.ValidationError(
+                'Invalid field names: "%s". Valid choices are "%s"' % (
+                    '", "'.join(sorted(unknown)), '", "'.join(readable)))
+        if fields:
+            readable = [name for name in readable if name in fields]
+        if exclude:
+            readable = [name for name in readable if name not in exclude]
+        return readable
+
+    def _is_top_level(self):
+        # List views render each item with a child of a ListSerializer
+        parent = self.parent
+        if isinstance(parent, rest_framework.serializers.ListSerializer):
+            parent = parent.parent
+        return parent is None and not self.context.get('nested', False)
+
+    def get_representation_kind(self, kind):
+        """Distinguishes cached representations with different fields
+        """
+        fields = self.get_rendered_fields()
+        if fields is None:
+            return kind
+        return '%s:%s' % (kind, ','.join(sorted(fields)))
+
+    @property
+    def _readable_fields(self):
+        fields = self.get_rendered_fields()
+        return [field for field in super(SparseFieldsMixin, self)._readable_fields
+                if fields is None or field.field_name in fields]
+
+
 class CreateWithParentModelSerializer(
         rest_framework.serializers.HyperlinkedModelSerializer):
     """Use this when a child has a required ForeignKey or OneToOne pointer 
@@ -3,7 +3,29 @@ from django.db import models
 
 from . import CreateWithParentModelSerializer
 from api.models.data_channels import DataChannel
-from api.serializers.data_nodes import DataNodeSerializer
+from api.serializers.data_nodes import DataNodeSerializer, \
+    DataNodeContentsRenderer
+
+
+class DataChannelListSerializer(serializers.ListSerializer):
+    """Renders the data of every channel in the list together,
+    so the number of queries does not grow with the number of channels.
+    """
+
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.Manager) else data
+        channels = list(iterable)
+        data_nodes = [channel.data_node for channel in channels
+                      if isinstance(channel, models.Model)
+                      and channel.data_node is not None]
+        if data_nodes:
+            self.child.data_node_contents = DataNodeContentsRenderer(
+                self.context).render(data_nodes)
+        try:
+            return [self.child.to_representation(item) for item in channels]
+        finally:
+            self.child.data_node_contents = {}
+
 
 class DataChannelSerializer(CreateWithParentModelSerializer):
 
@@ -11,6 +33,16 @@ class DataChannelSerializer(CreateWithParentModelSerializer):
     type = serializers.CharField()
     channel = serializers.CharField()
 
+    # Contents rendered by DataChannelListSerializer, keyed by DataNode id
+    data_node_contents = {}
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        child_kwargs = dict((key, value) for (key, value) in kwargs.items()
+                            if key != 'allow_empty')
+        kwargs['child'] = cls(*args, **child_kwargs)
+        return DataChannelListSerializer(*args, **kwargs)
+
     def create(self, validated_data):
         data = validated_data.pop('data', None)
         data_channel = super(DataChannelSerializer, self).create(validated_data)
@@ -51,12 +83,12 @@ class DataChannelSerializer(CreateWithParentModelSerializer):
                 instance)
         else:
             assert isinstance(instance, DataChannel)
-            instance.prefetch()
             representation = super(DataChannelSerializer, self)\
                              .to_representation(instance)
             if instance.data_node is not None:
                 data_node_serializer = DataNodeSerializer(
                     instance.data_node,
-                    context=self.context)
+                    context=dict(self.context,
+                                 data_node_contents=self.data_node_contents))
                 representation['data'] = data_node_serializer.data
             return representation
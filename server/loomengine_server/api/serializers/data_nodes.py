@@ -1,11 +1,14 @@
+from collections import OrderedDict, defaultdict
 import copy
 from django.db import models
 import jsonschema
 from rest_framework import serializers
 
-from .data_objects import DataObjectSerializer, URLDataObjectSerializer
+from .data_objects import DataObjectSerializer, URLDataObjectSerializer, \
+    FileResourceSerializer
 from api.models.data_nodes import DataNode
 from api.models.data_objects import DataObject
+from api.models.input_calculator import iter_chunks
 from api.models.validators import data_node_schema
 
 
@@ -99,12 +102,26 @@ class URLDataNodeSerializer(serializers.HyperlinkedModelSerializer):
         return minheight + 1
 
     def _create_data_node_from_data_objects(self, contents, data_type):
+        if data_type == 'file':
+            # Resolve all file references together
+            self._files_by_reference = DataObject.get_files_by_values(
+                self._get_file_references(contents))
         data_node = DataNode(type=data_type)
         data_node.full_clean()
         data_node.save()
         self._add_data_objects(data_node, contents, data_type)
         return data_node
 
+    def _get_file_references(self, contents, references=None):
+        if references is None:
+            references = set()
+        if isinstance(contents, list):
+            for item in contents:
+                self._get_file_references(item, references)
+        elif not isinstance(contents, dict):
+            references.add(contents)
+        return references
+
     def _add_data_objects(self, data_node, contents, data_type):
         path = []
         self._extend_all_paths_and_add_data_at_leaves(
@@ -131,6 +148,8 @@ class URLDataNodeSerializer(serializers.HyperlinkedModelSerializer):
                 s = DataObjectSerializer(data=contents, context=self.context)
                 s.is_valid(raise_exception=True)
                 data_object = s.save()
+            elif data_type == 'file':
+                data_object = self._files_by_reference[contents]
             else:
                 data_object = DataObject.get_by_value(
                     contents,
@@ -149,6 +168,132 @@ class URLDataNodeSerializer(serializers.HyperlinkedModelSerializer):
                     data_node, contents[i], path_i, data_type)
 
 
+class DataNodeContentsRenderer(object):
+    """Renders the contents of any number of DataNodes as nested lists of
+    DataObject representations, in the same shape as DataObjectSerializer.
+
+    Trees already loaded by DataNode.prefetch_list are walked in memory.
+    Other nodes are loaded with one query per tree level, and their
+    DataObjects with FileResources in one query per chunk of leaves.
+    Leaves are rendered to dicts directly with the serializer's fields
+    rather than with a new serializer instance for each leaf.
+    """
+
+    BLANK_NODE_VALUE = None
+    EMPTY_BRANCH_VALUE = []
+    QUERY_CHUNK_SIZE = 500
+
+    def __init__(self, context):
+        context = dict(context, nested=True)
+        self._data_object_fields = self._get_readable_fields(
+            DataObjectSerializer(context=context))
+        self._file_resource_fields = self._get_readable_fields(
+            FileResourceSerializer(context=context))
+
+    def render(self, data_nodes):
+        """Returns a dict of contents keyed by DataNode id
+        """
+        # Each node is (index, degree, data_object_id)
+        nodes = {}
+        children = defaultdict(list)
+        data_objects = {}
+        level = []
+        for data_node in data_nodes:
+            if 'children' in getattr(
+                    data_node, '_prefetched_objects_cache', {}):
+                self._add_prefetched_nodes(
+                    data_node, nodes, children, data_objects)
+                continue
+            nodes[data_node.id] = (
+                data_node.index, data_node.degree, data_node.data_object_id)
+            if data_node.degree:
+                level.append(data_node.id)
+        while level:
+            next_level = []
+            for chunk in iter_chunks(level, self.QUERY_CHUNK_SIZE):
+                for (id, parent_id, index, degree, data_object_id) \
+                    in DataNode.objects.filter(parent_id__in=chunk)\
+                        .values_list('id', 'parent_id', 'index',
+                                     'degree', 'data_object_id'):
+                    nodes[id] = (index, degree, data_object_id)
+                    children[parent_id].append(id)
+                    if degree:
+                        next_level.append(id)
+            level = next_level
+        data_objects.update(self._render_data_objects(set(
+            data_object_id for (index, degree, data_object_id)
+            in nodes.values() if data_object_id is not None
+            and data_object_id not in data_objects)))
+        return dict(
+            (data_node.id, self._build_contents(
+                data_node.id, nodes, children, data_objects))
+            for data_node in data_nodes)
+
+    def _add_prefetched_nodes(self, data_node, nodes, children, data_objects):
+        nodes[data_node.id] = (
+            data_node.index, data_node.degree, data_node.data_object_id)
+        if data_node.data_object_id is not None \
+           and data_node.data_object_id not in data_objects:
+            data_objects[data_node.data_object_id] = self._render_data_object(
+                data_node.data_object)
+        for child in data_node.children.all():
+            children[data_node.id].append(child.id)
+            self._add_prefetched_nodes(child, nodes, children, data_objects)
+
+    def _build_contents(self, node_id, nodes, children, data_objects):
+        index, degree, data_object_id = nodes[node_id]
+        if degree is None and data_object_id is None:
+            return self.BLANK_NODE_VALUE
+        elif degree == 0:
+            return self.EMPTY_BRANCH_VALUE
+        elif degree is None:
+            return data_objects[data_object_id]
+        contents = [self.BLANK_NODE_VALUE] * degree
+        for child_id in children[node_id]:
+            contents[nodes[child_id][0]] = self._build_contents(
+                child_id, nodes, children, data_objects)
+        return contents
+
+    def _render_data_objects(self, data_object_ids):
+        rendered = {}
+        for chunk in iter_chunks(data_object_ids, self.QUERY_CHUNK_SIZE):
+            for data_object in DataObject.objects.filter(id__in=chunk)\
+                                                 .select_related('file_resource'):
+                rendered[data_object.id] = self._render_data_object(
+                    data_object)
+        return rendered
+
+    def _render_data_object(self, data_object):
+        # Equivalent to DataObjectSerializer(data_object).data,
+        # with FileResources rendered the same way.
+        representation = OrderedDict()
+        for field in self._data_object_fields:
+            if field.field_name == 'value' and data_object.type == 'file' \
+               and data_object.file_resource is not None:
+                representation['value'] = self._render_fields(
+                    self._file_resource_fields, data_object.file_resource)
+            else:
+                representation.update(
+                    self._render_fields([field], data_object))
+        return representation
+
+    def _render_fields(self, fields, instance):
+        # Same as Serializer.to_representation for these fields
+        representation = OrderedDict()
+        for field in fields:
+            attribute = field.get_attribute(instance)
+            if attribute is None:
+                representation[field.field_name] = None
+            else:
+                representation[field.field_name] = field.to_representation(
+                    attribute)
+        return representation
+
+    def _get_readable_fields(self, serializer):
+        return [field for field in serializer.fields.values()
+                if not field.write_only]
+
+
 class DataNodeSerializer(URLDataNodeSerializer):
 
     contents = serializers.JSONField()
@@ -159,23 +304,13 @@ class DataNodeSerializer(URLDataNodeSerializer):
                 self.initial_data)
         else:
             assert isinstance(instance, DataNode)
-            instance.prefetch()
             representation = super(
                 DataNodeSerializer, self).to_representation(instance)
+            # Contents may be rendered in bulk by the parent serializer
+            rendered_contents = self.context.get('data_node_contents', {})
+            if instance.id not in rendered_contents:
+                rendered_contents = DataNodeContentsRenderer(
+                    self.context).render([instance])
             representation.update({
-                'contents': self._data_node_to_data_struct(instance)})
+                'contents': rendered_contents[instance.id]})
             return representation
-
-    def _data_node_to_data_struct(self, data_node):
-        if data_node._is_blank_node():
-            return self.BLANK_NODE_VALUE
-        elif data_node._is_empty_branch():
-            return self.EMPTY_BRANCH_VALUE
-        if data_node.is_leaf:
-            s = DataObjectSerializer(data_node.data_object, context=self.context)
-            return s.data
-        else:
-            contents = [self.BLANK_NODE_VALUE] * data_node.degree
-            for child in data_node.children.all():
-                contents[child.index] = self._data_node_to_data_struct(child)
-            return contents
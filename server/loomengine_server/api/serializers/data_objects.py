@@ -4,6 +4,8 @@ import jsonschema
 import jsonschema.exceptions
 from rest_framework import serializers
 
+from . import is_nested
+from api import representation_cache
 from api.models.data_objects import DataObject, FileResource
 
 
@@ -261,6 +263,15 @@ class DataObjectSerializer(URLDataObjectSerializer):
     datetime_created = serializers.DateTimeField(required=False, format='iso-8601')
     value = DataValueSerializer(source='_value_info', required=False)
 
+    def to_representation(self, instance):
+        if is_nested(self):
+            return super(DataObjectSerializer, self).to_representation(instance)
+        return representation_cache.get_or_render(
+            'data_object', instance, instance.get_representation_version(),
+            self.context,
+            lambda: super(DataObjectSerializer, self).to_representation(
+                instance))
+
 
 class UpdateDataObjectSerializer(DataObjectSerializer):
 
@@ -1,13 +1,15 @@
 from collections import OrderedDict
 import copy
 from rest_framework import serializers
+import django.core.exceptions
 import django.db
-from . import CreateWithParentModelSerializer, RecursiveField, strip_empty_values
-from api import get_setting, connect_data_nodes_to_parents, \
-    match_and_update_by_uuid, reload_models
+from . import CreateWithParentModelSerializer, RecursiveField, \
+    strip_empty_values, is_nested, SparseFieldsMixin
+from api import get_setting, connect_to_parents, match_and_update_by_uuid
 from api.models.data_nodes import DataNode
 from api.models.data_objects import DataObject
 from api.models.runs import Run, UserInput, RunInput, RunOutput, RunEvent
+from api.models.run_submissions import RunSubmission
 from api.models.tasks import Task, TaskInput, TaskOutput, TaskEvent
 from api.models.task_attempts import TaskAttempt, TaskAttemptInput, TaskAttemptOutput, \
     TaskAttemptEvent, TaskAttemptLogFile, TaskMembership
@@ -16,6 +18,7 @@ from api.serializers.templates import TemplateSerializer, URLTemplateSerializer
 from api.serializers.tasks import TaskSerializer, URLTaskSerializer
 from api.serializers.data_channels import DataChannelSerializer
 from api import async
+from api import representation_cache
 
 
 class UserInputSerializer(DataChannelSerializer):
@@ -32,11 +35,14 @@ class RunInputSerializer(DataChannelSerializer):
 
     class Meta:
         model = RunInput
-        fields = ('type', 'channel', 'as_channel', 'data', 'mode', 'group')
+        fields = ('type', 'channel', 'as_channel', 'data', 'mode', 'group',
+                  'staging')
 
     mode = serializers.CharField(required=False)
     group = serializers.IntegerField(required=False)
     as_channel = serializers.CharField(required=False)
+    staging = serializers.ChoiceField(
+        choices=RunInput.STAGING_CHOICES, required=False, allow_blank=True)
 
     def to_representation(self, instance):
         return strip_empty_values(
@@ -67,7 +73,7 @@ class RunEventSerializer(CreateWithParentModelSerializer):
         fields = ('event', 'detail', 'timestamp', 'is_error')
 
 
-class RunSerializer(serializers.HyperlinkedModelSerializer):
+class RunSerializer(SparseFieldsMixin, serializers.HyperlinkedModelSerializer):
 
     class Meta:
         model = Run
@@ -140,7 +146,15 @@ class RunSerializer(serializers.HyperlinkedModelSerializer):
     force_rerun = serializers.BooleanField(required=False, write_only=True)
 
     def to_representation(self, instance):
-        instance.prefetch()
+        if is_nested(self):
+            # Cache only the top-level representation
+            return self._render(instance)
+        return representation_cache.get_or_render(
+            self.get_representation_kind('run'), instance, instance.get_representation_version(),
+            self.context, lambda: self._render(instance))
+
+    def _render(self, instance):
+        instance.prefetch(fields=self.get_rendered_fields())
         return strip_empty_values(
             super(RunSerializer, self).to_representation(instance))
 
@@ -255,6 +269,57 @@ class URLRunSerializer(RunSerializer):
         return strip_empty_values(
             super(RunSerializer, self).to_representation(instance))
 
+class RunSubmissionSerializer(serializers.HyperlinkedModelSerializer):
+
+    class Meta:
+        model = RunSubmission
+        fields = ('uuid',
+                  'url',
+                  'status',
+                  'datetime_created',
+                  'datetime_finished',
+                  'run',
+                  'error',
+                  'run_data',)
+
+    uuid = serializers.UUIDField(read_only=True)
+    url = serializers.HyperlinkedIdentityField(
+        view_name='run-submission-detail',
+        lookup_field='uuid')
+    status = serializers.CharField(read_only=True)
+    datetime_created = serializers.DateTimeField(
+        read_only=True, format='iso-8601')
+    datetime_finished = serializers.DateTimeField(
+        read_only=True, format='iso-8601')
+    run = URLRunSerializer(read_only=True)
+    error = serializers.JSONField(read_only=True)
+    run_data = serializers.JSONField(write_only=True)
+
+    def validate_run_data(self, value):
+        # Only inexpensive checks here. The full validation runs in the
+        # asynchronous job and failures are saved on the RunSubmission.
+        if not isinstance(value, dict):
+            raise serializers.ValidationError(
+                'Expected an object but found "%s"' % value)
+        run_serializer = RunSerializer(context=self.context)
+        run_serializer._lookup_template(value.get('template'))
+        run_serializer.validate_user_inputs(value.get('user_inputs', []))
+        return value
+
+    def create(self, validated_data):
+        request = self.context.get('request')
+        if request:
+            server_url = '%s://%s' % (request.scheme, request.get_host())
+        else:
+            server_url = self.context.get('server_url', '')
+        return RunSubmission.submit(
+            validated_data['run_data'], server_url=server_url)
+
+    def to_representation(self, instance):
+        return strip_empty_values(
+            super(RunSubmissionSerializer, self).to_representation(instance))
+
+
 class UnsavedObjectManager(object):
 
     def __init__(self, serializer_context, serializer_fields):
@@ -298,27 +363,30 @@ class UnsavedObjectManager(object):
         self._root_run_uuid = None
 
     def bulk_create_all(self):
-        bulk_data_objects = DataObject.objects.bulk_create(
-            self._unsaved_data_objects.values())
-        self._new_data_objects = reload_models(DataObject, bulk_data_objects)
-        all_data_objects = [data_object for data_object in self._new_data_objects]
-        all_data_objects.extend(self._preexisting_data_objects.values())
-
+        # New objects get ids before they are saved, so foreign keys to them,
+        # including parent links, are written by the same bulk_create and
+        # nothing has to be reloaded. Parents are saved before children.
+        self._new_data_objects = self._unsaved_data_objects.values()
+        DataObject.allocate_ids(self._new_data_objects)
+        DataObject.bulk_create_with_ids(self._new_data_objects)
+        all_data_objects = self._new_data_objects \
+                           + self._preexisting_data_objects.values()
+
+        self._new_data_nodes = self._unsaved_data_nodes.values()
+        DataNode.allocate_ids(self._new_data_nodes)
         match_and_update_by_uuid(
-            self._unsaved_data_nodes.values(), 'data_object', all_data_objects)
-        bulk_data_nodes = DataNode.objects.bulk_create(
-            self._unsaved_data_nodes.values())
-        self._new_data_nodes = reload_models(DataNode, bulk_data_nodes)
-        all_data_nodes = [data_node for data_node in self._new_data_nodes]
-        all_data_nodes.extend(self._preexisting_data_nodes.values())
-
-        connect_data_nodes_to_parents(
+            self._new_data_nodes, 'data_object', all_data_objects)
+        connect_to_parents(
             self._new_data_nodes, self._data_node_parent_child_relationships)
+        DataNode.bulk_create_with_ids(self._new_data_nodes)
+        all_data_nodes = self._new_data_nodes \
+                         + self._preexisting_data_nodes.values()
 
-        bulk_runs = Run.objects.bulk_create(self._unsaved_runs.values())
-        self._new_runs = reload_models(Run, bulk_runs)
-        all_runs = [run for run in self._new_runs]
-        all_runs.extend(self._preexisting_runs.values())
+        self._new_runs = self._unsaved_runs.values()
+        Run.allocate_ids(self._new_runs)
+        all_runs = self._new_runs + self._preexisting_runs.values()
+        connect_to_parents(all_runs, self._run_parent_child_relationships)
+        Run.bulk_create_with_ids(self._new_runs)
 
         match_and_update_by_uuid(
             self._unsaved_run_inputs, 'run', self._new_runs)
@@ -342,10 +410,21 @@ class UnsavedObjectManager(object):
             self._unsaved_run_events, 'run', self._new_runs)
         RunEvent.objects.bulk_create(self._unsaved_run_events)
 
+        # TaskAttempts are saved before Tasks so that the active
+        # TaskAttempt can be set when the Task is saved
+        self._new_task_attempts = self._unsaved_task_attempts.values()
+        TaskAttempt.allocate_ids(self._new_task_attempts)
+        TaskAttempt.bulk_create_with_ids(self._new_task_attempts)
+        all_task_attempts = self._new_task_attempts \
+                            + self._preexisting_task_attempts.values()
+
+        self._new_tasks = self._unsaved_tasks
+        Task.allocate_ids(self._new_tasks)
         match_and_update_by_uuid(
-            self._unsaved_tasks, 'run', self._new_runs)
-        bulk_tasks = Task.objects.bulk_create(self._unsaved_tasks)
-        self._new_tasks = reload_models(Task, bulk_tasks)
+            self._new_tasks, 'run', self._new_runs)
+        self._connect_tasks_to_active_task_attempts(
+            self._new_tasks, all_task_attempts)
+        Task.bulk_create_with_ids(self._new_tasks)
 
         match_and_update_by_uuid(
             self._unsaved_task_inputs, 'task', self._new_tasks)
@@ -363,15 +442,8 @@ class UnsavedObjectManager(object):
                                  'task', self._new_tasks)
         TaskEvent.objects.bulk_create(self._unsaved_task_events)
 
-        bulk_attempts = TaskAttempt.objects.bulk_create(
-            self._unsaved_task_attempts.values())
-        self._new_task_attempts = reload_models(TaskAttempt, bulk_attempts)
-        all_task_attempts = [task_attempt for task_attempt
-                             in self._new_task_attempts]
-        all_task_attempts.extend(self._preexisting_task_attempts.values())
         match_and_update_by_uuid(self._unsaved_task_attempt_inputs,
                                  'task_attempt', self._new_task_attempts)
-
         match_and_update_by_uuid(
             self._unsaved_task_attempt_inputs, 'data_node', all_data_nodes)
         TaskAttemptInput.objects.bulk_create(
@@ -395,9 +467,6 @@ class UnsavedObjectManager(object):
                                  'task_attempt', self._new_task_attempts)
         TaskAttemptLogFile.objects.bulk_create(self._unsaved_task_attempt_log_files)
 
-        self._connect_tasks_to_active_task_attempts(
-            self._new_tasks, all_task_attempts)
-
         match_and_update_by_uuid(
             self._unsaved_task_to_all_task_attempts_m2m_relationships,
             'parent_task', self._new_tasks)
@@ -407,9 +476,6 @@ class UnsavedObjectManager(object):
         TaskMembership.objects.bulk_create(
             self._unsaved_task_to_all_task_attempts_m2m_relationships)
 
-        self._connect_runs_to_parents(all_runs)
-
-        # Reload
         matches = filter(
             lambda r: r.uuid==self._root_run_uuid, all_runs)
         assert len(matches) == 1, '1 run should match uuid of root'
@@ -644,20 +710,16 @@ class UnsavedObjectManager(object):
                     data={'value': contents})
                 self._unsaved_data_objects[
                     data_node.data_object.uuid] = data_node.data_object
-        file_lookups = DataObject.filter_multiple_by_name_or_id_or_tag_or_hash(
-            file_references.keys())
-        for reference, data_objects in file_lookups.iteritems():
-            if len(data_objects) == 0:
-                raise serializers.ValidationError(
-                    'No file found for reference "%s"' % reference)
-            if len(data_objects) > 1:
-                raise serializers.ValidationError(
-                    'Found %s files for reference "%s", expected 1.'
-                    % (len(dataobjects), reference))
+        try:
+            file_lookups = DataObject.get_files_by_values(
+                file_references.keys())
+        except django.core.exceptions.ValidationError as e:
+            raise serializers.ValidationError(e.messages)
+        for reference, data_object in file_lookups.iteritems():
             for data_node in file_references[reference]:
-                data_node.data_object = data_objects[0]
+                data_node.data_object = data_object
                 self._preexisting_data_objects[
-                    data_objects[0].uuid] = data_objects[0]
+                    data_object.uuid] = data_object
 
         data_object_uuids = self._unsaved_data_objects.keys()
         preexisting_data_objects = DataObject.objects.filter(
@@ -760,6 +822,10 @@ class UnsavedObjectManager(object):
                     request.scheme,
 		    request.get_host()),
 	    })
+        elif self._serializer_context.get('server_url'):
+            # Runs created by an asynchronous job have no request
+            context.update({
+                'server_url': self._serializer_context.get('server_url')})
         return context
 
     def _create_unsaved_task(self, task_data, run):
@@ -848,20 +914,13 @@ class UnsavedObjectManager(object):
         return task_attempt
 
     def _connect_tasks_to_active_task_attempts(self, tasks, task_attempts):
-        params = []
-        for task_uuid, task_attempt_uuid in self._task_to_task_attempt_relationships:
-            task = filter(lambda t: t.uuid==task_uuid, tasks)[0]
-            task_attempt = filter(
-                lambda ta: ta.uuid==task_attempt_uuid, task_attempts)[0]
-            params.append((task.id, task_attempt.id))
-        if params:
-            case_statement = ' '.join(
-                ['WHEN id=%s THEN %s' % pair for pair in params])
-            id_list = ', '.join(['%s' % pair[0] for pair in params])
-            sql = 'UPDATE api_task SET task_attempt_id= CASE %s END WHERE id IN (%s)'\
-                                                        % (case_statement, id_list)
-            with django.db.connection.cursor() as cursor:
-                cursor.execute(sql)
+        tasks_by_uuid = dict((task.uuid, task) for task in tasks)
+        task_attempts_by_uuid = dict(
+            (task_attempt.uuid, task_attempt) for task_attempt in task_attempts)
+        for task_uuid, task_attempt_uuid \
+            in self._task_to_task_attempt_relationships:
+            tasks_by_uuid[task_uuid].task_attempt \
+                = task_attempts_by_uuid[task_attempt_uuid]
 
     def _create_unsaved_data_object(self, contents):
         contents.pop('url')
@@ -890,6 +949,7 @@ class UnsavedObjectManager(object):
         run_input['group'] = template_input.group
         run_input['channel'] = template_input.channel
         run_input['as_channel'] = template_input.as_channel
+        run_input['staging'] = template_input.staging
         run_input_model = RunInput(**run_input)
         return run_input_model
 
@@ -911,23 +971,6 @@ class UnsavedObjectManager(object):
         run_output_model = RunOutput(**run_output)
         return run_output_model
 
-    def _connect_runs_to_parents(self, runs):
-        params = []
-        for parent_uuid, child_uuid in self._run_parent_child_relationships:
-            child = filter(
-                lambda r: r.uuid==child_uuid, runs)[0]
-            parent = filter(
-                lambda r: r.uuid==parent_uuid, runs)[0]
-            params.append((child.id, parent.id))
-        if params:
-            case_statement = ' '.join(
-                ['WHEN id=%s THEN %s' % pair for pair in params])
-            id_list = ', '.join(['%s' % pair[0] for pair in params])
-            sql = 'UPDATE api_run SET parent_id= CASE %s END WHERE id IN (%s)'\
-                                                 % (case_statement, id_list)
-            with django.db.connection.cursor() as cursor:
-                cursor.execute(sql)
-
     def _connect_inputs_outputs(self, run):
         parent = None
         self._connect_outputs(run, parent)
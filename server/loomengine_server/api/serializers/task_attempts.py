@@ -1,6 +1,6 @@
 from rest_framework import serializers
 
-from . import CreateWithParentModelSerializer
+from . import CreateWithParentModelSerializer, SparseFieldsMixin
 from api.models.task_attempts import TaskAttempt, TaskAttemptOutput, \
     TaskAttemptInput, TaskAttemptLogFile, TaskAttemptEvent
 from api.serializers.data_objects import DataObjectSerializer
@@ -11,9 +11,12 @@ class TaskAttemptInputSerializer(DataChannelSerializer):
 
     class Meta:
         model = TaskAttemptInput
-        fields = ('type', 'channel', 'data', 'mode')
+        fields = ('type', 'channel', 'data', 'mode', 'staging')
 
     mode = serializers.CharField()
+    staging = serializers.ChoiceField(
+        choices=TaskAttemptInput.STAGING_CHOICES, required=False,
+        allow_blank=True)
 
 
 class URLTaskAttemptOutputSerializer(serializers.HyperlinkedModelSerializer):
@@ -120,7 +123,8 @@ _task_attempt_fields = [
 ]
 
 
-class TaskAttemptSerializer(serializers.HyperlinkedModelSerializer):
+class TaskAttemptSerializer(SparseFieldsMixin,
+                            serializers.HyperlinkedModelSerializer):
 
     class Meta:
         model = TaskAttempt
@@ -178,7 +182,7 @@ class TaskAttemptSerializer(serializers.HyperlinkedModelSerializer):
         return instance
 
     def to_representation(self, instance):
-        instance.prefetch()
+        instance.prefetch(fields=self.get_rendered_fields())
         return super(TaskAttemptSerializer, self).to_representation(instance)
 
 
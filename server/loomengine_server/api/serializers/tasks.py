@@ -1,6 +1,6 @@
 from rest_framework import serializers
 
-from . import CreateWithParentModelSerializer
+from . import CreateWithParentModelSerializer, SparseFieldsMixin
 from api.models.data_objects import DataObject
 from api.models.tasks import Task, TaskInput, TaskOutput, \
     TaskEvent
@@ -20,10 +20,12 @@ class TaskInputSerializer(DataChannelSerializer):
 
     class Meta:
         model = TaskInput
-        fields = ('data', 'type', 'channel', 'as_channel',  'mode')
+        fields = ('data', 'type', 'channel', 'as_channel',  'mode', 'staging')
 
     mode = serializers.CharField()
     as_channel = serializers.CharField(required=False, allow_null=True)
+    staging = serializers.ChoiceField(
+        choices=TaskInput.STAGING_CHOICES, required=False, allow_blank=True)
 
 
 class TaskOutputSerializer(DataChannelSerializer):
@@ -65,7 +67,7 @@ _task_serializer_fields = [
 ]
 
 
-class TaskSerializer(serializers.HyperlinkedModelSerializer):
+class TaskSerializer(SparseFieldsMixin, serializers.HyperlinkedModelSerializer):
 
     class Meta:
         model = Task
@@ -101,7 +103,7 @@ class TaskSerializer(serializers.HyperlinkedModelSerializer):
     status = serializers.CharField(read_only=True)
 
     def to_representation(self, instance):
-        instance.prefetch()
+        instance.prefetch(fields=self.get_rendered_fields())
         return super(TaskSerializer, self).to_representation(instance)
 
 
@@ -5,9 +5,10 @@ from jinja2.exceptions import UndefinedError
 from rest_framework import serializers
 
 from . import RecursiveField, strip_empty_values, match_and_update_by_uuid, \
-    reload_models
+    reload_models, is_nested, SparseFieldsMixin
 from .data_channels import DataChannelSerializer
 from api import async
+from api import representation_cache
 from api.models import render_from_template, render_string_or_list, \
     positiveIntegerDefaultDict
 from api.models.templates import Template, TemplateInput, TemplateMembership
@@ -45,7 +46,8 @@ class TemplateInputSerializer(DataChannelSerializer):
 
     class Meta:
         model = TemplateInput
-        fields = ('type', 'channel', 'as_channel', 'data', 'hint', 'mode', 'group')
+        fields = ('type', 'channel', 'as_channel', 'data', 'hint', 'mode', 'group',
+                  'staging')
 
     hint = serializers.CharField(required=False, allow_blank=True)
     mode = serializers.CharField(required=False, allow_blank=True)
@@ -53,9 +55,12 @@ class TemplateInputSerializer(DataChannelSerializer):
     # Override data to make it non-required
     data = serializers.JSONField(required=False, allow_null=True) 
     as_channel = serializers.CharField(required=False, allow_null=True)
+    staging = serializers.ChoiceField(
+        choices=TemplateInput.STAGING_CHOICES, required=False, allow_blank=True)
 
 
-class TemplateSerializer(serializers.HyperlinkedModelSerializer):
+class TemplateSerializer(SparseFieldsMixin,
+                         serializers.HyperlinkedModelSerializer):
 
     class Meta:
         model = Template
@@ -98,7 +103,15 @@ class TemplateSerializer(serializers.HyperlinkedModelSerializer):
     steps = RecursiveField(many=True, required=False)
 
     def to_representation(self, instance):
-        instance.prefetch()
+        if is_nested(self):
+            # Cache only the top-level representation
+            return self._render(instance)
+        return representation_cache.get_or_render(
+            self.get_representation_kind('template'), instance, instance.get_representation_version(),
+            self.context, lambda: self._render(instance))
+
+    def _render(self, instance):
+        instance.prefetch(fields=self.get_rendered_fields())
         return strip_empty_values(
             super(TemplateSerializer, self).to_representation(instance))
 
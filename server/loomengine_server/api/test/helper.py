@@ -1,3 +1,5 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 import os
 import yaml
 
@@ -50,3 +52,30 @@ def request_run_from_template_file(template_path, **kwargs):
     s.is_valid(raise_exception=True)
     template = s.save()
     return request_run(template, **kwargs)
+
+def count_queries(function):
+    with CaptureQueriesContext(connection) as context:
+        function()
+    return len(context.captured_queries)
+
+def assert_query_budget(test_case, create, render, sizes, budget):
+    """For each size, create an object with create(size) and check that
+    render(object) makes no more than budget queries, and no more
+    queries than for the smallest size. Returns the query count
+    for each size.
+    """
+    counts = []
+    for size in sorted(sizes):
+        instance = create(size)
+        count = count_queries(lambda: render(instance))
+        test_case.assertLessEqual(
+            count, budget,
+            'Rendering with size %s made %s queries. Budget is %s.'
+            % (size, count, budget))
+        if counts:
+            test_case.assertLessEqual(
+                count, counts[0][1],
+                'Rendering with size %s made %s queries but size %s '\
+                'made only %s' % (size, count, counts[0][0], counts[0][1]))
+        counts.append((size, count))
+    return counts
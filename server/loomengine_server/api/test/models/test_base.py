@@ -1,7 +1,11 @@
-from django.test import TestCase
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 
 from api.models.base import FilterHelper
+from api.models.data_nodes import DataNode
 from api.models.data_objects import DataObject, FileResource
+from api.models import id_sequences
 from api import exceptions
 
 
@@ -185,3 +189,44 @@ class TestBase(TestCase):
         file1.save()
         with self.assertRaises(exceptions.ConcurrentModificationError):
             file2.save()
+
+    def testAllocateIds(self):
+        saved = DataNode.objects.create(type='string')
+        data_nodes = [DataNode(type='string') for i in range(3)]
+        DataNode.allocate_ids(data_nodes)
+        ids = [data_node.id for data_node in data_nodes]
+        self.assertEqual(ids, range(saved.id + 1, saved.id + 4))
+
+        # Parent links are written by bulk_create
+        data_nodes[1].parent = data_nodes[0]
+        DataNode.objects.bulk_create(data_nodes)
+        self.assertEqual(
+            DataNode.objects.get(id=data_nodes[1].id).parent_id,
+            data_nodes[0].id)
+        self.assertEqual(
+            DataNode.objects.create(type='string').id, saved.id + 4)
+
+
+class TestIdBlocks(TransactionTestCase):
+
+    def setUp(self):
+        # Start without a block left by an earlier test
+        id_sequences._id_blocks.clear()
+
+    def testSavesOutsideTransactionShareBlock(self):
+        first = DataNode.objects.create(type='string')
+        with CaptureQueriesContext(connection) as context:
+            data_nodes = [DataNode.objects.create(type='string')
+                          for i in range(3)]
+        self.assertEqual([data_node.id for data_node in data_nodes],
+                         range(first.id + 1, first.id + 4))
+        self.assertFalse(any('api_idsequence' in query['sql']
+                             for query in context.captured_queries))
+
+        # Bulk allocations do not take ids from the block
+        bulk = [DataNode(type='string')
+                for i in range(id_sequences.ID_BLOCK_SIZE)]
+        DataNode.allocate_ids(bulk)
+        self.assertEqual(bulk[0].id, first.id + id_sequences.ID_BLOCK_SIZE)
+        self.assertEqual(
+            DataNode.objects.create(type='string').id, first.id + 4)
@@ -3,6 +3,7 @@ from django.test import TestCase
 
 from api.test.models import _get_string_data_object
 from api.models.data_nodes import *
+from api.models import calculate_contents_fingerprint
 
 
 class TestDataNode(TestCase):
@@ -233,6 +234,17 @@ class TestDataNode(TestCase):
         self.assertNotEqual(leaf.uuid, clone.uuid)
         self.assertEqual(leaf.data_object.uuid, clone.data_object.uuid)
 
+    def testGetFlatNode_flat(self):
+        tree = self.getTree(self.INPUT_DATA)
+        branch = tree.get_node([(2,3)])
+        self.assertEqual(branch.get_flat_node().uuid, branch.uuid)
+
+    def testGetFlatNode_nested(self):
+        tree = self.getTree(self.INPUT_DATA)
+        flat_node = tree.get_flat_node()
+        self.assertNotEqual(flat_node.uuid, tree.uuid)
+        self.assertEqual(flat_node.degree, 8)
+
     def testGetOrCreateNode_existing(self):
         tree = self.getTree(self.INPUT_DATA)
 
@@ -255,6 +267,30 @@ class TestDataNode(TestCase):
             node.calculate_contents_fingerprint(),
             'd7405829b255d1dd4af90780a4b20286')
 
+    def testGetContentsFingerprint(self):
+        node = self.getTree(self.INPUT_DATA)
+        self.assertEqual(
+            node.get_contents_fingerprint(),
+            calculate_contents_fingerprint(
+                node._get_fingerprintable_data_node_struct()))
+        self.assertEqual(
+            DataNode.objects.get(id=node.id).contents_fingerprint,
+            node.get_contents_fingerprint())
+
+    def testGetContentsFingerprint_incomplete(self):
+        node = self.getTree(self.INPUT_DATA[:3])
+        node.get_contents_fingerprint()
+        self.assertIsNone(
+            DataNode.objects.get(id=node.id).contents_fingerprint)
+
+    def testFlattenedCloneContentsFingerprint(self):
+        tree = self.getTree(self.INPUT_DATA)
+        clone = tree.flattened_clone()
+        self.assertEqual(
+            clone.contents_fingerprint,
+            calculate_contents_fingerprint(
+                clone._get_fingerprintable_data_node_struct()))
+
     def testCalculateContentsFingerprintOrderMatters(self):
         swapped_order_input_data=(
             ([(0,3),(0,1)], 'i'),
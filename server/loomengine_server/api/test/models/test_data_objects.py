@@ -1,5 +1,5 @@
 import os
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.core.exceptions import ValidationError
 
 from api.models.data_objects import DataObject, FileResource
@@ -105,6 +105,28 @@ class TestDataObject(TestCase):
         with self.assertRaises(ValidationError):
             DataObject.get_by_value(filename_1, 'file')
 
+    def testGetFilesByValues(self):
+        do_1 = DataObject.create_and_initialize_file_resource(
+            filename=filename_1, md5=md5_1, source_type='result')
+        do_2 = DataObject.create_and_initialize_file_resource(
+            filename='other.txt', md5=md5_1, source_type='result')
+        references = [filename_1, '@%s' % do_2.uuid[:8],
+                      'other.txt$%s' % md5_1[:6]]
+        data_objects = DataObject.get_files_by_values(references)
+        self.assertEqual(data_objects[filename_1].uuid, do_1.uuid)
+        self.assertEqual(data_objects['@%s' % do_2.uuid[:8]].uuid, do_2.uuid)
+        self.assertEqual(data_objects['other.txt$%s' % md5_1[:6]].uuid,
+                         do_2.uuid)
+
+    def testGetFilesByValues_errorsInOneBatch(self):
+        DataObject.create_and_initialize_file_resource(
+            filename=filename_1, md5=md5_1, source_type='result')
+        DataObject.create_and_initialize_file_resource(
+            filename=filename_1, md5=md5_1, source_type='result')
+        with self.assertRaises(ValidationError) as context:
+            DataObject.get_files_by_values([filename_1, 'noMatch'])
+        self.assertEqual(len(context.exception.messages), 2)
+
     def testCalculateContentsFingerprint_integer(self):
         contents = {'type': 'integer',
                     'value':17}
@@ -128,6 +150,14 @@ class TestDataObject(TestCase):
         self.assertEqual(do.calculate_contents_fingerprint(),
                          calculate_contents_fingerprint(contents))
 
+    def testGetContentsFingerprint(self):
+        do = DataObject.get_by_value(17, 'integer')
+        fingerprint = do.get_contents_fingerprint()
+        self.assertEqual(fingerprint, do.calculate_contents_fingerprint())
+        self.assertEqual(
+            DataObject.objects.get(id=do.id).contents_fingerprint,
+            fingerprint)
+
 
 class TestFileResource(TestCase):
 
@@ -160,3 +190,54 @@ class TestFileResource(TestCase):
             data_object=data_object, filename=filename_1,
             md5=md5_1, source_type='result')
         self.assertEqual(resource.get_uuid(), data_object.uuid)
+
+    def _create_complete_resource(self):
+        resource = FileResource.initialize(
+            data_object=DataObject.objects.create(type='file'),
+            filename=filename_1, md5=md5_1, source_type='result')
+        resource.upload_status = 'complete'
+        resource.save()
+        return resource
+
+    def testInitializeSharesStoredFile(self):
+        stored = self._create_complete_resource()
+        resource = FileResource.initialize(
+            data_object=DataObject.objects.create(type='file'),
+            filename='other.txt', md5=md5_1, source_type='imported')
+        self.assertEqual(resource.file_url, stored.file_url)
+        self.assertEqual(resource.upload_status, 'complete')
+
+    def testSaveSharedFileAfterStoredFileDeleted(self):
+        stored = self._create_complete_resource()
+        resource = FileResource.initialize(
+            data_object=DataObject.objects.create(type='file'),
+            filename='other.txt', md5=md5_1, source_type='imported')
+        # The last FileResource using the file is kept until the file is
+        # deleted, but it no longer has upload_status 'complete'
+        stored.setattrs_and_save_with_retries({'upload_status': 'deleting'})
+        self.assertFalse(stored.delete_if_file_is_shared())
+        resource.save()
+        # The file is uploaded again rather than sharing a deleted file
+        self.assertNotEqual(resource.file_url, stored.file_url)
+        self.assertIn('other.txt', resource.file_url)
+        self.assertEqual(resource.upload_status, 'incomplete')
+
+    @override_settings(DEDUPLICATE_FILE_UPLOADS=False)
+    def testInitializeWithoutDeduplication(self):
+        stored = self._create_complete_resource()
+        resource = FileResource.initialize(
+            data_object=DataObject.objects.create(type='file'),
+            filename='other.txt', md5=md5_1, source_type='imported')
+        self.assertNotEqual(resource.file_url, stored.file_url)
+        self.assertEqual(resource.upload_status, 'incomplete')
+
+    def testDeleteIfFileIsShared(self):
+        stored = self._create_complete_resource()
+        resource = FileResource.initialize(
+            data_object=DataObject.objects.create(type='file'),
+            filename=filename_1, md5=md5_1, source_type='result')
+        resource.save()
+        self.assertTrue(stored.delete_if_file_is_shared())
+        self.assertFalse(resource.delete_if_file_is_shared())
+        # The last one is kept until its file is deleted
+        self.assertEqual(list(FileResource.objects.all()), [resource])
@@ -1,9 +1,12 @@
 from collections import OrderedDict
-from django.test import TestCase
+from django.test import TestCase, override_settings
 import hashlib
+import jinja2
 import json
 
+import api.models
 from api.models import render_from_template, render_string_or_list, \
+    render_many_from_template, get_compiled_template, \
     calculate_contents_fingerprint
 
 
@@ -15,6 +18,30 @@ class TestRenderFromTemplate(TestCase):
         rendered_text = render_from_template(raw_text, context)
         self.assertEqual(rendered_text, 'My name is Inigo')
 
+    def testRenderFromTemplateUndefined(self):
+        with self.assertRaises(jinja2.exceptions.UndefinedError):
+            render_from_template('My name is {{name}}', {})
+
+    def testRenderManyFromTemplate(self):
+        raw_text = 'My name is {{name}}'
+        contexts = [{'name': 'Inigo'}, {'name': 'Fezzik'}]
+        self.assertEqual(render_many_from_template(raw_text, contexts),
+                         ['My name is Inigo', 'My name is Fezzik'])
+
+    def testGetCompiledTemplateCached(self):
+        raw_text = 'cached {{name}}'
+        self.assertIs(get_compiled_template(raw_text),
+                      get_compiled_template(raw_text))
+
+    @override_settings(JINJA_TEMPLATE_CACHE_SIZE=2)
+    def testGetCompiledTemplateEvictsLeastRecentlyUsed(self):
+        get_compiled_template('first {{name}}')
+        get_compiled_template('second {{name}}')
+        get_compiled_template('first {{name}}')
+        get_compiled_template('third {{name}}')
+        self.assertEqual(list(api.models._compiled_templates.keys()),
+                         ['first {{name}}', 'third {{name}}'])
+
 
 class TestRenderFromStringOrList(TestCase):
 
@@ -3,7 +3,8 @@ from django.test import TestCase
 from api.test.models import _get_string_data_object
 from api.models.data_objects import DataObject
 from api.models.data_nodes import DataNode
-from api.models.input_calculator import InputCalculator, InputSetGeneratorNode
+from api.models.input_calculator import InputCalculator, InputSetGeneratorNode, \
+    iter_chunks
 from api.models.runs import Run, RunInput
 
 scalar_input_text = 'scalar data'
@@ -297,6 +298,20 @@ class TestInputSetGeneratorNode(TestCase):
         self.assertEqual(input_sets_reverse[0].input_items[1]\
                           .data_node.data_object.substitution_value, 'i')
 
+    def testIterCrossProduct(self):
+        step_run_input_full = getInputWithFullTree(mode='no_gather')
+        step_run_input_partial = getInputWithPartialTree(mode='no_gather')
+        generator_full = InputSetGeneratorNode.create_from_data_channel(
+            step_run_input_full)
+        generator_partial = InputSetGeneratorNode.create_from_data_channel(
+            step_run_input_partial)
+        generator_combined = generator_full.cross_product(generator_partial)
+        input_sets = generator_combined.iter_input_sets(())
+        first_input_set = next(input_sets)
+        self.assertEqual(first_input_set.path, ((0,3),(0,1),(0,3),(0,1)))
+        self.assertEqual(first_input_set.data_path, [[0,3],[0,1],[0,3],[0,1]])
+        self.assertEqual(len(list(input_sets)), 3 * 8 - 1)
+
 
 # TEST CASES
 # isang group lang:
@@ -316,3 +331,9 @@ class TestInputSetGeneratorNode(TestCase):
 # NEG TEST CASES
 # Gather on channel with scalar data
 
+
+class TestIterChunks(TestCase):
+
+    def testIterChunks(self):
+        chunks = list(iter_chunks(iter(range(7)), 3))
+        self.assertEqual(chunks, [[0,1,2],[3,4,5],[6]])
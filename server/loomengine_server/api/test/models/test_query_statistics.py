@@ -0,0 +1,94 @@
+from django.db import connection
+from django.test import TestCase, override_settings
+
+from api import query_stats
+from api.models import QueryStatistic, merge_slowest
+
+
+class TestQueryStatistic(TestCase):
+
+    def testAdd(self):
+        QueryStatistic.add('request', 'GET run-detail', calls=1, queries=3,
+                           db_time=0.5, max_queries=3,
+                           slowest=[{'time': 0.3, 'sql': 'a'}])
+        QueryStatistic.add('request', 'GET run-detail', calls=2, queries=5,
+                           db_time=0.25, max_queries=4,
+                           slowest=[{'time': 0.2, 'sql': 'b'}])
+        statistic = QueryStatistic.objects.get(
+            kind='request', name='GET run-detail')
+        self.assertEqual(statistic.calls, 3)
+        self.assertEqual(statistic.queries, 8)
+        self.assertEqual(statistic.db_time, 0.75)
+        self.assertEqual(statistic.max_queries, 4)
+        self.assertEqual([s['sql'] for s in statistic.slowest], ['a', 'b'])
+
+    def testMergeSlowest(self):
+        statements = [{'time': float(i), 'sql': str(i)} for i in range(10)]
+        slowest = merge_slowest(statements[:5], statements[5:])
+        self.assertEqual([s['sql'] for s in slowest],
+                         ['9', '8', '7', '6', '5'])
+
+
+@override_settings(QUERY_STATS=True)
+class TestQueryStats(TestCase):
+
+    def tearDown(self):
+        query_stats.pending_statistics.clear()
+
+    def _get_query_log(self, queries):
+        query_log = query_stats.QueryLog()
+        for query_time, sql in queries:
+            query_log.append({'time': str(query_time), 'sql': sql})
+        return query_log
+
+    @override_settings(QUERY_STATS_FLUSH_INTERVAL_SECONDS=3600)
+    def testAddWithoutFlush(self):
+        query_stats.pending_statistics.add(
+            'task', 'api.async.some_task', self._get_query_log([(0.1, 'a')]))
+        self.assertFalse(QueryStatistic.objects.exists())
+        query_stats.flush()
+        statistic = QueryStatistic.objects.get(
+            kind='task', name='api.async.some_task')
+        self.assertEqual(statistic.queries, 1)
+
+    @override_settings(QUERY_STATS_FLUSH_INTERVAL_SECONDS=0)
+    def testAddWithFlush(self):
+        query_stats.pending_statistics.add(
+            'task', 'api.async.some_task',
+            self._get_query_log([(0.1, 'a'), (0.2, 'b')]))
+        statistic = QueryStatistic.objects.get(
+            kind='task', name='api.async.some_task')
+        self.assertEqual(statistic.queries, 2)
+        self.assertEqual(statistic.slowest[0]['sql'], 'b')
+
+    def testRecorder(self):
+        recorder = query_stats.QueryRecorder()
+        recorder.start()
+        list(QueryStatistic.objects.all())
+        queries = recorder.stop()
+        self.assertEqual(queries.count, 1)
+
+    def testRecorderWithFullQueriesLog(self):
+        # Celery workers never clear connection.queries_log
+        for i in range(connection.queries_limit):
+            connection.queries_log.append({'time': '0.0', 'sql': 'old'})
+        recorder = query_stats.QueryRecorder()
+        recorder.start()
+        list(QueryStatistic.objects.all())
+        queries = recorder.stop()
+        self.assertEqual(queries.count, 1)
+        self.assertNotEqual(queries.slowest[0]['sql'], 'old')
+
+    def testQueryLogKeepsSlowest(self):
+        query_log = self._get_query_log(
+            [(float(i), str(i)) for i in range(10)])
+        self.assertEqual(query_log.count, 10)
+        self.assertEqual(query_log.time, 45.0)
+        self.assertEqual([s['sql'] for s in query_log.slowest],
+                         ['9', '8', '7', '6', '5'])
+
+    def testReset(self):
+        QueryStatistic.add('request', 'GET run-list', calls=1, queries=1,
+                           db_time=0.1, max_queries=1, slowest=[])
+        query_stats.reset()
+        self.assertFalse(QueryStatistic.objects.exists())
@@ -1,6 +1,10 @@
+from datetime import timedelta
 from django.test import TestCase, override_settings
+from django.utils import timezone
 import yaml
 
+from api import async
+
 from api.test.models.test_templates import get_template
 from api.models.data_objects import *
 from api.models.runs import Run, TaskNode
@@ -29,6 +33,84 @@ class TestRun(TestCase):
             .is_connected(
                 run.inputs.get(channel='one')))
 
+    def testRequestPushAllInputs(self):
+        with self.settings(TEST_DISABLE_ASYNC_DELAY=True,
+                           TEST_NO_PUSH_INPUTS=True):
+            run = get_run()
+            run.request_push_all_inputs()
+        run = Run.objects.get(id=run.id)
+        self.assertEqual(run.push_inputs_status, 'idle')
+        self.assertFalse(run.push_inputs_pending)
+
+    def testRequestPushAllInputs_inProgress(self):
+        with self.settings(TEST_DISABLE_ASYNC_DELAY=True,
+                           TEST_NO_PUSH_INPUTS=True):
+            run = get_run()
+            Run.objects.filter(id=run.id).update(
+                push_inputs_status='in_progress')
+            run.request_push_all_inputs()
+        # The job in progress is flagged to run again rather than
+        # starting a second job
+        run = Run.objects.get(id=run.id)
+        self.assertEqual(run.push_inputs_status, 'in_progress')
+        self.assertTrue(run.push_inputs_pending)
+
+    def testRequestPushAllInputs_jobKilled(self):
+        with self.settings(TEST_DISABLE_ASYNC_DELAY=True,
+                           TEST_NO_PUSH_INPUTS=True):
+            run = get_run()
+        pushed = []
+        def push_all_inputs(run):
+            pushed.append(run.id)
+            if len(pushed) == 1:
+                # The worker dies in the middle of the first job
+                raise SystemExit
+        original_push_all_inputs = Run.push_all_inputs
+        Run.push_all_inputs = push_all_inputs
+        try:
+            with self.settings(TEST_DISABLE_ASYNC_DELAY=True):
+                with self.assertRaises(SystemExit):
+                    run.request_push_all_inputs()
+                # The lost job still holds the lock
+                run.request_push_all_inputs()
+                async.check_for_stalled_push_inputs()
+                self.assertEqual(len(pushed), 1)
+                # Until the lock expires
+                Run.objects.filter(id=run.id).update(
+                    push_inputs_changed=timezone.now() - timedelta(days=1))
+                async.check_for_stalled_push_inputs()
+        finally:
+            Run.push_all_inputs = original_push_all_inputs
+        self.assertEqual(len(pushed), 2)
+        run = Run.objects.get(id=run.id)
+        self.assertEqual(run.push_inputs_status, 'idle')
+        self.assertFalse(run.push_inputs_pending)
+
+    def testRequestPushAllInputs_staleRunSaved(self):
+        with self.settings(TEST_DISABLE_ASYNC_DELAY=True,
+                           TEST_NO_PUSH_INPUTS=True):
+            run = get_run()
+            Run.objects.filter(id=run.id).update(
+                push_inputs_status='in_progress')
+            run = Run.objects.get(id=run.id)
+            stale_run = Run.objects.get(id=run.id)
+            run.request_push_all_inputs()
+            stale_run.set_running_status()
+        # Saving the stale instance does not clear the flags
+        run = Run.objects.get(id=run.id)
+        self.assertTrue(run.status_is_running)
+        self.assertEqual(run.push_inputs_status, 'in_progress')
+        self.assertTrue(run.push_inputs_pending)
+
+    def testGetSubtreeVersion(self):
+        with self.settings(TEST_DISABLE_ASYNC_DELAY=True,
+                           TEST_NO_PUSH_INPUTS=True):
+            run = get_run()
+        version = Run.objects.get(id=run.id).get_subtree_version()
+        run.steps.first().add_event('test event')
+        self.assertNotEqual(
+            Run.objects.get(id=run.id).get_subtree_version(), version)
+
 
 class TestInputCalculator(TestCase):
 
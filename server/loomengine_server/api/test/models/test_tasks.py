@@ -1,8 +1,13 @@
 from django.test import TestCase
+from django.contrib.auth.models import User
+from rest_framework.test import APIRequestFactory, force_authenticate
 
 from api.test.models import _get_string_data_node
 from api.models.data_objects import *
 from api.models.tasks import *
+from api.models.task_attempts import TaskAttemptLogFile
+from api.serializers.task_attempts import TaskAttemptOutputUpdateSerializer
+from api.views import TaskViewSet
 
 
 def get_task():
@@ -71,6 +76,73 @@ class TestTask(TestCase):
         self.assertEqual(self.task.calculate_contents_fingerprint(),
                          'adf76dc0c0a43cbc2e5e9f8a001ccfbf')
 
+    def testGetCachedTaskAttempts(self):
+        task_attempt = self.task.create_and_activate_task_attempt()
+        fingerprint = self.task.get_fingerprint()
+        fingerprint.update_task_attempt_maybe(task_attempt)
+        cached = Task._get_cached_task_attempts(
+            [self.task], self.task.inputs.all(), self.task.outputs.all())
+        self.assertEqual(cached[self.task.uuid].uuid, task_attempt.uuid)
+
+    def testGetCachedTaskAttempts_noMatch(self):
+        cached = Task._get_cached_task_attempts(
+            [self.task], self.task.inputs.all(), self.task.outputs.all())
+        self.assertEqual(cached, {})
+
+    def testGetVersion(self):
+        version = self.task.get_version()
+        self.assertEqual(self.task.get_version(), version)
+        self.task.add_event('test event')
+        self.assertNotEqual(self.task.get_version(), version)
+
+    def _get_etag(self):
+        request = APIRequestFactory().get('/api/tasks/%s/' % self.task.uuid)
+        force_authenticate(request, user=User(username='test'))
+        view = TaskViewSet.as_view({'get': 'retrieve'})
+        response = view(request, uuid=self.task.uuid)
+        self.assertEqual(response.status_code, 200)
+        return response['ETag']
+
+    def _list_tasks(self, query):
+        request = APIRequestFactory().get('/api/tasks/?%s' % query)
+        force_authenticate(request, user=User(username='test'))
+        view = TaskViewSet.as_view({'get': 'list'})
+        return view(request)
+
+    def testListSparseFields(self):
+        response = self._list_tasks('fields=uuid,status,url&exclude=url')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual(sorted(response.data[0].keys()), ['status', 'uuid'])
+
+    def testListSparseFieldsInvalid(self):
+        response = self._list_tasks('fields=uuid,command')
+        self.assertEqual(response.status_code, 400)
+
+    def testETagChangesWhenLogUploaded(self):
+        task_attempt = self.task.create_and_activate_task_attempt()
+        data_object = DataObject.create_and_initialize_file_resource(
+            filename='stdout.log', md5='d8e8fca2dc0f896fd7cb4cb0031ba249',
+            source_type='log', task_attempt=task_attempt)
+        TaskAttemptLogFile.objects.create(
+            task_attempt=task_attempt, log_name='stdout',
+            data_object=data_object)
+        etag = self._get_etag()
+        data_object.file_resource.setattrs_and_save_with_retries(
+            {'upload_status': 'complete'})
+        self.assertNotEqual(self._get_etag(), etag)
+
+    def testETagChangesWhenOutputUpdated(self):
+        task_attempt = self.task.create_and_activate_task_attempt()
+        etag = self._get_etag()
+        s = TaskAttemptOutputUpdateSerializer(
+            task_attempt.outputs.first(),
+            data={'data': {'contents': 'output text'}},
+            partial=True)
+        s.is_valid(raise_exception=True)
+        s.save()
+        self.assertNotEqual(self._get_etag(), etag)
+
 
 class TestTaskAttempt(TestCase):
 
@@ -89,6 +161,20 @@ class TestTaskAttempt(TestCase):
                          'input2.txt')
 
 
+class TestTaskAttemptDataNodes(TestCase):
+
+    def testCreateAttemptSharesInputDataNodes(self):
+        task = get_task()
+        data_node_count = DataNode.objects.count()
+        task_attempt = task.create_and_activate_task_attempt()
+        # Inputs reuse the Task's DataNodes, so no rows are written
+        self.assertEqual(DataNode.objects.count(), data_node_count)
+        for attempt_input in task_attempt.inputs.all():
+            self.assertEqual(
+                attempt_input.data_node.uuid,
+                task.inputs.get(channel=attempt_input.channel).data_node.uuid)
+
+
 class TestArrayInputContext(TestCase):
 
     filenames = ['one', 'two.txt', 'three', 'two.txt', 'three', 'three']
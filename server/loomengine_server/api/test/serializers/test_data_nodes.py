@@ -2,8 +2,10 @@ from django.test import TestCase
 from rest_framework import serializers
 
 from . import get_mock_context, get_mock_request
+from api.models.data_nodes import DataNode
+from api.models.data_objects import DataObject
 from api.serializers.data_nodes import URLDataNodeSerializer, \
-    DataNodeSerializer
+    DataNodeSerializer, DataNodeContentsRenderer
 from api.serializers.data_objects import DataObjectSerializer
 
 class TestURLDataNodeSerializer(TestCase):
@@ -234,3 +236,100 @@ class TestDataNodeSerializer(TestCase):
         s.is_valid(raise_exception=True)
         s.save()
         self.assertEqual(s.data['contents']['value'], raw_data)
+
+
+class TestDataNodeContentsRenderer(TestCase):
+
+    def _create_data_node(self, contents=[['a', 'b'], [], ['c']],
+                          type='string'):
+        s = DataNodeSerializer(
+            data={'contents': contents},
+            context={'type': type})
+        s.is_valid(raise_exception=True)
+        return s.save()
+
+    def _create_file_references(self, count):
+        references = []
+        for i in range(count):
+            data_object = DataObject.create_and_initialize_file_resource(
+                filename='file%s.txt' % i,
+                md5='d8e8fca2dc0f896fd7cb4cb0031ba24%s' % i,
+                source_type='imported')
+            references.append({'uuid': data_object.uuid})
+        return references
+
+    def _render_per_leaf(self, data_node):
+        if data_node.is_leaf:
+            return DataObjectSerializer(
+                data_node.data_object, context=get_mock_context()).data
+        contents = [None] * data_node.degree
+        for child in data_node.children.all():
+            contents[child.index] = self._render_per_leaf(child)
+        return contents
+
+    def testRender(self):
+        m = self._create_data_node()
+        m = DataNode.objects.get(id=m.id)
+        contents = DataNodeContentsRenderer(get_mock_context()).render(
+            [m])[m.id]
+        # An empty branch has no node, and renders as None, as in
+        # the serializer
+        self.assertIsNone(contents[1])
+        self.assertEqual(contents[0][1]['value'], 'b')
+        self.assertEqual(
+            contents, self._render_per_leaf(m))
+
+    def testRenderPrefetched(self):
+        m = self._create_data_node()
+        m = DataNode.objects.get(id=m.id)
+        m.prefetch()
+        contents = DataNodeContentsRenderer(get_mock_context()).render(
+            [m])[m.id]
+        self.assertEqual(contents[2][0]['value'], 'c')
+        self.assertEqual(
+            contents, self._render_per_leaf(m))
+
+    def _assert_renders_as_serializer(self, data_node):
+        m = DataNode.objects.get(id=data_node.id)
+        expected = self._render_per_leaf(m)
+        self.assertEqual(DataNodeContentsRenderer(
+            get_mock_context()).render([m])[m.id], expected)
+        m.prefetch()
+        self.assertEqual(DataNodeContentsRenderer(
+            get_mock_context()).render([m])[m.id], expected)
+        return expected
+
+    def testRenderFile(self):
+        m = self._create_data_node(
+            self._create_file_references(1)[0], type='file')
+        contents = self._assert_renders_as_serializer(m)
+        self.assertEqual(contents['value']['filename'], 'file0.txt')
+        self.assertEqual(contents['value']['upload_status'], 'incomplete')
+
+    def testRenderFileList(self):
+        m = self._create_data_node(
+            [[], self._create_file_references(2)], type='file')
+        contents = self._assert_renders_as_serializer(m)
+        self.assertEqual(contents[1][1]['value']['filename'], 'file1.txt')
+
+    def testRenderInteger(self):
+        m = self._create_data_node([3, -1], type='integer')
+        contents = self._assert_renders_as_serializer(m)
+        self.assertEqual(contents[1]['value'], -1)
+
+    def testRenderFloat(self):
+        m = self._create_data_node([[0.5], [2.25]], type='float')
+        contents = self._assert_renders_as_serializer(m)
+        self.assertEqual(contents[1][0]['value'], 2.25)
+
+    def testRenderBoolean(self):
+        m = self._create_data_node([True, False], type='boolean')
+        contents = self._assert_renders_as_serializer(m)
+        self.assertIs(contents[1]['value'], False)
+
+    def testRenderNestedList(self):
+        m = self._create_data_node(
+            [[[]], [['a', 'b'], ['c']], [['d']]], type='string')
+        contents = self._assert_renders_as_serializer(m)
+        self.assertEqual(contents[1][1][0]['value'], 'c')
+        self.assertEqual(contents[2][0][0]['value'], 'd')
@@ -0,0 +1,51 @@
+import json
+from django.test import TransactionTestCase, override_settings
+
+from . import fixtures, create_run_from_template, get_mock_context
+from api import export_closure
+from api.models.templates import Template
+from api.serializers.templates import TemplateSerializer
+
+
+@override_settings(TEST_DISABLE_ASYNC_DELAY=True,
+                   TEST_NO_PUSH_INPUTS=True)
+class TestExportClosure(TransactionTestCase):
+
+    def _create_template(self):
+        s = TemplateSerializer(data=fixtures.templates.step_a)
+        s.is_valid(raise_exception=True)
+        m = s.save()
+        # Refresh to update postprocessing_status
+        return Template.objects.get(id=m.id)
+
+    def testIterClosure(self):
+        template = self._create_template()
+        runs = [create_run_from_template(template) for i in range(2)]
+        run_uuids = export_closure.get_runs(
+            [run.uuid for run in runs] + [runs[0].uuid])
+        template_uuids = export_closure.get_templates([template.uuid])
+        records = list(export_closure.iter_closure(
+            run_uuids, template_uuids, get_mock_context()))
+
+        # The template is included once, before the runs that use it
+        self.assertEqual(
+            [(record['type'], record['data']['uuid']) for record in records
+             if record['type'] != 'data_object'],
+            [('template', template.uuid),
+             ('run', runs[0].uuid),
+             ('run', runs[1].uuid)])
+        keys = [(record['type'], record['data']['uuid'])
+                for record in records]
+        self.assertEqual(len(keys), len(set(keys)))
+
+    def testIterJsonLines(self):
+        template = self._create_template()
+        lines = list(export_closure.iter_json_lines(
+            export_closure.iter_closure(
+                [], [template.uuid], get_mock_context())))
+        self.assertEqual(json.loads(lines[-1])['data']['uuid'],
+                         template.uuid)
+
+    def testGetRunsWithMissingRun(self):
+        with self.assertRaises(export_closure.ObjectNotFound):
+            export_closure.get_runs(['00000000-0000-0000-0000-000000000000'])
@@ -0,0 +1,141 @@
+import copy
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from . import fixtures, get_mock_context, create_run_from_template, \
+    create_data_node_from_data_object
+from api.models.data_objects import DataObject
+from api.models.tasks import Task, TaskInput
+from api.models.task_attempts import TaskAttempt, TaskAttemptOutput, \
+    TaskAttemptEvent
+from api.serializers.data_nodes import DataNodeSerializer
+from api.serializers.runs import RunSerializer
+from api.serializers.tasks import TaskSerializer
+from api.serializers.task_attempts import TaskAttemptSerializer
+from api.serializers.templates import TemplateSerializer
+from api.test.helper import assert_query_budget
+
+
+"""These tests check that rendering each detail serializer takes
+a fixed number of queries, however large the object is.
+"""
+
+SIZES = [1, 10, 50]
+
+
+def get_workflow(step_count):
+    # The steps share input 'a', which must have one source,
+    # so its data is given on the workflow rather than on each step
+    steps = copy.deepcopy(fixtures.templates.big_workflow_steps[:step_count])
+    for step in steps:
+        for input in step['inputs']:
+            input.pop('data', None)
+    workflow = {
+        'name': 'big',
+        'inputs': [
+            {
+                'type': 'string',
+                'data': {'contents': 'a word or two'},
+                'channel': 'a'
+            }
+        ],
+        'outputs': [
+            {
+                'channel': 'b0',
+                'type': 'file'
+            }
+        ],
+        'steps': steps
+    }
+    s = TemplateSerializer(data=workflow)
+    s.is_valid(raise_exception=True)
+    return s.save()
+
+def get_data_node(leaf_count):
+    s = DataNodeSerializer(
+        data={'contents': ['word%s' % i for i in range(leaf_count)]},
+        context={'type': 'string'})
+    s.is_valid(raise_exception=True)
+    return s.save()
+
+def get_task(input_count):
+    task = Task.objects.create(
+        interpreter='/bin/bash',
+        raw_command='echo {{input0}}',
+        command='echo word0',
+        resources={'memory': '1', 'disk_size': '1', 'cores': '1'},
+        environment={'docker_image': 'ubuntu'},
+        data_path=[[0,1],]
+    )
+    for i in range(input_count):
+        data_object = DataObject.get_by_value('word%s' % i, 'string')
+        TaskInput.objects.create(
+            task=task,
+            data_node=create_data_node_from_data_object(data_object),
+            channel='input%s' % i,
+            mode='no_gather',
+            type='string')
+    task_attempt = TaskAttempt.objects.create(
+        interpreter=task.interpreter,
+        command=task.command,
+        environment=task.environment,
+        resources=task.resources)
+    task.add_to_all_task_attempts(task_attempt)
+    return task
+
+def get_task_attempt(output_count):
+    task_attempt = TaskAttempt.objects.create(
+        interpreter='/bin/bash',
+        command='echo word0',
+        resources={'memory': '1', 'disk_size': '1', 'cores': '1'},
+        environment={'docker_image': 'ubuntu'})
+    for i in range(output_count):
+        data_object = DataObject.get_by_value('word%s' % i, 'string')
+        TaskAttemptOutput.objects.create(
+            task_attempt=task_attempt,
+            data_node=create_data_node_from_data_object(data_object),
+            channel='output%s' % i,
+            mode='no_scatter',
+            type='string',
+            source={'stream': 'stdout'})
+        TaskAttemptEvent.objects.create(
+            task_attempt=task_attempt,
+            event='event %s' % i)
+    return task_attempt
+
+def render(serializer_class):
+    def _render(instance):
+        # Reload so that nothing is already cached on the instance
+        instance = instance.__class__.objects.get(id=instance.id)
+        return serializer_class(instance, context=get_mock_context()).data
+    return _render
+
+
+@override_settings(DISABLE_REPRESENTATION_CACHE=True)
+class TestQueryBudgets(TestCase):
+
+    def testDataNode(self):
+        assert_query_budget(
+            self, get_data_node, render(DataNodeSerializer), SIZES, 5)
+
+    def testTemplate(self):
+        assert_query_budget(
+            self, get_workflow, render(TemplateSerializer), SIZES, 30)
+
+    def testTask(self):
+        assert_query_budget(
+            self, get_task, render(TaskSerializer), SIZES, 30)
+
+    def testTaskAttempt(self):
+        assert_query_budget(
+            self, get_task_attempt, render(TaskAttemptSerializer), SIZES, 30)
+
+
+@override_settings(DISABLE_REPRESENTATION_CACHE=True,
+                   TEST_DISABLE_ASYNC_DELAY=True,
+                   TEST_NO_PUSH_INPUTS=True)
+class TestRunQueryBudget(TransactionTestCase):
+
+    def testRun(self):
+        assert_query_budget(
+            self, lambda size: create_run_from_template(get_workflow(size)),
+            render(RunSerializer), SIZES, 50)
@@ -4,9 +4,11 @@ from rest_framework.serializers import ValidationError
 
 from . import fixtures, get_mock_request, create_run_from_template
 from . import get_mock_context
+from api import async, get_setting
 from api.serializers.templates import *
 from api.serializers.runs import *
 from api.models.runs import Run
+from api.models.run_submissions import RunSubmission
 
 @override_settings(TEST_DISABLE_ASYNC_DELAY=True,
                    TEST_NO_PUSH_INPUTS=True)
@@ -82,3 +84,129 @@ class TestRunSerializer(TransactionTestCase):
             m.uuid,
             RunSerializer(run, context=get_mock_context()).data[
                 'template']['uuid'])
+
+    def testRenderSparseFields(self):
+        s = TemplateSerializer(data=fixtures.templates.nested_workflow)
+        s.is_valid(raise_exception=True)
+        m = s.save()
+        run = create_run_from_template(m)
+
+        context = get_mock_context()
+        context['fields'] = ['uuid', 'status', 'steps']
+        context['exclude'] = ['steps']
+        data = RunSerializer(run, context=context).data
+        self.assertEqual(sorted(data.keys()), ['status', 'uuid'])
+
+    def testRenderSparseFieldsInvalid(self):
+        s = TemplateSerializer(data=fixtures.templates.step_a)
+        s.is_valid(raise_exception=True)
+        m = s.save()
+        run = create_run_from_template(m)
+
+        context = get_mock_context()
+        context['fields'] = ['uuid', 'nonexistent']
+        with self.assertRaises(ValidationError):
+            RunSerializer(run, context=context).data
+
+
+@override_settings(TEST_DISABLE_ASYNC_DELAY=True,
+                   TEST_NO_RUN_TASK_ATTEMPT=True,
+                   TEST_NO_TASK_ATTEMPT_CLEANUP=True)
+class TestRerunCachedWorkflow(TransactionTestCase):
+
+    def _create_run(self, template):
+        s = RunSerializer(data={
+            'template': '@%s' % template.uuid,
+            'user_inputs': [{'channel': 'a1', 'data': {'contents': 'a1'}}]})
+        s.is_valid(raise_exception=True)
+        return s.save()
+
+    def testRerun(self):
+        s = TemplateSerializer(data=fixtures.templates.step_a)
+        s.is_valid(raise_exception=True)
+        template = s.save()
+        run = self._create_run(template)
+        task = Task.objects.get(run__uuid=run.uuid)
+        task_attempt = task.task_attempt
+        task.get_fingerprint().update_task_attempt_maybe(task_attempt)
+
+        # The new Task is bulk created, then reuses the cached TaskAttempt
+        rerun = self._create_run(template)
+        task = Task.objects.get(run__uuid=rerun.uuid)
+        self.assertEqual(task.task_attempt.uuid, task_attempt.uuid)
+
+
+@override_settings(TEST_DISABLE_ASYNC_DELAY=True,
+                   TEST_NO_PUSH_INPUTS=True)
+class TestRunSubmissionSerializer(TransactionTestCase):
+
+    def testCreate(self):
+        s = TemplateSerializer(data=fixtures.templates.step_a)
+        s.is_valid(raise_exception=True)
+        m = s.save()
+
+        s = RunSubmissionSerializer(
+            data={'run_data': {'template': '@%s' % m.uuid}},
+            context=get_mock_context())
+        s.is_valid(raise_exception=True)
+        submission = s.save()
+
+        submission = RunSubmission.objects.get(id=submission.id)
+        self.assertEqual(submission.status, 'complete')
+        self.assertEqual(submission.run.template.uuid, m.uuid)
+        self.assertEqual(
+            submission.run.notification_context.get('server_url'),
+            'http://testserver')
+        self.assertEqual(
+            RunSubmissionSerializer(
+                submission, context=get_mock_context()).data['run']['uuid'],
+            submission.run.uuid)
+
+    def testCreateMissingTemplateNeg(self):
+        s = RunSubmissionSerializer(
+            data={'run_data': {'template': 'nonexistent'}},
+            context=get_mock_context())
+        with self.assertRaises(ValidationError):
+            s.is_valid(raise_exception=True)
+
+    def testCreateFailed(self):
+        s = TemplateSerializer(data=fixtures.templates.step_b)
+        s.is_valid(raise_exception=True)
+        m = s.save()
+        run_data = {
+            'template': '@%s' % m.uuid,
+            'user_inputs': [
+                {'channel': 'b1', 'data': {'contents': 'missingfile'}},
+                {'channel': 'b2', 'data': {'contents': 'missingfile'}},
+                {'channel': 'b3', 'data': {'contents': 'validstring'}}]
+        }
+        count_before = Run.objects.count()
+
+        s = RunSubmissionSerializer(
+            data={'run_data': run_data}, context=get_mock_context())
+        s.is_valid(raise_exception=True)
+        submission = s.save()
+
+        submission = RunSubmission.objects.get(id=submission.id)
+        self.assertEqual(submission.status, 'failed')
+        self.assertIsNotNone(submission.error)
+        self.assertIsNone(submission.run)
+        self.assertEqual(Run.objects.count(), count_before)
+
+    def testStalledSubmissionFails(self):
+        # A job that claimed the submission and then died
+        submission = RunSubmission.objects.create(run_data={})
+        RunSubmission.claim(submission.uuid)
+        async.check_for_stalled_run_submissions()
+        submission = RunSubmission.objects.get(id=submission.id)
+        self.assertEqual(submission.status, 'in_progress')
+
+        RunSubmission.objects.filter(id=submission.id).update(
+            datetime_started=submission.datetime_started
+            - datetime.timedelta(
+                seconds=get_setting('RUN_SUBMISSION_TIMEOUT_SECONDS')+1))
+        async.check_for_stalled_run_submissions()
+        submission = RunSubmission.objects.get(id=submission.id)
+        self.assertEqual(submission.status, 'failed')
+        self.assertIsNotNone(submission.error)
+        self.assertIsNotNone(submission.datetime_finished)
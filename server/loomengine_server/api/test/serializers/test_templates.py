@@ -3,6 +3,7 @@ from django.test import TestCase
 
 from . import fixtures
 from . import get_mock_request, get_mock_context
+from api.models.tags import TemplateTag
 from api.serializers.templates import *
 from rest_framework import serializers
 
@@ -105,6 +106,44 @@ class TestTemplateSerializer(TestCase):
         s2 = TemplateSerializer(m, context=get_mock_context())
         self.assertEqual(s2.data['name'], 'nested')
 
+    def testRenderCached(self):
+        s = TemplateSerializer(data=fixtures.templates.step_a)
+        s.is_valid(raise_exception=True)
+        m = s.save()
+        TemplateSerializer(m, context=get_mock_context()).data
+
+        # update() does not change the version, so the cached copy is used
+        Template.objects.filter(id=m.id).update(name='renamed')
+        m = Template.objects.get(id=m.id)
+        s2 = TemplateSerializer(m, context=get_mock_context())
+        self.assertEqual(s2.data['name'], fixtures.templates.step_a['name'])
+
+        representation_cache.invalidate(m)
+        s3 = TemplateSerializer(m, context=get_mock_context())
+        self.assertEqual(s3.data['name'], 'renamed')
+
+    def testRenderCachedAfterTagAndCull(self):
+        s = TemplateSerializer(data=fixtures.templates.step_a)
+        s.is_valid(raise_exception=True)
+        m = s.save()
+        context = get_mock_context()
+        TemplateSerializer(m, context=context).data
+        key = representation_cache._get_key(
+            'template', m, m.get_representation_version(), context)
+        cache = representation_cache._get_cache()
+        representation = cache.get(key)
+        self.assertIsNotNone(representation)
+
+        Template.objects.filter(id=m.id).update(name='renamed')
+        TemplateTag(tag='newtag', template=m).save()
+        # The cache culls every entry except the stale one. It is still
+        # not used, since the tag was saved after it was cached.
+        cache.clear()
+        cache.set(key, representation)
+        m = Template.objects.get(id=m.id)
+        s2 = TemplateSerializer(m, context=get_mock_context())
+        self.assertEqual(s2.data['name'], 'renamed')
+
 class TestTemplateSerializerValidate(TestCase):
 
     def testDuplicateChannelsNeg(self):
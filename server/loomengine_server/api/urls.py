@@ -33,6 +33,9 @@ router.register('templates',
 router.register('runs',
                 api.views.RunViewSet,
                 base_name='run')
+router.register('run-submissions',
+                api.views.RunSubmissionViewSet,
+                base_name='run-submission')
 router.register('data-tags',
                 api.views.DataTagViewSet,
                 base_name='data-tag')
@@ -61,6 +64,8 @@ urlpatterns = [
     url(r'^info/$', api.views.info),
     url(r'^auth-status/$', api.views.auth_status),
     url(r'^storage-settings/$', api.views.StorageSettingsView.as_view()),
+    url(r'^export-closure/$', api.views.ExportClosureView.as_view()),
+    url(r'^query-statistics/$', api.views.QueryStatisticsView.as_view()),
     url(r'^doc/$', get_swagger_view(title='Loom API')),
 ]
 
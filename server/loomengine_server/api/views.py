@@ -2,13 +2,15 @@ from django.contrib.auth import login, logout
 from django.contrib.auth.models import User
 from django.core.exceptions import ObjectDoesNotExist
 import django.core.exceptions
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.db.models import ProtectedError
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
+import hashlib
 import json
 import logging
 import os
+import rest_framework.mixins
 import rest_framework.response
 import rest_framework.viewsets
 import rest_framework.status
@@ -23,6 +25,8 @@ from api import get_setting, get_storage_settings
 from api import models
 from api import serializers
 from api import async
+from api import export_closure
+from api import query_stats
 from loomengine_utils import version
 
 logger = logging.getLogger(__name__)
@@ -120,7 +124,58 @@ class ProtectedDeleteModelViewSet(rest_framework.viewsets.ModelViewSet):
                                     status=409)
 
 
-class DataObjectViewSet(SelectableSerializerModelViewSet, ProtectedDeleteModelViewSet):
+class SparseFieldsModelViewSet(rest_framework.viewsets.ModelViewSet):
+    """GET requests may include "fields" and/or "exclude" query params, each
+    a comma-separated list of field names, to limit the fields rendered.
+    Only the data needed for these fields is prefetched.
+    """
+
+    def get_serializer_context(self):
+        context = super(SparseFieldsModelViewSet, self).get_serializer_context()
+        if self.request.method == 'GET':
+            for param in ['fields', 'exclude']:
+                value = self.request.query_params.get(param, '')
+                names = [name.strip() for name in value.split(',')
+                         if name.strip()]
+                if names:
+                    context[param] = names
+        return context
+
+
+class ConditionalRetrieveModelViewSet(rest_framework.viewsets.ModelViewSet):
+    """Detail views send an ETag derived from the model's get_version(),
+    which changes whenever the object or anything rendered with it is saved.
+    If the client sends a matching If-None-Match header, the view returns
+    304 Not Modified without rendering the object.
+    """
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        etag = self._get_etag(request, instance)
+        if etag in self._parse_if_none_match(request):
+            response = rest_framework.response.Response(
+                status=rest_framework.status.HTTP_304_NOT_MODIFIED)
+        else:
+            serializer = self.get_serializer(instance)
+            response = rest_framework.response.Response(serializer.data)
+        response['ETag'] = etag
+        return response
+
+    def _get_etag(self, request, instance):
+        # The path includes query params, which may change the representation
+        key = '%s:%s:%s:%s' % (
+            self.get_serializer_class().__name__, instance.uuid,
+            instance.get_version(), request.get_full_path())
+        return '"%s"' % hashlib.md5(key).hexdigest()
+
+    def _parse_if_none_match(self, request):
+        header = request.META.get('HTTP_IF_NONE_MATCH', '')
+        return [etag.strip() for etag in header.split(',') if etag.strip()]
+
+
+class DataObjectViewSet(ConditionalRetrieveModelViewSet,
+                        SelectableSerializerModelViewSet,
+                        ProtectedDeleteModelViewSet):
     """Each DataObject represents a value of type file, string, boolean, 
     integer, or float.
     """
@@ -274,7 +329,10 @@ class DataNodeViewSet(SelectableSerializerModelViewSet, ProtectedDeleteModelView
     }
 
 
-class TaskViewSet(SelectableSerializerModelViewSet, ProtectedDeleteModelViewSet):
+class TaskViewSet(SparseFieldsModelViewSet,
+                  ConditionalRetrieveModelViewSet,
+                  SelectableSerializerModelViewSet,
+                  ProtectedDeleteModelViewSet):
     """A Task represents a specific combination of runtime environment, command, 
     and inputs that describe a reproducible unit of analysis.
     """
@@ -287,7 +345,10 @@ class TaskViewSet(SelectableSerializerModelViewSet, ProtectedDeleteModelViewSet)
     }
 
 
-class TaskAttemptViewSet(SelectableSerializerModelViewSet, ProtectedDeleteModelViewSet):
+class TaskAttemptViewSet(SparseFieldsModelViewSet,
+                         ConditionalRetrieveModelViewSet,
+                         SelectableSerializerModelViewSet,
+                         ProtectedDeleteModelViewSet):
     """A TaskAttempt represents a single attempt at executing a Task. A Task may have multiple TaskAttempts due to retries. DETAIL_ROUTES: "fail" will set a run to failed status. "finish" will set a run to finished status. "log-files" can be used to POST a new LogFile. "events" can be used to POST a new event. "settings" can be used to get settings for loom-task-monitor.
     """
     lookup_field = 'uuid'
@@ -375,13 +436,17 @@ class TaskAttemptViewSet(SelectableSerializerModelViewSet, ProtectedDeleteModelV
             'PRESERVE_ON_FAILURE': get_setting('PRESERVE_ON_FAILURE'),
             'HEARTBEAT_INTERVAL_SECONDS':
             get_setting('TASKRUNNER_HEARTBEAT_INTERVAL_SECONDS'),
+            'INPUT_STAGING_MODE': get_setting('INPUT_STAGING_MODE'),
             # container name is duplicated in TaskAttempt cleanup playbook
             'PROCESS_CONTAINER_NAME': '%s-attempt-%s' % (
                 get_setting('SERVER_NAME'), uuid),
         }, status=200)
 
 
-class TemplateViewSet(SelectableSerializerModelViewSet, ProtectedDeleteModelViewSet):
+class TemplateViewSet(SparseFieldsModelViewSet,
+                      ConditionalRetrieveModelViewSet,
+                      SelectableSerializerModelViewSet,
+                      ProtectedDeleteModelViewSet):
     """A Template is a pattern for analysis to be performed, but without assigned inputs. Templates can be nested under the 'steps' field. Only leaf nodes contain command, interpreter, resources, and environment.
     """
     lookup_field = 'uuid'
@@ -517,7 +582,10 @@ class TemplateViewSet(SelectableSerializerModelViewSet, ProtectedDeleteModelView
         return JsonResponse(serialized_dependencies, status=200)
 
 
-class RunViewSet(SelectableSerializerModelViewSet, ProtectedDeleteModelViewSet):
+class RunViewSet(SparseFieldsModelViewSet,
+                 ConditionalRetrieveModelViewSet,
+                 SelectableSerializerModelViewSet,
+                 ProtectedDeleteModelViewSet):
     """A Run represents the execution of a Template on a specific set of inputs. Runs can be nested under the 'steps' field. Only leaf nodes contain command, interpreter, resources, environment, and tasks.
     """
     lookup_field = 'uuid'
@@ -660,6 +728,28 @@ class RunViewSet(SelectableSerializerModelViewSet, ProtectedDeleteModelViewSet):
         return JsonResponse(serialized_dependencies, status=200)
 
 
+class RunSubmissionViewSet(rest_framework.mixins.CreateModelMixin,
+                           rest_framework.mixins.RetrieveModelMixin,
+                           rest_framework.mixins.ListModelMixin,
+                           rest_framework.viewsets.GenericViewSet):
+    """A RunSubmission is a request to create a Run in an asynchronous job. POST the same data as for a new Run. The response is returned before the Run is created, and "status" reports progress. When "status" is "complete", "run" is the new Run. When "status" is "failed", "error" has the reason.
+    """
+    lookup_field = 'uuid'
+    serializer_class = serializers.RunSubmissionSerializer
+
+    def get_queryset(self):
+        return models.RunSubmission.objects.all()\
+                                   .select_related('run')\
+                                   .order_by('-datetime_created')
+
+    def create(self, request):
+        s = self.get_serializer(data={'run_data': request.data})
+        s.is_valid(raise_exception=True)
+        s.save()
+        return rest_framework.response.Response(
+            s.data, status=rest_framework.status.HTTP_202_ACCEPTED)
+
+
 class TaskAttemptLogFileViewSet(SelectableSerializerModelViewSet, ProtectedDeleteModelViewSet):
     """LogFiles represent the logs for TaskAttempts. The same data is available in the TaskAttempt endpoint. This endpoint is to allow updating a LogFile without updating the full TaskAttempt. DETAIL_ROUTES: "data-object" allows you to post the file DataObject for the LogFile.
     """
@@ -763,6 +853,53 @@ def status(request):
     return JsonResponse({"message": "server is up"}, status=200)
 
 
+class QueryStatisticsView(APIView):
+    """Database queries made by each endpoint and asynchronous task.
+    Recorded only when the QUERY_STATS setting is True.
+    """
+    permission_classes = (permissions.IsAdminUser,)
+
+    def get(self, request, *args, **kwargs):
+        # Include this process's unsaved totals
+        query_stats.flush()
+        statistics = models.QueryStatistic.objects.order_by('-queries')
+        return JsonResponse({
+            'enabled': get_setting('QUERY_STATS'),
+            'statistics': [statistic.to_dict() for statistic in statistics]})
+
+    def delete(self, request, *args, **kwargs):
+        query_stats.reset()
+        return JsonResponse({})
+
+
+class ExportClosureView(APIView):
+    """Everything needed to export the Runs and Templates whose UUIDs are
+    POSTed as {"runs": [...], "templates": [...]}: the Runs, their
+    Templates, and the file DataObjects they refer to, each once. The
+    response is streamed as JSON lines, one
+    {"type": "data_object"|"template"|"run", "data": {...}} per line.
+    """
+
+    def post(self, request, *args, **kwargs):
+        run_uuids = request.data.get('runs', [])
+        template_uuids = request.data.get('templates', [])
+        for uuids in (run_uuids, template_uuids):
+            if not isinstance(uuids, list) or not all(
+                    isinstance(uuid, basestring) for uuid in uuids):
+                raise rest_framework.exceptions.ValidationError(
+                    '"runs" and "templates" must be lists of UUIDs')
+        try:
+            run_uuids = export_closure.get_runs(run_uuids)
+            template_uuids = export_closure.get_templates(template_uuids)
+        except export_closure.ObjectNotFound as e:
+            raise rest_framework.exceptions.NotFound(str(e))
+        records = export_closure.iter_closure(
+            run_uuids, template_uuids, {'request': request})
+        return StreamingHttpResponse(
+            export_closure.iter_json_lines(records),
+            content_type='application/x-ndjson')
+
+
 class StorageSettingsView(RetrieveAPIView):
 
     def retrieve(self, request):
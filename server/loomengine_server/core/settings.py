@@ -119,8 +119,17 @@ INTERNAL_STORAGE_ROOT = os.path.expanduser(
     os.getenv('LOOM_INTERNAL_STORAGE_ROOT', STORAGE_ROOT))
 STORAGE_ROOT_WITH_PREFIX =_add_url_prefix(STORAGE_ROOT)
 INTERNAL_STORAGE_ROOT_WITH_PREFIX =_add_url_prefix(INTERNAL_STORAGE_ROOT)
+INPUT_STAGING_MODE = os.getenv('LOOM_INPUT_STAGING_MODE', 'copy').lower()
+if INPUT_STAGING_MODE not in ['copy', 'mount']:
+    raise ValidationError(
+        'Couldn\'t recognize value for setting INPUT_STAGING_MODE="%s"'\
+        % INPUT_STAGING_MODE)
 DISABLE_DELETE = to_boolean(os.getenv('LOOM_DISABLE_DELETE', 'False'))
+DEDUPLICATE_FILE_UPLOADS = to_boolean(
+    os.getenv('LOOM_DEDUPLICATE_FILE_UPLOADS', 'True'))
 FORCE_RERUN = to_boolean(os.getenv('LOOM_FORCE_RERUN', 'False'))
+DISABLE_REPRESENTATION_CACHE = to_boolean(
+    os.getenv('LOOM_DISABLE_REPRESENTATION_CACHE', 'False'))
 
 TASKRUNNER_HEARTBEAT_INTERVAL_SECONDS = float(os.getenv('LOOM_TASKRUNNER_HEARTBEAT_INTERVAL_SECONDS', '60'))
 TASKRUNNER_HEARTBEAT_TIMEOUT_SECONDS = float(os.getenv('LOOM_TASKRUNNER_HEARTBEAT_TIMEOUT_SECONDS', TASKRUNNER_HEARTBEAT_INTERVAL_SECONDS*2.5))
@@ -136,6 +145,13 @@ MAXIMUM_RETRIES_FOR_SYSTEM_FAILURE = int(os.getenv(
 MAXIMUM_RETRIES_FOR_TIMEOUT_FAILURE = int(os.getenv(
     'LOOM_MAXIMUM_TASK_RETRIES_FOR_TIMEOUT_FAILURE', '0'))
 MAXIMUM_TREE_DEPTH = int(os.getenv('LOOM_MAXIMUM_TREE_DEPTH', '10'))
+TASK_CREATION_CHUNK_SIZE = int(os.getenv('LOOM_TASK_CREATION_CHUNK_SIZE', '500'))
+JINJA_TEMPLATE_CACHE_SIZE = int(os.getenv('LOOM_JINJA_TEMPLATE_CACHE_SIZE', '1000'))
+QUERY_STATS = to_boolean(os.getenv('LOOM_QUERY_STATS', 'False'))
+QUERY_STATS_FLUSH_INTERVAL_SECONDS = float(os.getenv('LOOM_QUERY_STATS_FLUSH_INTERVAL_SECONDS', '60'))
+PUSH_INPUTS_DEBOUNCE_SECONDS = float(os.getenv('LOOM_PUSH_INPUTS_DEBOUNCE_SECONDS', '2'))
+PUSH_INPUTS_LOCK_TIMEOUT_SECONDS = float(os.getenv('LOOM_PUSH_INPUTS_LOCK_TIMEOUT_SECONDS', '3600'))
+RUN_SUBMISSION_TIMEOUT_SECONDS = float(os.getenv('LOOM_RUN_SUBMISSION_TIMEOUT_SECONDS', '3600'))
 
 DEFAULT_DOCKER_REGISTRY = os.getenv('LOOM_DEFAULT_DOCKER_REGISTRY', '')
 
@@ -235,6 +251,7 @@ MIDDLEWARE_CLASSES = [
     'django.contrib.auth.middleware.SessionAuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.query_stats.QueryStatsMiddleware',
 ]
 
 if LOGIN_REQUIRED:
@@ -403,5 +420,23 @@ CACHES = {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
         'LOCATION': '232871b2',
         'TIMEOUT': 0,
-    }
+    },
+    # Rendered JSON for objects that no longer change. See
+    # api/representation_cache.py. Set LOOM_REPRESENTATION_CACHE_BACKEND
+    # to a shared backend (e.g. memcached) when running multiple servers.
+    # The default is a file cache local to this host.
+    'representations': {
+        'BACKEND': os.getenv(
+            'LOOM_REPRESENTATION_CACHE_BACKEND',
+            'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.getenv(
+            'LOOM_REPRESENTATION_CACHE_LOCATION',
+            os.path.join(tempfile.gettempdir(), 'loom-representation-cache')),
+        'TIMEOUT': int(os.getenv(
+            'LOOM_REPRESENTATION_CACHE_TIMEOUT_SECONDS', '86400')),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv(
+                'LOOM_REPRESENTATION_CACHE_MAX_ENTRIES', '10000')),
+        },
+    },
 }
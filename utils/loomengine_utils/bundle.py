@@ -0,0 +1,307 @@
+"""A bundle holds files, templates and runs in one tar archive, so that
+they can be exported and imported as a single stream rather than as a
+tree of metadata files.
+
+The first member of the archive is manifest.jsonl, with one JSON record
+per line. The first record is a header, {"bundle_version": 1}. Each other
+record has a "type" of "file", "template" or "run", and the object itself
+under "data". A file record has a "member" with the name of the archive
+member that holds its contents, unless it was exported without contents,
+in which case the file_url in its data is used. Members with file
+contents follow the manifest, in the same order as their records.
+Records are ordered files first, then templates, then runs, so that
+anything a record refers to is imported before it.
+"""
+
+import errno
+import hashlib
+import json
+import logging
+import os
+import sys
+import tarfile
+import threading
+import time
+from StringIO import StringIO
+
+from .exceptions import BundleError
+from .file_utils import File
+
+logger = logging.getLogger(__name__)
+
+BUNDLE_VERSION = 1
+MANIFEST = 'manifest.jsonl'
+
+
+class BundleWriter(object):
+    """Collects records with add_file, add_template and add_run,
+    then streams the bundle to url when write is called.
+    """
+
+    def __init__(self, url, storage_settings, retry=False):
+        self.storage_settings = storage_settings
+        self.retry = retry
+        self.file = File(url, storage_settings, retry=retry)
+        if self.file.exists():
+            raise BundleError(
+                'Bundle already exists at "%s"' % self.file.get_url())
+        self._file_records = []
+        self._template_records = []
+        self._run_records = []
+        self._file_uuids = set()
+
+    def add_file(self, data_object, include_contents=True):
+        if data_object['uuid'] in self._file_uuids:
+            return
+        self._file_uuids.add(data_object['uuid'])
+        record = {'type': 'file', 'data': data_object}
+        if include_contents:
+            record['member'] = 'files/%s/%s' % (
+                data_object['uuid'], data_object['value']['filename'])
+        self._file_records.append(record)
+
+    def add_template(self, template):
+        self._template_records.append({'type': 'template', 'data': template})
+
+    def add_run(self, run):
+        self._run_records.append({'type': 'run', 'data': run})
+
+    def write(self):
+        records = self._file_records + self._template_records \
+                  + self._run_records
+        manifest = ''.join(
+            json.dumps(record, sort_keys=True) + '\n'
+            for record in [{'bundle_version': BUNDLE_VERSION}] + records)
+        logger.info('Writing bundle to %s ...' % self.file.get_url())
+        stream = _open_writer(self.file)
+        try:
+            tar = tarfile.open(fileobj=stream, mode='w|')
+            try:
+                self._add_member(
+                    tar, MANIFEST, len(manifest), StringIO(manifest))
+                for record in records:
+                    if 'member' in record:
+                        self._add_file_member(tar, record)
+            finally:
+                tar.close()
+        except:
+            stream.abort()
+            raise
+        stream.close()
+        logger.info('...finished writing bundle')
+
+    def _add_file_member(self, tar, record):
+        file_resource = record['data']['value']
+        source = File(file_resource['file_url'], self.storage_settings,
+                      retry=self.retry)
+        logger.info('...adding file %s' % source.get_url())
+        reader = _Md5Reader(_open_reader(source))
+        try:
+            self._add_member(tar, record['member'], source.get_size(), reader)
+        finally:
+            reader.close()
+        md5 = reader.hexdigest()
+        if file_resource.get('md5') and md5 != file_resource['md5']:
+            raise BundleError(
+                'Expected md5 "%s" for file "%s", but found md5 "%s"'
+                % (file_resource['md5'], source.get_url(), md5))
+
+    def _add_member(self, tar, name, size, stream):
+        tarinfo = tarfile.TarInfo(name)
+        tarinfo.size = size
+        tarinfo.mtime = time.time()
+        tarinfo.mode = 0644
+        tar.addfile(tarinfo, stream)
+
+
+class BundleReader(object):
+    """Iterating over a BundleReader streams the bundle at url and yields
+    (record, contents) for each record in the manifest. contents is a
+    file-like object for file records with a member, or None. It must be
+    read before the next record is requested.
+    """
+
+    def __init__(self, url, storage_settings, retry=False):
+        self.file = File(url, storage_settings, retry=retry)
+
+    def __iter__(self):
+        stream = _open_reader(self.file)
+        try:
+            tar = tarfile.open(fileobj=stream, mode='r|')
+            member = tar.next()
+            if member is None or member.name != MANIFEST:
+                raise BundleError(
+                    '"%s" is not a bundle. The first member must be "%s"'
+                    % (self.file.get_url(), MANIFEST))
+            records = self._parse_manifest(tar.extractfile(member))
+            for record in records:
+                if 'member' not in record:
+                    yield record, None
+                    continue
+                member = tar.next()
+                if member is None or member.name != record['member']:
+                    raise BundleError(
+                        'Bundle "%s" is missing member "%s"'
+                        % (self.file.get_url(), record['member']))
+                yield record, tar.extractfile(member)
+            tar.close()
+        finally:
+            stream.close()
+
+    def _parse_manifest(self, manifest):
+        lines = manifest.read().splitlines()
+        try:
+            header = json.loads(lines[0])
+            version = header['bundle_version']
+            records = [json.loads(line) for line in lines[1:] if line]
+        except (IndexError, KeyError, TypeError, ValueError) as e:
+            raise BundleError('Manifest in bundle "%s" is not valid: %s'
+                              % (self.file.get_url(), e))
+        if version != BUNDLE_VERSION:
+            raise BundleError(
+                'Bundle "%s" has version %s. Only version %s is supported.'
+                % (self.file.get_url(), version, BUNDLE_VERSION))
+        return records
+
+
+def is_bundle(url, storage_settings, retry=False):
+    """True if url is an existing file rather than a directory.
+    Bulk imports accept either.
+    """
+    file = File(url, storage_settings, retry=retry)
+    return not file.is_dir() and file.exists()
+
+
+class _Md5Reader(object):
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._md5 = hashlib.md5()
+
+    def read(self, size=-1):
+        data = self._stream.read(size)
+        self._md5.update(data)
+        return data
+
+    def hexdigest(self):
+        return self._md5.hexdigest()
+
+    def close(self):
+        self._stream.close()
+
+
+def _open_reader(file):
+    if file.type == 'local':
+        return open(file.get_path(), 'rb')
+    return _PipeReader(file)
+
+
+def _open_writer(file):
+    if file.type == 'local':
+        return _LocalWriter(file)
+    return _PipeWriter(file)
+
+
+class _LocalWriter(object):
+
+    def __init__(self, file):
+        self.file = file
+        try:
+            os.makedirs(os.path.dirname(file.get_path()))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        self._stream = open(file.get_path(), 'wb')
+
+    def write(self, data):
+        self._stream.write(data)
+
+    def close(self):
+        self._stream.close()
+
+    def abort(self):
+        # Do not leave a partial bundle behind
+        self._stream.close()
+        self.file.delete()
+
+
+class _PipeThread(object):
+    """Runs a File's stream_to or stream_from in a thread, on one end
+    of a pipe, so that a stream can be read or written in this thread.
+    """
+
+    def __init__(self, function, stream):
+        self._function = function
+        self._thread_stream = stream
+        self._exc_info = None
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        try:
+            self._function(self._thread_stream)
+        except Exception:
+            self._exc_info = sys.exc_info()
+        finally:
+            self._thread_stream.close()
+
+    def join(self, ignore_errors=False):
+        self._thread.join()
+        if self._exc_info is not None and not ignore_errors:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+
+
+class _PipeReader(_PipeThread):
+
+    def __init__(self, file):
+        read_fd, write_fd = os.pipe()
+        self._stream = os.fdopen(read_fd, 'rb')
+        super(_PipeReader, self).__init__(
+            file.stream_to, os.fdopen(write_fd, 'wb'))
+
+    def read(self, size=-1):
+        data = self._stream.read(size)
+        if not data:
+            # End of the pipe. Raise the error if the download failed.
+            self.join()
+        return data
+
+    def close(self):
+        # Closing early stops the download with a broken pipe,
+        # which is not an error
+        self._stream.close()
+        self.join(ignore_errors=True)
+
+
+class _PipeWriter(_PipeThread):
+
+    def __init__(self, file):
+        self.file = file
+        read_fd, write_fd = os.pipe()
+        self._stream = os.fdopen(write_fd, 'wb')
+        super(_PipeWriter, self).__init__(
+            file.stream_from, os.fdopen(read_fd, 'rb'))
+
+    def write(self, data):
+        try:
+            self._stream.write(data)
+        except IOError as e:
+            if e.errno != errno.EPIPE:
+                raise
+            # The upload stopped reading. Raise its error.
+            self.join()
+            raise
+
+    def close(self):
+        self._stream.close()
+        self.join()
+
+    def abort(self):
+        try:
+            self._stream.close()
+        except IOError:
+            pass
+        self.join(ignore_errors=True)
+        if self.file.exists():
+            self.file.delete()
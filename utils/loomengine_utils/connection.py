@@ -1,3 +1,5 @@
+from collections import OrderedDict
+import copy
 import datetime
 import os
 import json
@@ -24,17 +26,23 @@ class Connection(object):
     It also handles authentication headers.
     """
 
+    # Number of responses with an ETag kept for revalidation
+    RESOURCE_CACHE_SIZE = 100
+
     def __init__(self, master_url, token=None, verify=False):
         self.api_root_url = os.path.join(master_url, 'api/')
         self.token = token
         self.verify = verify
+        # Maps (relative_url, params) to (etag, response json)
+        # in least-recently-used order
+        self._resource_cache = OrderedDict()
 
     def _add_auth_token_to_headers(self, headers):
         if self.token is not None:
             headers['Authorization'] = 'Token %s' % self.token
         return headers
 
-    def _post(self, data, relative_url, auth=None, timeout=30):
+    def _post(self, data, relative_url, auth=None, timeout=30, stream=False):
         url = self.api_root_url + relative_url
         if not self.verify:
             disable_insecure_request_warning()
@@ -46,7 +54,8 @@ class Connection(object):
                     {'content-type': 'application/json'}),
                 verify=self.verify,
                 auth=auth,
-                timeout=timeout
+                timeout=timeout,
+                stream=stream
             ))
 
     def _put(self, data, relative_url, timeout=30):
@@ -75,9 +84,12 @@ class Connection(object):
                 verify=self.verify,
                 timeout=timeout))
 
-    def _get(self, relative_url, raise_for_status=True, params=None, timeout=30):
+    def _get(self, relative_url, raise_for_status=True, params=None,
+             timeout=30, headers=None):
         if params is None:
             params = {}
+        if headers is None:
+            headers = {}
         url = self.api_root_url + relative_url
         if not self.verify:
             disable_insecure_request_warning()
@@ -86,7 +98,7 @@ class Connection(object):
                 url,
                 verify=self.verify, # Don't fail on unrecognized SSL certificate
                 params=params,
-                headers=self._add_auth_token_to_headers({}),
+                headers=self._add_auth_token_to_headers(dict(headers)),
                 timeout=timeout), 
             raise_for_status=raise_for_status)
 
@@ -176,18 +188,50 @@ class Connection(object):
     def _get_resource(self, relative_url, params=None):
         """Convenience function for retrieving a resource.
         If resource does not exist, return None.
+        Responses with an ETag are kept, and the next request for the same
+        resource sends If-None-Match so that an unchanged resource returns
+        304 and is not rendered or sent again.
         """
-        response = self._get(relative_url, params=params, raise_for_status=False)
+        cache_key = (relative_url, tuple(sorted((params or {}).items())))
+        cached = self._resource_cache.get(cache_key)
+        headers = {}
+        if cached is not None:
+            headers['If-None-Match'] = cached[0]
+        response = self._get(relative_url, params=params,
+                             raise_for_status=False, headers=headers)
+        if response.status_code == 304 and cached is not None:
+            # Mark as most recently used
+            del self._resource_cache[cache_key]
+            self._resource_cache[cache_key] = cached
+            return copy.deepcopy(cached[1])
+        self._resource_cache.pop(cache_key, None)
         if response.status_code == 404:
             return None
         self._raise_for_status(response)
-        return response.json()
+        data = response.json()
+        etag = response.headers.get('ETag')
+        if etag:
+            self._resource_cache[cache_key] = (etag, copy.deepcopy(data))
+            while len(self._resource_cache) > self.RESOURCE_CACHE_SIZE:
+                self._resource_cache.popitem(last=False)
+        return data
 
     def _get_index(self, relative_url, params=None):
         response = self._get(relative_url, params=params)
         response.raise_for_status()
         return response.json()
 
+    def _get_field_params(self, fields=None, exclude=None):
+        """Query params to render only the given list of fields, or all
+        fields except those in exclude.
+        """
+        params = {}
+        if fields:
+            params['fields'] = ','.join(fields)
+        if exclude:
+            params['exclude'] = ','.join(exclude)
+        return params
+
     # ------------------ Resource-specific methods ---------------------
 
     # DataNode
@@ -305,8 +349,9 @@ class Connection(object):
             template,
             'templates/')
 
-    def get_template(self, template_id, expand=False):
-        params = {}
+    def get_template(self, template_id, expand=False,
+                     fields=None, exclude=None):
+        params = self._get_field_params(fields=fields, exclude=exclude)
         if expand:
             params['expand'] = '1'
         return self._get_resource(
@@ -376,8 +421,14 @@ class Connection(object):
     def post_run(self, run):
         return self._post_resource(run, 'runs/')
 
-    def get_run(self, run_id, expand=False):
-        params = {}
+    def post_run_submission(self, run):
+        return self._post_resource(run, 'run-submissions/')
+
+    def get_run_submission(self, submission_id):
+        return self._get_resource('run-submissions/%s/' % submission_id)
+
+    def get_run(self, run_id, expand=False, fields=None, exclude=None):
+        params = self._get_field_params(fields=fields, exclude=exclude)
         if expand:
             params['expand'] = 1
         return self._get_resource('runs/%s/' % run_id, params=params)
@@ -447,13 +498,17 @@ class Connection(object):
 
     # Task
 
-    def get_task(self, task_id):
-        return self._get_resource('tasks/%s/' % task_id)
+    def get_task(self, task_id, fields=None, exclude=None):
+        return self._get_resource(
+            'tasks/%s/' % task_id,
+            params=self._get_field_params(fields=fields, exclude=exclude))
 
     # TaskAttempt
 
-    def get_task_attempt(self, task_attempt_id):
-        return self._get_resource('task-attempts/%s/' % task_attempt_id)
+    def get_task_attempt(self, task_attempt_id, fields=None, exclude=None):
+        return self._get_resource(
+            'task-attempts/%s/' % task_attempt_id,
+            params=self._get_field_params(fields=fields, exclude=exclude))
 
     def update_task_attempt(self, task_attempt_id, task_attempt_update):
         return self._patch_resource(
@@ -539,6 +594,24 @@ class Connection(object):
             {}, 'tokens/', auth=(username, password))
         return response.json().get('token')
 
+    # Export
+
+    def get_export_closure(self, runs=None, templates=None):
+        """Yields the runs and templates with the given UUIDs, each run's
+        template, and the file data objects they refer to, each once, as
+        {'type': 'data_object'|'template'|'run', 'data': {...}}. The
+        response is read as it streams from the server.
+        """
+        response = self._post(
+            {'runs': runs or [], 'templates': templates or []},
+            'export-closure/', stream=True)
+        try:
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
+        finally:
+            response.close()
+
     # Data/Template/Run Tag Indexes
 
     def get_data_tag_index(self):
@@ -42,3 +42,6 @@ class ImportManagerError(LoomengineUtilsError):
 
 class FileDuplicateError(ImportManagerError):
     pass
+
+class BundleError(LoomengineUtilsError):
+    pass
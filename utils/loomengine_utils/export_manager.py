@@ -1,34 +1,71 @@
+import collections
 import copy
 import datetime
 import logging
+from multiprocessing.pool import ThreadPool
 import os
+import time
 import yaml
 
+from .bundle import BundleWriter
 from .exceptions import LoomengineUtilsError, ExportManagerError, \
     FileAlreadyExistsError
 from .file_utils import File
 
 logger = logging.getLogger(__name__)
 
+# Most files exported at once by bulk exports. Copies are mostly waiting
+# on storage requests, so threads are enough to overlap them.
+EXPORT_THREADS = 8
+
+# Seconds between progress messages during bulk exports
+PROGRESS_INTERVAL = 10
+
 
 class ExportManager(object):
 
-    def __init__(self, connection, storage_settings=None, silent=False):
+    def __init__(self, connection, storage_settings=None, silent=False,
+                 threads=EXPORT_THREADS):
         self.connection = connection
         if storage_settings is None:
             storage_settings = connection.get_storage_settings()
         self.storage_settings = storage_settings
         self.silent = silent
+        self.threads = threads
 
     def _print(self, text):
         if not self.silent:
             print text
 
+    def export_bundle(self, bundle_url, files=None, templates=None,
+                      runs=None, retry=False, link_files=False):
+        """Export files, templates and runs to one bundle archive
+        at bundle_url, rather than to a directory tree. See bundle.py
+        for the format.
+        """
+        bundle = BundleWriter(bundle_url, self.storage_settings, retry=retry)
+        if files:
+            self.bulk_export_files(
+                files, retry=retry, link_files=link_files, bundle=bundle)
+        if templates:
+            self.bulk_export_templates(
+                templates, retry=retry, link_files=link_files, bundle=bundle)
+        if runs:
+            self.bulk_export_runs(
+                runs, retry=retry, link_files=link_files, bundle=bundle)
+        bundle.write()
+
     def bulk_export_files(self, files, destination_directory=None,
                           retry=False, export_metadata=True,
-                          link_files=False, editable=False):
+                          link_files=False, editable=False, bundle=None):
+        if bundle is not None:
+            for file in files:
+                bundle.add_file(file, include_contents=not link_files)
+            return
         if destination_directory == None:
             destination_directory = self._get_default_bulk_export_directory()
+        exports = []
+        destinations = set()
         for file in files:
             if editable:
                 subdir = 'md5_'+file['value'].get('md5')
@@ -38,18 +75,106 @@ class ExportManager(object):
                 destination_directory,
                 'files',
                 subdir)
-            self.export_file(file,
-                             destination_directory=file_directory,
-                             retry=retry,
-                             export_metadata=export_metadata,
-                             export_raw_file=not link_files)
+            # Files with the same md5 and filename have the same destination
+            # in an editable export, and are copied once
+            destination = (file_directory, file['value']['filename'])
+            if destination in destinations:
+                continue
+            destinations.add(destination)
+            exports.append((file, file_directory))
+        self._export_files_concurrently(
+            exports, retry=retry, export_metadata=export_metadata,
+            export_raw_file=not link_files)
+
+    def _export_files_concurrently(self, exports, retry=False,
+                                   export_metadata=True, export_raw_file=True):
+        """Export (data_object, destination_directory) pairs, up to
+        self.threads at a time, with the copy and metadata for each file
+        written in one thread. The first error stops the export.
+
+        Files with the same md5 are exported together, and only the first
+        is transferred from storage. The others are copied from the first
+        export, which is a local copy or a server-side GCS rewrite.
+        """
+        if not exports:
+            return
+        groups = collections.OrderedDict()
+        for data_object, destination_directory in exports:
+            key = data_object['value'].get('md5') or data_object.get('uuid')
+            groups.setdefault(key, []).append(
+                (data_object, destination_directory))
+
+        def export(group):
+            sizes = []
+            source_url = None
+            for data_object, destination_directory in group:
+                sizes.append(self.export_file(
+                    data_object,
+                    destination_directory=destination_directory,
+                    retry=retry,
+                    export_metadata=export_metadata,
+                    export_raw_file=export_raw_file,
+                    source_url=source_url))
+                if export_raw_file and source_url is None:
+                    source_url = data_object['value']['file_url']
+            return sizes
+
+        self._print('Exporting %s files...' % len(exports))
+        start = time.time()
+        total_size = 0
+        if self.threads > 1 and len(groups) > 1:
+            pool = ThreadPool(min(self.threads, len(groups)))
+            try:
+                results = pool.imap_unordered(export, groups.values())
+                total_size = self._report_export_progress(
+                    (size for sizes in results for size in sizes),
+                    len(exports), start)
+                pool.close()
+            except:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+        else:
+            total_size = self._report_export_progress(
+                (size for group in groups.values() for size in export(group)),
+                len(exports), start)
+        elapsed = max(time.time() - start, 0.001)
+        self._print('...finished exporting %s files (%s) in %.1fs, %s/s' % (
+            len(exports), self._format_size(total_size), elapsed,
+            self._format_size(total_size / elapsed)))
+
+    def _report_export_progress(self, sizes, count, start):
+        total_size = 0
+        last_report = start
+        for i, size in enumerate(sizes, 1):
+            total_size += size
+            now = time.time()
+            if now - last_report >= PROGRESS_INTERVAL and i < count:
+                self._print('...exported %s of %s files (%s)' % (
+                    i, count, self._format_size(total_size)))
+                last_report = now
+        return total_size
+
+    def _format_size(self, size):
+        for unit in ['B', 'KB', 'MB', 'GB']:
+            if size < 1024:
+                return '%.1f %s' % (size, unit)
+            size /= 1024.0
+        return '%.1f TB' % size
 
     def export_file(self, data_object, destination_directory=None,
                     destination_filename=None, retry=False,
-                    export_metadata=False, export_raw_file=True):
+                    export_metadata=False, export_raw_file=True, link=False,
+                    source_url=None):
         """Export a file from Loom to some file storage location.
         Default destination_directory is cwd. Default destination_filename is the 
         filename from the file data object associated with the given file_id.
+        If link is True, a local file may be exported as a hardlink to
+        the file in storage. Use it only if the export will not be modified.
+        If source_url is given, the contents are copied from there instead
+        of from the file_url of the data object.
+        Returns the number of bytes copied.
         """
         if not destination_directory:
             destination_directory = os.getcwd()
@@ -65,6 +190,7 @@ class ExportManager(object):
             data_object['value']['filename'],
             data_object['uuid']))
 
+        size = 0
         if export_raw_file:
             destination = File(
                 destination_file_url, self.storage_settings, retry=retry)
@@ -77,9 +203,11 @@ class ExportManager(object):
             # Copy from the first file location
             file_resource = data_object.get('value')
             md5 = file_resource.get('md5')
-            source_url = data_object['value']['file_url']
+            if source_url is None:
+                source_url = data_object['value']['file_url']
             File(source_url, self.storage_settings, retry=retry).copy_to(
-                destination, expected_md5=md5)
+                destination, expected_md5=md5, link=link)
+            size = destination.get_size()
             data_object['value'] = self._create_new_file_resource(
                 data_object['value'], destination.get_url())
         else:
@@ -99,6 +227,7 @@ class ExportManager(object):
             logger.info('...skipping metadata')
 
         logger.info('...finished file export')
+        return size
 
     def _create_new_file_resource(self, old_resource, new_file_url):
         # Most fields are the same as old_resource.
@@ -150,8 +279,11 @@ class ExportManager(object):
                               destination_directory=None,
                               retry=False, link_files=False,
                               editable=False, save_files=True,
-                              file_dict=None):
-        if destination_directory is None:
+                              file_dict=None, bundle=None):
+        if bundle is not None and editable:
+            raise ExportManagerError(
+                'Editable templates cannot be exported to a bundle')
+        if destination_directory is None and bundle is None:
             destination_directory = self._get_default_bulk_export_directory()
 
         expanded_templates = self._expand_templates(templates)
@@ -180,8 +312,18 @@ class ExportManager(object):
                                    destination_directory=destination_directory,
                                    retry=retry, link_files=link_files,
                                    export_metadata=export_file_metadata,
-                                   editable=editable)
-        for template in expanded_templates:
+                                   editable=editable, bundle=bundle)
+        self._save_bulk_templates(
+            expanded_templates, destination_directory, editable=editable,
+            retry=retry, bundle=bundle)
+        return templates
+
+    def _save_bulk_templates(self, templates, destination_directory,
+                             editable=False, retry=False, bundle=None):
+        for template in templates:
+            if bundle is not None:
+                bundle.add_template(template)
+                continue
             if editable:
                 subdir = 'md5_'+template.get('md5')
             else:
@@ -194,7 +336,6 @@ class ExportManager(object):
                 self._recursively_save_template_and_steps(template, template_destination, retry=retry)
             else:
                 self._save_template(template, template_destination, retry=retry)
-        return templates
 
     def _recursively_save_template_and_steps(self, template, template_destination, retry=False):
         steps = template.pop('steps', [])
@@ -210,31 +351,25 @@ class ExportManager(object):
 
     def bulk_export_runs(self, runs,
                          destination_directory=None,
-                         retry=False, link_files=False):
-        if destination_directory is None:
+                         retry=False, link_files=False, bundle=None):
+        if destination_directory is None and bundle is None:
             destination_directory = self._get_default_bulk_export_directory()
 
-        expanded_runs = self._expand_runs(runs)
-        templates = [run['template'] for run in expanded_runs]
-        templates = [self.connection.get_template(template['uuid'])
-                     for template in templates]
-        expanded_templates = self._expand_templates(templates)
-
-        file_dict = {}
-        file_id_field = 'uuid'
+        # The runs, their templates and their files, each listed once
+        closure = self._get_export_closure(runs=runs)
+        expanded_runs = closure['runs']
 
-        self._get_files_from_templates(expanded_templates, file_dict, file_id_field)
-        self._get_files_from_runs(expanded_runs, file_dict, file_id_field)
-        
-        self.bulk_export_files(file_dict.values(),
+        self.bulk_export_files(closure['data_objects'],
                                destination_directory=destination_directory,
-                               retry=retry, link_files=link_files)
-        self.bulk_export_templates(templates,
-                                   destination_directory=destination_directory,
-                                   retry=retry, link_files=link_files,
-                                   save_files=False)
+                               retry=retry, link_files=link_files,
+                               bundle=bundle)
+        self._save_bulk_templates(closure['templates'], destination_directory,
+                                  retry=retry, bundle=bundle)
 
         for run in expanded_runs:
+            if bundle is not None:
+                bundle.add_run(run)
+                continue
             subdir = 'uuid_'+run.get('uuid')
             run_destination = self._get_run_destination(
                 run,
@@ -248,9 +383,9 @@ class ExportManager(object):
         # We are going to save the full template under templates/ subdir but leave the
         # abbreviated version in the run.
         #So we Take a copy of the template and expand it.
-        run = self._expand_run(run)
-        template = self.connection.get_template(run['template']['uuid'])
-        template = self._expand_template(template)
+        closure = self._get_export_closure(runs=[run])
+        run = closure['runs'][0]
+        template = closure['templates'][0]
 
         run_destination = self._get_run_destination(
             run, destination_directory=destination_directory)
@@ -258,13 +393,9 @@ class ExportManager(object):
             template, os.path.join(run_destination+'.dependencies', 'templates'))
         file_destination_directory = run_destination+'.dependencies'
 
-        file_dict = {}
-        file_id_field = 'uuid'
-        self._get_files_from_template(template, file_dict, file_id_field)
-        self._get_files_from_run(run, file_dict, file_id_field)
-        
         self.bulk_export_files(
-            file_dict.values(), destination_directory=file_destination_directory,
+            closure['data_objects'],
+            destination_directory=file_destination_directory,
             retry=retry, link_files=link_files)
         self._save_template(template, template_destination, retry=retry)
         self._save_run(run, run_destination, retry=retry)
@@ -275,11 +406,18 @@ class ExportManager(object):
             destination_directory = os.getcwd()
         return os.path.join(destination_directory, run['name']+'.yaml')
 
-    def _expand_runs(self, runs):
-        return [self._expand_run(r) for r in runs]
-        
-    def _expand_run(self, run):
-        return self.connection.get_run(run['uuid'], expand=True)
+    def _get_export_closure(self, runs=None, templates=None):
+        """Gets the expanded runs and templates, each run's template,
+        and the file data objects they use, in one request
+        """
+        closure = {'data_objects': [], 'templates': [], 'runs': []}
+        kinds = {'data_object': 'data_objects', 'template': 'templates',
+                 'run': 'runs'}
+        for record in self.connection.get_export_closure(
+                runs=[run['uuid'] for run in runs or []],
+                templates=[template['uuid'] for template in templates or []]):
+            closure[kinds[record['type']]].append(record['data'])
+        return closure
 
     def _save_run(self, run, destination, retry=False):
         self._print('Exporting run %s@%s to %s...' % (
@@ -288,10 +426,10 @@ class ExportManager(object):
         self._print('...finished exporting run')
         
     def _expand_template(self, template):
-        return self.connection.get_template(template.get('uuid'), expand=True)
+        return self._expand_templates([template])[0]
 
     def _expand_templates(self, templates):
-        return [self._expand_template(t) for t in templates]
+        return self._get_export_closure(templates=templates)['templates']
 
     def _convert_template_to_editable(self, template):
         # Delete data that is unique to the original instance. User can edit
@@ -334,30 +472,6 @@ class ExportManager(object):
                 new_contents = contents.get('value')
             return new_contents
 
-    def _get_files_from_run(self, run, file_dict, file_id_field):
-        self._get_files_from_inputs_outputs(run, file_dict, file_id_field)
-        for step in run.get('steps', []):
-            self._get_files_from_run(step, file_dict, file_id_field)
-        for task in run.get('tasks', []):
-            self._get_files_from_task(task, file_dict, file_id_field)
-
-    def _get_files_from_runs(self, runs, file_dict, file_id_field):
-        for run in runs:
-            self._get_files_from_template(run, file_dict, file_id_field)
-
-    def _get_files_from_task(self, task, file_dict, file_id_field):
-        self._get_files_from_inputs_outputs(task, file_dict, file_id_field)
-        for task_attempt in task.get('all_task_attempts', []):
-            self._get_files_from_task_attempt(task_attempt, file_dict, file_id_field)
-
-    def _get_files_from_task_attempt(self, task_attempt, file_dict, file_id_field):
-        self._get_files_from_inputs_outputs(task_attempt, file_dict, file_id_field)
-        self._get_files_from_logs(task_attempt, file_dict, file_id_field)
-
-    def _get_files_from_logs(self, task_attempt, file_dict, file_id_field):
-        for log_file in task_attempt.get('log_files', []):
-            self._add_file_if_unique(log_file.get('data_object'), file_dict, file_id_field)
-            
     def _get_files_from_template(self, template, file_dict, file_id_field):
         self._get_files_from_inputs_outputs(template, file_dict, file_id_field)
         for step in template.get('steps', []):
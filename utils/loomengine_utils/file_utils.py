@@ -1,7 +1,12 @@
+from collections import deque
 import copy
+import ctypes
+import ctypes.util
 import errno
+import fcntl
 import fnmatch
 import glob
+import itertools
 import google.cloud.storage
 import google.cloud.exceptions
 import logging
@@ -11,7 +16,7 @@ import re
 from requests.exceptions import HTTPError
 import shutil
 import sys
-import tempfile
+import threading
 import time
 import urlparse
 import warnings
@@ -28,8 +33,31 @@ from oauth2client.client import HttpAccessTokenRefreshError
 from oauth2client.client import ApplicationDefaultCredentialsError
 import apiclient.discovery
 
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
 logger = logging.getLogger(__name__)
 
+
+class _GoogleStorageCache(threading.local):
+    """Clients and buckets are shared by all Google Storage Files and
+    FilePatterns in the same thread, so that credentials are found and each
+    bucket is fetched only once per thread. They are not shared between
+    threads, since a client's HTTP connections are not safe to use from two
+    threads at once, and they are freed when the thread exits.
+    """
+
+    def __init__(self):
+        self.clients = {}
+        self.buckets = {}
+
+_google_storage_cache = _GoogleStorageCache()
+
 def parse_as_yaml(text):
     try:
         data = yaml.load(text, Loader=yaml.SafeLoader)
@@ -78,42 +106,55 @@ def _urlparse(path):
     return url
 
 
+METADATA_SUFFIX = '.metadata.yaml'
+
+
 class FileSet:
 
     def __init__(self, patterns, settings, retry=False, trim_metadata_suffix=False, raise_if_missing=True):
-        """Returns a list of unique Files matching the given patterns.
+        """An iterable of unique Files matching the given patterns.
+        Files are found as they are iterated, so callers can start work
+        on the first Files before all matches are known.
         """
         assert isinstance(patterns, list), 'patterns must be a list'
         self.settings = settings
         self.retry = retry
         self.raise_if_missing=raise_if_missing
         self.do_trim_metadata_suffix = trim_metadata_suffix
-        self.files = []
-        self.urls = set()
-        self._parse_patterns(patterns)
+        self.patterns = self._parse_patterns(patterns)
 
     def _parse_patterns(self, patterns):
-        for pattern in patterns:
-            self._parse_pattern(pattern)
+        return [self._parse_pattern(pattern) for pattern in patterns]
 
     def _parse_pattern(self, pattern):
-        for file in FilePattern(
-                pattern, self.settings, retry=self.retry,
-                trim_metadata_suffix=self.do_trim_metadata_suffix,
-                raise_if_missing=self.raise_if_missing):
-            self._add_file(file)
-
-    def _add_file(self, file):
-        # Only add a file if it is unique
-        if file.get_url() not in self.urls:
-            self.urls.add(file.get_url())
-            self.files.append(file)
+        return FilePattern(
+            pattern, self.settings, retry=self.retry,
+            trim_metadata_suffix=self.do_trim_metadata_suffix,
+            raise_if_missing=self.raise_if_missing)
 
     def __iter__(self):
-        return self.files.__iter__()
+        # A File is a duplicate if an earlier pattern also yields it.
+        # Patterns without wildcards yield at most one File each, so their
+        # URLs are kept in a set, and imports of many shell-expanded paths
+        # stay linear. Patterns with wildcards are checked with matches(),
+        # to avoid keeping every URL they yield in memory.
+        literal_urls = set()
+        wildcard_patterns = []
+        for pattern in self.patterns:
+            for file in pattern:
+                url = file.get_url()
+                if url not in literal_urls and not any(
+                        earlier_pattern.matches(file)
+                        for earlier_pattern in wildcard_patterns):
+                    yield file
+                if not pattern.has_wildcards():
+                    literal_urls.add(url)
+            if pattern.has_wildcards():
+                wildcard_patterns.append(pattern)
 
     def __len__(self):
-        return self.files.__len__()
+        # Finds all matches, so avoid this for large patterns
+        return sum(1 for file in self)
 
 
 def FilePattern(pattern, settings, **kwargs):
@@ -128,22 +169,103 @@ def FilePattern(pattern, settings, **kwargs):
 
 
 class AbstractFilePattern:
+    """Files are matched as the pattern is iterated. Each iteration
+    matches the pattern again.
+    """
 
-    def _trim_metadata_suffix(self, all_matches):
-        if not self.do_trim_metadata_suffix:
-            return all_matches
-
-        # For any file <filename>.metadata.yaml, return just <filename>
-        return map(lambda path: path[:-len('.metadata.yaml')]
-                   if path.endswith('.metadata.yaml')
-                   else path,
-                   all_matches)
+    _pending_files = None
 
     def _strip_file_scheme(self, path):
         return re.sub('^file://', '', path)
 
+    def _check_for_matches(self):
+        # The first match is kept, so that iteration
+        # does not have to start over
+        files = self._iter_files()
+        try:
+            first_file = next(files)
+        except StopIteration:
+            raise NoFileError('No files found for pattern "%s"' % self.pattern)
+        self._pending_files = itertools.chain([first_file], files)
+
     def __iter__(self):
-        return self.files.__iter__()
+        if self._pending_files is not None:
+            files, self._pending_files = self._pending_files, None
+            return files
+        return self._iter_files()
+
+    def _iter_files(self):
+        raise FileUtilsError('Child class must override this method')
+
+    def has_wildcards(self):
+        raise FileUtilsError('Child class must override this method')
+
+    def matches(self, file):
+        """True if iterating this pattern would yield file
+        """
+        raise FileUtilsError('Child class must override this method')
+
+
+def _iter_local_matches(pattern, directories=False):
+    """Like glob.iglob, but yields only files (or only directories).
+    Uses scandir where available, so that file types come from
+    the directory listing rather than from a stat of each match.
+    """
+    dirname, basename = os.path.split(pattern)
+    if glob.has_magic(dirname):
+        parents = _iter_local_matches(dirname, directories=True)
+    else:
+        parents = [dirname]
+    for parent in parents:
+        if not glob.has_magic(basename):
+            path = os.path.join(parent, basename)
+            if os.path.isdir(path) if directories else os.path.isfile(path):
+                yield path
+            continue
+        for name, is_dir, is_file in _iter_directory(parent or os.curdir):
+            if (is_dir if directories else is_file) \
+               and _local_name_matches(name, basename):
+                yield os.path.join(parent, name)
+
+
+def _iter_directory(path):
+    # Yields (name, is_dir, is_file) for each entry
+    try:
+        if scandir is None:
+            names = os.listdir(path)
+        else:
+            entries = scandir(path)
+    except OSError:
+        return
+    if scandir is None:
+        for name in names:
+            entry_path = os.path.join(path, name)
+            yield name, os.path.isdir(entry_path), os.path.isfile(entry_path)
+    else:
+        for entry in entries:
+            yield entry.name, entry.is_dir(), entry.is_file()
+
+
+def _local_name_matches(name, pattern):
+    # As in glob, wildcards do not match a leading "."
+    if name.startswith('.') and not pattern.startswith('.'):
+        return False
+    return fnmatch.fnmatch(name, pattern)
+
+
+def _local_path_matches(path, pattern):
+    # As in glob, wildcards match within a single path component
+    path_parts = path.split(os.sep)
+    pattern_parts = pattern.split(os.sep)
+    if len(path_parts) != len(pattern_parts):
+        return False
+    for name, pattern_part in zip(path_parts, pattern_parts):
+        if glob.has_magic(pattern_part):
+            if not _local_name_matches(name, pattern_part):
+                return False
+        elif name != pattern_part:
+            return False
+    return True
 
 
 class LocalFilePattern(AbstractFilePattern):
@@ -156,23 +278,44 @@ class LocalFilePattern(AbstractFilePattern):
 
     def __init__(self, pattern, settings, retry=False, trim_metadata_suffix=False, raise_if_missing=True):
         # retry has no effect
+        self.pattern = pattern
+        self.settings = settings
+        self.retry = retry
         self.do_trim_metadata_suffix = trim_metadata_suffix
         self.raise_if_missing = raise_if_missing
-
-        self.files = [
-            LocalFile(path, settings, retry=retry)
-            for path in self._get_matching_paths(pattern)]
-
-    def _get_matching_paths(self, pattern):
-        matches = glob.glob(self._strip_file_scheme(pattern))
-        matches = self._remove_directories(matches)
-        matches = self._trim_metadata_suffix(matches)
-        if self.raise_if_missing and len(matches) == 0:
-            raise NoFileError('No files found for pattern "%s"' % pattern)
-        return matches
-
-    def _remove_directories(self, all_matches):
-        return filter(lambda path: os.path.isfile(path), all_matches)
+        self.path_pattern = os.path.abspath(self._strip_file_scheme(pattern))
+        if self.raise_if_missing:
+            self._check_for_matches()
+
+    def _iter_files(self):
+        for path in self._iter_matching_paths():
+            yield LocalFile(path, self.settings, retry=self.retry)
+
+    def _iter_matching_paths(self):
+        for path in _iter_local_matches(self.path_pattern):
+            if self.do_trim_metadata_suffix and path.endswith(METADATA_SUFFIX):
+                # For any file <filename>.metadata.yaml, return just
+                # <filename>, unless <filename> is matched by itself
+                path = path[:-len(METADATA_SUFFIX)]
+                if self._matches_existing_path(path):
+                    continue
+            yield path
+
+    def _matches_existing_path(self, path):
+        return _local_path_matches(path, self.path_pattern) \
+            and os.path.isfile(path)
+
+    def has_wildcards(self):
+        return glob.has_magic(self.path_pattern)
+
+    def matches(self, file):
+        if file.type != 'local':
+            return False
+        path = file.get_path()
+        if self._matches_existing_path(path):
+            return True
+        return self.do_trim_metadata_suffix \
+            and self._matches_existing_path(path + METADATA_SUFFIX)
 
 
 class GoogleStorageClient:
@@ -182,40 +325,60 @@ class GoogleStorageClient:
     CHUNK_SIZE = 1024*1024*100 
 
     def get_client(self):
+        self.client = self._get_client()
+
+    def _get_client(self):
+        # The client for the current thread
+        project = self.settings['GCE_PROJECT']
+        client = _google_storage_cache.clients.get(project)
+        if client is not None:
+            return client
         try:
             if self.retry:
-                self.client = execute_with_retries(
-                    lambda: google.cloud.storage.client.Client(
-                        self.settings['GCE_PROJECT']),
+                client = execute_with_retries(
+                    lambda: google.cloud.storage.client.Client(project),
                     (Exception,),
                     logger,
                     'Get client')
             else:
-                self.client = google.cloud.storage.client.Client(
-                    self.settings['GCE_PROJECT'])
+                client = google.cloud.storage.client.Client(project)
         except ApplicationDefaultCredentialsError as e:
             raise SystemExit(
                 'ERROR! '\
                 'Google Cloud application default credentials are not set. '\
                 'Please run "gcloud auth application-default login"')
+        _google_storage_cache.clients[project] = client
+        return client
 
     def get_bucket(self, bucket_id):
+        self.bucket = self._get_bucket(bucket_id)
+
+    def _get_bucket(self, bucket_id):
+        # The bucket for the current thread, with the current thread's client
+        key = (self.settings['GCE_PROJECT'], bucket_id)
+        bucket = _google_storage_cache.buckets.get(key)
+        if bucket is not None:
+            return bucket
+        client = self._get_client()
         try:
             if self.retry:
-                self.bucket = execute_with_retries(
-                    lambda: self.client.get_bucket(bucket_id),
+                bucket = execute_with_retries(
+                    lambda: client.get_bucket(bucket_id),
                     (Exception,),
                     logger,
                     'Get bucket',
                     nonretryable_errors=(google.cloud.exceptions.Forbidden,),
                 )
             else:
-                self.bucket = self.client.get_bucket(bucket_id)
+                bucket = client.get_bucket(bucket_id)
         except HttpAccessTokenRefreshError:
             raise FileUtilsError(
                 'Failed to access bucket "%s". Are you logged in? '\
                 'Try "gcloud auth login"' % bucket_id)
-        
+        _google_storage_cache.buckets[key] = bucket
+        return bucket
+
+
     def get_blob(self, blob_id, must_exist=False):
         if self.retry:
             self.blob = execute_with_retries(
@@ -233,8 +396,11 @@ class GoogleStorageClient:
                 raise FileUtilsError('Blob not found: "%s"' % blob_id)
             self.blob = google.cloud.storage.blob.Blob(
                 self.blob_id, self.bucket, chunk_size=self.CHUNK_SIZE)
-        if self.blob.size > self.CHUNK_SIZE:
-            self.blob.chunk_size = self.CHUNK_SIZE
+        self._set_chunk_size(self.blob)
+
+    def _set_chunk_size(self, blob):
+        if blob.size > self.CHUNK_SIZE:
+            blob.chunk_size = self.CHUNK_SIZE
 
 
 class GoogleStorageFilePattern(AbstractFilePattern, GoogleStorageClient):
@@ -242,7 +408,8 @@ class GoogleStorageFilePattern(AbstractFilePattern, GoogleStorageClient):
     """
 
     def __init__(self, pattern, settings, retry=False, trim_metadata_suffix=False, raise_if_missing=True):
-        # retry has no effect
+        # raise_if_missing has no effect
+        self.pattern = pattern
         self.do_trim_metadata_suffix = trim_metadata_suffix
         self.raise_if_missing = raise_if_missing
         self.settings = settings
@@ -258,19 +425,22 @@ class GoogleStorageFilePattern(AbstractFilePattern, GoogleStorageClient):
         try:
             self.get_client()
             self.get_bucket(self.bucket_id)
-            self._get_matching_blobs(self.blob_pattern)
-
-            self.files = [
-                GoogleStorageFile('gs://%s/%s' % (self.bucket_id, blob_id),
-                                  settings, retry=retry)
-                for blob_id in self._get_matching_blobs(self.blob_pattern)]
         except google.cloud.exceptions.InternalServerError as e:
             raise APIError(
                 "%s.%s: %s" %
                 (e.__class__.__module__, e.__class__.__name__, e))
 
-
-    def _get_matching_blobs(self, blob_pattern):
+    def _iter_files(self):
+        # Files are built from the listing, without fetching each blob
+        for blob_id, blob in self._iter_matching_blobs(self.blob_pattern):
+            yield GoogleStorageFile(
+                'gs://%s/%s' % (self.bucket_id, blob_id),
+                self.settings, retry=self.retry, blob=blob)
+
+    def _iter_matching_blobs(self, blob_pattern):
+        # Yields (blob_id, blob). blob is None if blob_id
+        # was trimmed and that blob was not listed.
+        #
         # Google doesn't support wildcards, so we need to get
         # a list of possible blobs and then use fnmatch.filter
         # to filter by wildcard pattern.
@@ -278,14 +448,70 @@ class GoogleStorageFilePattern(AbstractFilePattern, GoogleStorageClient):
         # we use the only filter available: prefix. Whatever blob_pattern
         # text comes before the first wildcard gives our prefix.
         prefix = re.match('(^[^\*\?]*)', blob_pattern).group()
-        blobs = self.bucket.list_blobs(prefix=prefix)
-        blob_ids = [b.name for b in blobs]
-        matches = fnmatch.filter(blob_ids, blob_pattern)
-        matches = self._trim_metadata_suffix(matches)
-        return matches
+        # Blobs are listed in lexicographic order, so a blob always comes
+        # before <blob>.metadata.yaml. Matches are remembered only until
+        # their metadata can no longer follow.
+        recent_matches = deque()
+        recent_match_set = set()
+        for blob in self._iter_blobs(prefix):
+            while recent_matches \
+                  and blob.name > recent_matches[0] + METADATA_SUFFIX:
+                recent_match_set.discard(recent_matches.popleft())
+            if not fnmatch.fnmatch(blob.name, blob_pattern):
+                continue
+            if self.do_trim_metadata_suffix:
+                if blob.name.endswith(METADATA_SUFFIX):
+                    blob_id = blob.name[:-len(METADATA_SUFFIX)]
+                    if blob_id not in recent_match_set:
+                        yield blob_id, None
+                    continue
+                recent_matches.append(blob.name)
+                recent_match_set.add(blob.name)
+            yield blob.name, blob
+
+    def _iter_blobs(self, prefix):
+        # Blobs are listed one page at a time as they are used
+        page_token = None
+        while True:
+            if self.retry:
+                blobs, page_token = execute_with_retries(
+                    lambda: self._list_blobs_page(prefix, page_token),
+                    (Exception,),
+                    logger,
+                    'List blobs',
+                    nonretryable_errors=(google.cloud.exceptions.Forbidden,),
+                )
+            else:
+                blobs, page_token = self._list_blobs_page(prefix, page_token)
+            for blob in blobs:
+                yield blob
+            if not page_token:
+                return
 
-    def __iter__(self):
-        return self.files.__iter__()
+    def _list_blobs_page(self, prefix, page_token):
+        iterator = self.bucket.list_blobs(prefix=prefix, page_token=page_token)
+        blobs = list(next(iterator.pages))
+        return blobs, iterator.next_page_token
+
+    def has_wildcards(self):
+        return glob.has_magic(self.blob_pattern)
+
+    def _matches_existing_blob(self, file, blob_id):
+        if not fnmatch.fnmatch(blob_id, self.blob_pattern):
+            return False
+        if blob_id == file.blob_id and file.is_listed:
+            return True
+        return GoogleStorageFile(
+            'gs://%s/%s' % (self.bucket_id, blob_id),
+            self.settings, retry=self.retry).exists()
+
+    def matches(self, file):
+        if file.type != 'google_storage' or file.bucket_id != self.bucket_id:
+            return False
+        if self._matches_existing_blob(file, file.blob_id):
+            return True
+        return self.do_trim_metadata_suffix and self._matches_existing_blob(
+            file, file.blob_id + METADATA_SUFFIX)
 
 
 def File(url, settings, retry=False):
@@ -315,15 +541,20 @@ class AbstractFile:
     def __init__(self, url, settings, retry=False):
         raise FileUtilsError('Child class must override this method')
 
-    def copy_to(self, destination, expected_md5=None):
-        if self.retry or destination.retry:
+    def copy_to(self, destination, expected_md5=None, move=False, link=False):
+        """Copy this file to destination. See Copier for move and link.
+        """
+        if move:
+            # Nothing to retry from once the source has been moved
+            tries_remaining = 0
+        elif self.retry or destination.retry:
             tries_remaining = 2
         else:
             tries_remaining = 1
 
         while True:
             try:
-                copier = Copier(self, destination)
+                copier = Copier(self, destination, move=move, link=link)
                 copier.copy()
                 destination.verify_md5(expected_md5)
                 break
@@ -359,6 +590,12 @@ class AbstractFile:
         raise FileUtilsError('Child class must override this method')
     def read(self, content):
         raise FileUtilsError('Child class must override this method')
+    def stream_to(self, stream):
+        raise FileUtilsError('Child class must override this method')
+    def stream_from(self, stream):
+        raise FileUtilsError('Child class must override this method')
+    def get_size(self):
+        raise FileUtilsError('Child class must override this method')
     def write(self, content, overwrite=False):
         raise FileUtilsError('Child class must override this method')
     def delete(self, pruneto=None):
@@ -393,7 +630,32 @@ class LocalFile(AbstractFile):
         except IOError as e:
             raise FileUtilsError(e.message)
 
+    def stream_to(self, stream):
+        """Write the contents to a file-like object, a chunk at a time.
+        """
+        with open(self.get_path()) as f:
+            shutil.copyfileobj(f, stream)
+
+    def stream_from(self, stream):
+        """Write the contents of a file-like object to this file,
+        a chunk at a time.
+        """
+        self._make_parent_dir()
+        with open(self.get_path(), 'w') as f:
+            shutil.copyfileobj(stream, f)
+
+    def get_size(self):
+        return os.path.getsize(self.get_path())
+
     def write(self, content, overwrite=False):
+        self._make_parent_dir()
+        if not overwrite and self.exists():
+            raise FileUtilsError(
+                'Destination file already exists at "%s"' % self.get_path())
+        with open(self.get_path(), 'w') as f:
+            f.write(content)
+
+    def _make_parent_dir(self):
         try:
             os.makedirs(os.path.dirname(self.get_path()))
         except OSError as e:
@@ -402,11 +664,6 @@ class LocalFile(AbstractFile):
                 pass
             else:
                 raise FileUtilsError(str(e))
-        if not overwrite and self.exists():
-            raise FileUtilsError(
-                'Destination file already exists at "%s"' % self.get_path())
-        with open(self.get_path(), 'w') as f:
-            f.write(content)
 
     def delete(self, pruneto=None):
         os.remove(self.get_path())
@@ -429,13 +686,16 @@ class GoogleStorageFile(AbstractFile, GoogleStorageClient):
     """
     type = 'google_storage'
 
-    def __init__(self, url, settings, retry=False, must_exist=False):
+    def __init__(self, url, settings, retry=False, must_exist=False,
+                 blob=None):
         self.settings = settings
         self.url = _urlparse(url)
         self.retry = retry
         assert self.url.scheme == 'gs'
         self.bucket_id = self.url.hostname
         self.blob_id = self.url.path.lstrip('/')
+        # True if the blob came from a listing, so it is known to exist
+        self.is_listed = blob is not None
         if not self.bucket_id:
             raise FileUtilsError(
                 'Could not parse bucket ID in url "%s". '\
@@ -443,11 +703,27 @@ class GoogleStorageFile(AbstractFile, GoogleStorageClient):
         try:
             self.get_client()
             self.get_bucket(self.bucket_id)
-            self.get_blob(self.blob_id, must_exist=must_exist)
+            if blob is not None:
+                self._set_chunk_size(blob)
+                self.blob = blob
+            elif must_exist:
+                self.get_blob(self.blob_id, must_exist=True)
+        except google.cloud.exceptions.InternalServerError as e:
+            raise APIError(
+                "%s.%s: %s" %
+                (e.__class__.__module__, e.__class__.__name__, e))
+
+    def __getattr__(self, name):
+        # Blob metadata is fetched the first time it is used
+        if name != 'blob':
+            raise AttributeError(name)
+        try:
+            self.get_blob(self.blob_id)
         except google.cloud.exceptions.InternalServerError as e:
             raise APIError(
                 "%s.%s: %s" %
                 (e.__class__.__module__, e.__class__.__name__, e))
+        return self.blob
 
     def calculate_md5(self):
         md5_base64 = self.blob.md5_hash
@@ -470,35 +746,73 @@ class GoogleStorageFile(AbstractFile, GoogleStorageClient):
         return self.url.geturl().endswith('/')
 
     def read(self):
-        tempdir = tempfile.mkdtemp()
-        dest_file = os.path.join(tempdir, self.get_filename())
-        self.copy_to(File(dest_file, self.settings, retry=self.retry))
-        with open(dest_file) as f:
-            text = f.read()
-        os.remove(dest_file)
-        os.rmdir(tempdir)
-        return text
+        # Content is returned as a string, so read it in memory
+        # rather than through a temporary file
+        if self.retry:
+            return execute_with_retries(
+                lambda: self.blob.download_as_string(),
+                (Exception,),
+                logger,
+                'File read',
+                nonretryable_errors=(google.cloud.exceptions.Forbidden,),
+            )
+        else:
+            return self.blob.download_as_string()
+
+    def stream_to(self, stream):
+        """Write the contents to a file-like object, a chunk at a time.
+        Not retried, since data already written cannot be taken back.
+        """
+        self._get_thread_blob().download_to_file(stream)
+
+    def stream_from(self, stream):
+        """Upload the contents of a file-like object to this file.
+        Not retried, since data already read cannot be read again.
+        """
+        self._get_thread_blob().upload_from_file(stream)
+
+    def _get_thread_blob(self):
+        # Streams may run in another thread from the one that created
+        # this File, e.g. in a bundle's pipe, so they use a blob bound to
+        # the current thread's client instead of self.blob
+        return self._get_bucket(self.bucket_id).blob(
+            self.blob_id, chunk_size=self.CHUNK_SIZE)
+
+    def get_size(self):
+        return self.blob.size
 
     def write(self, content, overwrite=False):
         if not overwrite and self.exists():
             raise FileUtilsError(
-                'Destination file already exists at "%s"' % path)
-        with tempfile.NamedTemporaryFile('w') as f:
-            f.write(content)
-            f.flush()
-            File(f.name, self.settings, retry=self.retry).copy_to(self)
+                'Destination file already exists at "%s"' % self.get_url())
+        if self.retry:
+            execute_with_retries(
+                lambda: self.blob.upload_from_string(content),
+                (Exception,),
+                logger,
+                'File write',
+                nonretryable_errors=(google.cloud.exceptions.Forbidden,),
+            )
+        else:
+            self.blob.upload_from_string(content)
 
     def delete(self, pruneto=None):
         # pruning is automating in Google Storage
         self.blob.delete()
 
 
-def Copier(source, destination):
+def Copier(source, destination, move=False, link=False):
     """Factory method to select the right copier for a given source and destination.
+
+    move and link only affect copies between local files. move allows the
+    source to be moved to the destination, and should be used only when
+    the source is about to be deleted. link allows the destination to be
+    a hardlink to the source, and should be used only when neither will be
+    modified in place.
     """
 
     if source.type == 'local' and destination.type == 'local':
-        return LocalCopier(source, destination)
+        return LocalCopier(source, destination, move=move, link=link)
     elif source.type == 'local' and destination.type == 'google_storage':
         return Local2GoogleStorageCopier(source, destination)
     elif source.type == 'google_storage' and destination.type == 'local':
@@ -512,16 +826,112 @@ def Copier(source, destination):
 
 class AbstractCopier:
 
-    def __init__(self, source, destination, retry=False, expected_md5=None):
+    def __init__(self, source, destination, retry=False, expected_md5=None,
+                 move=False, link=False):
         self.source = source
         self.destination = destination
         self.expected_md5=expected_md5
         self.retry = self.source.retry or self.destination.retry
+        self.move = move
+        self.link = link
             
     def copy(self, path):
         raise FileUtilsError('Child class must override method')
 
+
+# ioctl request to share a file's blocks with another file (a reflink),
+# on filesystems that support it, e.g. btrfs and xfs. From linux/fs.h.
+_FICLONE = 0x40049409
+
+# Errors meaning that a method of copying is not supported for these files,
+# so another method should be tried
+_UNSUPPORTED_ERRNOS = set(
+    getattr(errno, name) for name in
+    ['EXDEV', 'EPERM', 'EMLINK', 'EINVAL', 'ENOSYS', 'ENOTSUP', 'EOPNOTSUPP',
+     'ENOTTY', 'EBADF', 'ETXTBSY']
+    if hasattr(errno, name))
+
+# Largest number of bytes requested from copy_file_range or sendfile at once
+_MAX_KERNEL_COPY_SIZE = 2**30
+
+
+def _get_libc_function(name, restype, argtypes):
+    # os.copy_file_range and os.sendfile are not in Python 2,
+    # so call libc directly when it has them
+    library = ctypes.util.find_library('c')
+    if library is None:
+        return None
+    try:
+        function = getattr(ctypes.CDLL(library, use_errno=True), name)
+    except (OSError, AttributeError):
+        return None
+    function.restype = restype
+    function.argtypes = argtypes
+    return function
+
+_copy_file_range = _get_libc_function(
+    'copy_file_range', ctypes.c_ssize_t,
+    [ctypes.c_int, ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p,
+     ctypes.c_size_t, ctypes.c_uint])
+_sendfile = _get_libc_function(
+    'sendfile', ctypes.c_ssize_t,
+    [ctypes.c_int, ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t])
+
+
+def _reflink(source_fd, destination_fd):
+    try:
+        fcntl.ioctl(destination_fd, _FICLONE, source_fd)
+    except (IOError, OSError) as e:
+        if e.errno in _UNSUPPORTED_ERRNOS:
+            return False
+        raise
+    return True
+
+
+def _kernel_copy(copy_chunk, size):
+    """Copy size bytes in the kernel, using copy_chunk(count) to copy
+    the next count bytes from the current position of each file.
+    Returns False if nothing was copied because copy_chunk is not supported
+    for these files, so that another method can be used.
+    """
+    copied = 0
+    while copied < size:
+        count = copy_chunk(min(size - copied, _MAX_KERNEL_COPY_SIZE))
+        if count < 0:
+            error = ctypes.get_errno()
+            if copied == 0 and error in _UNSUPPORTED_ERRNOS:
+                return False
+            raise OSError(error, os.strerror(error))
+        if count == 0:
+            # Source is shorter than when we started
+            break
+        copied += count
+    return True
+
+
+def _copy_file_range_copy(source_fd, destination_fd, size):
+    if _copy_file_range is None:
+        return False
+    return _kernel_copy(
+        lambda count: _copy_file_range(
+            source_fd, None, destination_fd, None, count, 0),
+        size)
+
+
+def _sendfile_copy(source_fd, destination_fd, size):
+    if _sendfile is None:
+        return False
+    return _kernel_copy(
+        lambda count: _sendfile(destination_fd, source_fd, None, count),
+        size)
+
+
 class LocalCopier(AbstractCopier):
+    """Copies between local files with the cheapest method that is safe:
+    a move or hardlink when allowed, otherwise a reflink, copy_file_range,
+    sendfile, or a copy through Python buffers.
+    As with a plain copy, the destination must not already exist.
+    """
 
     def copy(self):
         # Retry has no effect in local copier
@@ -533,12 +943,38 @@ class LocalCopier(AbstractCopier):
                 pass
             else:
                 raise FileUtilsError(str(e))
+        # A symlink is copied rather than linked, so that the destination
+        # does not depend on the file it points to
+        if (self.move or self.link) \
+           and not os.path.islink(self.source.get_path()):
+            if self._link():
+                if self.move:
+                    os.remove(self.source.get_path())
+                return
         dest = os.open(self.destination.get_path(),
                        os.O_CREAT | os.O_EXCL | os.O_WRONLY)
         with os.fdopen(dest, 'w') as f:
             with open(self.source.get_path()) as sf:
+                source_fd = sf.fileno()
+                size = os.fstat(source_fd).st_size
+                if _reflink(source_fd, dest) \
+                   or _copy_file_range_copy(source_fd, dest, size) \
+                   or _sendfile_copy(source_fd, dest, size):
+                    return
                 shutil.copyfileobj(sf, f)
 
+    def _link(self):
+        # Unlike os.rename, os.link fails if the destination exists,
+        # the same as opening it with O_EXCL
+        try:
+            os.link(self.source.get_path(), self.destination.get_path())
+        except OSError as e:
+            if e.errno in _UNSUPPORTED_ERRNOS:
+                # e.g. on different filesystems
+                return False
+            raise
+        return True
+
 
 class GoogleStorageCopier(AbstractCopier):
 
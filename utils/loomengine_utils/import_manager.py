@@ -1,9 +1,13 @@
+import functools
+import itertools
 import logging
 import os
 import re
 from requests.exceptions import HTTPError
 import yaml
 
+from . import md5calc
+from .bundle import BundleReader, is_bundle
 from .exceptions import ImportManagerError, FileDuplicateError
 from .file_utils import File, FileSet, parse_as_yaml
 from .connection import ServerConnectionError
@@ -12,6 +16,32 @@ from oauth2client.client import ApplicationDefaultCredentialsError
 logger = logging.getLogger(__name__)
 
 
+def _iter_batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _saves_md5_cache(method):
+    """For ImportManager methods that may hash local files. The md5 cache
+    is written once, when the outermost of these calls returns, rather
+    than after each file or batch.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        self._import_depth += 1
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self._import_depth -= 1
+            if self._import_depth == 0 and self.md5_cache is not None:
+                self.md5_cache.save()
+    return wrapper
+
+
 class DependencyNode(object):
     """This class helps keep track of file dependencies for a
     template. It maintains a tree of dependencies so that when references to 
@@ -27,9 +57,18 @@ class DependencyNode(object):
 
 class ImportManager(object):
 
-    def __init__(self, connection, storage_settings=None, silent=False):
+    # Number of files whose md5s are calculated together
+    # when many files are imported
+    MD5_BATCH_SIZE = 100
+
+    def __init__(self, connection, storage_settings=None, silent=False,
+                 md5_cache=None):
+        """md5_cache is an optional md5calc.Md5Cache for local files"""
         self.connection = connection
         self.silent = silent
+        self.md5_cache = md5_cache
+        self._local_md5s = {}
+        self._import_depth = 0
         if storage_settings is None:
             storage_settings = connection.get_storage_settings()
 	self.storage_settings = storage_settings
@@ -38,8 +77,13 @@ class ImportManager(object):
         if not self.silent:
             print text
 
+    @_saves_md5_cache
     def bulk_import(self, directory, link_files=False,
                     retry=False):
+        # "directory" may also be a bundle from ExportManager.export_bundle
+        if is_bundle(directory, self.storage_settings, retry=retry):
+            return self.import_bundle(
+                directory, link_files=link_files, retry=retry)
         self._bulk_import_files(
             os.path.join(directory, 'files'),
             link_files=link_files, retry=retry)
@@ -50,6 +94,96 @@ class ImportManager(object):
             os.path.join(directory, 'runs'),
             link_files=link_files, retry=retry)
 
+    @_saves_md5_cache
+    def import_bundle(self, bundle_url, link_files=False, retry=False,
+                      force_duplicates=False):
+        """Import files, templates and runs from a bundle, reading it
+        as a single stream. Files with contents in the bundle are always
+        copied to storage. link_files applies to files without contents.
+        """
+        self._print('Importing bundle from "%s".' % bundle_url)
+        bundle = BundleReader(bundle_url, self.storage_settings, retry=retry)
+        for record, contents in bundle:
+            if record['type'] == 'file':
+                if contents is None:
+                    source = File(record['data']['value']['file_url'],
+                                  self.storage_settings, retry=retry)
+                    self._import_file_and_metadata(
+                        source, record['data'], '', link=link_files,
+                        force_duplicates=force_duplicates, retry=retry)
+                else:
+                    self._import_bundled_file(
+                        record['data'], contents, bundle.file,
+                        force_duplicates=force_duplicates, retry=retry)
+            elif record['type'] == 'template':
+                self._import_bundled_template(record['data'])
+            elif record['type'] == 'run':
+                self._import_bundled_run(record['data'])
+            else:
+                raise ImportManagerError(
+                    'Unknown record type "%s" in bundle "%s"'
+                    % (record['type'], bundle_url))
+
+    def _import_bundled_file(self, metadata, contents, bundle_file,
+                             force_duplicates=False, retry=False):
+        md5 = metadata['value']['md5']
+        data_object = self._render_file_data_object_dict(
+            bundle_file, '', metadata=metadata, md5=md5)
+        try:
+            data_object = self._check_for_file_duplicates(
+                data_object, force_duplicates=force_duplicates)
+        except FileDuplicateError:
+            return
+        data_object = self._post_data_object(data_object)
+        if data_object['value'].get('upload_status') == 'complete':
+            return data_object
+        destination = File(data_object['value']['file_url'],
+                           self.storage_settings, retry=retry)
+        logger.info('Importing file %s@%s from bundle to %s...' % (
+            data_object['value']['filename'], data_object['uuid'],
+            destination.get_url()))
+        try:
+            destination.stream_from(contents)
+            destination.verify_md5(md5)
+        except Exception:
+            self._set_upload_status(data_object, 'failed')
+            raise
+        return self._set_upload_status(data_object, 'complete')
+
+    def _import_bundled_template(self, template):
+        # Templates in a bundle are complete, with uuids, so there are
+        # no dependencies to look for
+        if self.connection.get_template(template['uuid']):
+            self._print('Skipping template "%s@%s" because it already '\
+                        'exists.' % (template['name'], template['uuid']))
+            return
+        self._post(self.connection.post_template, template)
+        self._print('Imported template "%s@%s".' % (
+            template['name'], template['uuid']))
+
+    def _import_bundled_run(self, run):
+        self._post(self.connection.post_run, run)
+        self._print('Imported run "%s@%s".' % (run['name'], run['uuid']))
+
+    def _post_data_object(self, data_object):
+        try:
+            return self._post(self.connection.post_data_object, data_object)
+        except ServerConnectionError as e:
+            raise ImportManagerError(
+                "Failed to POST DataObject: '%s'. %s"
+                % (data_object, e.message))
+
+    def _post(self, post_function, data):
+        try:
+            return post_function(data)
+        except HTTPError as e:
+            if e.response.status_code==400:
+                errors = e.response.json()
+                raise SystemExit(
+                    "ERROR! %s" % errors)
+            else:
+                raise
+
     def _bulk_import_files(self, directory, link_files=False, retry=False,
                            force_duplicates=False):
         # import all files directory/* and directory/*/*, with metadata if present
@@ -58,12 +192,13 @@ class ImportManager(object):
             self.storage_settings, retry=retry,
             trim_metadata_suffix=True, raise_if_missing=False)
         imported_files = []
-        for file_to_import in files_to_import:
-            imported_files.append(
-                self.import_file(
-                    file_to_import.get_url(), '', link=link_files, retry=retry,
-                    force_duplicates=force_duplicates)
-            )
+        for batch in self._iter_md5_batches(files_to_import):
+            for file_to_import in batch:
+                imported_files.append(
+                    self.import_file(
+                        file_to_import.get_url(), '', link=link_files,
+                        retry=retry, force_duplicates=force_duplicates)
+                )
         return imported_files
 
     def _bulk_import_templates(self, directory, link_files=False, retry=False,
@@ -92,21 +227,32 @@ class ImportManager(object):
             )
         return imported_runs
 
+    @_saves_md5_cache
     def import_from_patterns(self, patterns, comments, link=False,
                             ignore_metadata=False, force_duplicates=False,
                             from_metadata=False, retry=False):
         files = []
-        for source in FileSet(patterns, self.storage_settings, retry=retry,
-                              trim_metadata_suffix=True):
-            files.append(self.import_file(
-                source.get_url(),
-                comments,
-                link=link,
-                ignore_metadata=ignore_metadata,
-                force_duplicates=force_duplicates,
-                retry=retry))
+        sources = FileSet(patterns, self.storage_settings, retry=retry,
+                          trim_metadata_suffix=True)
+        for batch in self._iter_md5_batches(sources):
+            for source in batch:
+                files.append(self.import_file(
+                    source.get_url(),
+                    comments,
+                    link=link,
+                    ignore_metadata=ignore_metadata,
+                    force_duplicates=force_duplicates,
+                    retry=retry))
         return files
 
+    def _iter_md5_batches(self, sources):
+        # md5s of local files are calculated for a batch at once, so that
+        # they can be hashed concurrently. Batches are imported as they
+        # are listed.
+        for batch in _iter_batches(sources, self.MD5_BATCH_SIZE):
+            self._calculate_local_md5s(batch)
+            yield batch
+
     def _get_file_metadata(self, metadata_url, retry=False, ignore_metadata=False):
         if ignore_metadata:
             return None
@@ -130,6 +276,7 @@ class ImportManager(object):
             raise ImportManagerError(
                 'Metadata is not valid YAML format: "%s"' % metadata_url)
 
+    @_saves_md5_cache
     def import_file(self, requested_source_url, comments, link=False,
                     ignore_metadata=False, force_duplicates=False,
                     retry=False):
@@ -149,6 +296,33 @@ class ImportManager(object):
             source_file, metadata, comments, link=link,
             force_duplicates=force_duplicates, retry=retry)
 
+    def _calculate_local_md5s(self, sources):
+        """Hash the local files among sources concurrently. The md5s
+        are kept until _get_md5 is called for each file.
+        """
+        paths = [source.get_path() for source in sources
+                 if source.type == 'local' and source.exists()
+                 and not source.is_dir()
+                 and source.get_path() not in self._local_md5s]
+        if not paths:
+            return
+        logger.info('Calculating md5 on %s local file(s)...' % len(paths))
+        self._local_md5s.update(zip(paths, md5calc.calculate_md5sums(
+            paths, cache=self.md5_cache)))
+
+    def _get_md5(self, source):
+        if source.type == 'local':
+            md5 = self._local_md5s.pop(source.get_path(), None)
+            if md5 is None:
+                logger.info('Calculating md5 on file "%s"...'
+                            % source.get_url())
+                md5 = md5calc.calculate_md5sums(
+                    [source.get_path()], processes=1,
+                    cache=self.md5_cache)[0]
+            return md5
+        logger.info('Calculating md5 on file "%s"...' % source.get_url())
+        return source.calculate_md5()
+
     def _get_file_and_metadata_urls(self, requested_source_url):
         if requested_source_url.endswith('.metadata.yaml'):
             source_file_url = requested_source_url[:-len('.metadata.yaml')]
@@ -238,7 +412,7 @@ class ImportManager(object):
         return files
 
     def _render_file_data_object_dict(
-            self, source, comments, metadata=None, link=False):
+            self, source, comments, metadata=None, link=False, md5=None):
         if metadata is None:
             metadata = {}
         metadata_file_resource = metadata.get('value', {})
@@ -248,8 +422,8 @@ class ImportManager(object):
             comments = metadata_file_resource.get('import_comments', '')
         filename = metadata_file_resource.get('filename', source.get_filename())
         file_relative_path = metadata_file_resource.get('file_relative_path', None)
-        logger.info('Calculating md5 on file "%s"...' % source.get_url())
-        md5 = source.calculate_md5()
+        if md5 is None:
+            md5 = self._get_md5(source)
         metadata_md5 = metadata_file_resource.get('md5')
         imported_from_url = metadata_file_resource.get(
             'imported_from_url', source.get_url())
@@ -286,14 +460,16 @@ class ImportManager(object):
             file_data_object['datetime_created'] = metadata.get('datetime_created')
         return file_data_object
 
-    def import_result_file(self, task_attempt_output, source_url, retry=False):
+    def import_result_file(self, task_attempt_output, source_url, retry=False,
+                           move=False):
         logger.info('Calculating md5 on file "%s"...' % source_url)
         source = File(source_url, self.storage_settings, retry=retry)
         md5 = source.calculate_md5()
         task_attempt_output = self._create_task_attempt_output_file(
             task_attempt_output, md5, source.get_filename())
         data_object = task_attempt_output['data']['contents']
-        return self._execute_file_import(data_object, source, retry=retry)
+        return self._execute_file_import(
+            data_object, source, retry=retry, move=move)
 
     def _create_task_attempt_output_file(
             self, task_attempt_output, md5, filename):
@@ -311,14 +487,12 @@ class ImportManager(object):
                         }}}})
 
     def import_result_file_list(self, task_attempt_output, source_url_list,
-                                retry=False):
-        md5_list = []
-        filename_list = []
-        for source_url in source_url_list:
-            logger.info('Calculating md5 on file "%s"...' % source_url)
-            source = File(source_url, self.storage_settings, retry=retry)
-            md5_list.append(source.calculate_md5())
-            filename_list.append(source.get_filename())
+                                retry=False, move=False):
+        sources = [File(source_url, self.storage_settings, retry=retry)
+                   for source_url in source_url_list]
+        self._calculate_local_md5s(sources)
+        md5_list = [self._get_md5(source) for source in sources]
+        filename_list = [source.get_filename() for source in sources]
         task_attempt_output = self._create_task_attempt_output_file_array(
             task_attempt_output, md5_list, filename_list)
         data_object_array = task_attempt_output['data']['contents']
@@ -326,7 +500,8 @@ class ImportManager(object):
         for (source_url, data_object) in zip(source_url_list, data_object_array):
             source = File(source_url, self.storage_settings, retry=retry)
             imported_data_objects.append(
-                self._execute_file_import(data_object, source, retry=retry))
+                self._execute_file_import(
+                    data_object, source, retry=retry, move=move))
         return imported_data_objects
 
     def _create_task_attempt_output_file_array(
@@ -348,7 +523,8 @@ class ImportManager(object):
                     'contents': contents
                 }})
 
-    def import_log_file(self, task_attempt, source_url, retry=False):
+    def import_log_file(self, task_attempt, source_url, retry=False,
+                        move=False):
         log_name = os.path.basename(source_url)
         log_file = self.connection.post_task_attempt_log_file(
             task_attempt['uuid'], {'log_name': log_name})
@@ -368,9 +544,13 @@ class ImportManager(object):
                                   'md5': md5,
                 }})
         
-        return self._execute_file_import(data_object, source, retry=retry)
+        return self._execute_file_import(
+            data_object, source, retry=retry, move=move)
 
-    def _execute_file_import(self, file_data_object, source, retry=False):
+    def _execute_file_import(self, file_data_object, source, retry=False,
+                             move=False):
+        # If move is True, a local source may be moved to a local destination
+        # rather than copied. Use it only for files that will be deleted.
         logger.info('Importing file from %s...' % source.get_url())
         if file_data_object['value'].get('upload_status') == 'complete':
             logger.info(
@@ -385,7 +565,7 @@ class ImportManager(object):
                 retry=retry)
             logger.info(
                 '   copying to destination %s ...' % destination.get_url())
-            source.copy_to(destination)
+            source.copy_to(destination, move=move)
         except ApplicationDefaultCredentialsError as e:
             self._set_upload_status(file_data_object, 'failed')
             raise SystemExit(
@@ -413,6 +593,7 @@ class ImportManager(object):
             {'uuid': uuid, 'value': { 'upload_status': upload_status}}
         )
 
+    @_saves_md5_cache
     def import_template(self, template_file, comments=None,
                         force_duplicates=False,
                         retry=False, link_files=False):
@@ -448,6 +629,7 @@ class ImportManager(object):
             imported_template['uuid']))
         return imported_template
 
+    @_saves_md5_cache
     def import_run(self, run_file,
                    force_duplicates=False,
                    retry=False, link_files=False):
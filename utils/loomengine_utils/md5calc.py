@@ -1,10 +1,18 @@
+import errno
 import hashlib
+import json
+import multiprocessing
+import os
+import tempfile
+
+# Large reads keep hashing of big files from being bound by system calls
+CHUNK_SIZE = 2**20
 
 def calculate_md5sum(file_path):
     with open(file_path, 'rb') as f:
         m = hashlib.md5()
         while True:
-            data = f.read(8192)
+            data = f.read(CHUNK_SIZE)
             if not data:
                 break
             m.update(data)
@@ -12,3 +20,128 @@ def calculate_md5sum(file_path):
 
 def calculate_md5sum_from_string(string):
     m = hashlib.md5(string)
+    return m.hexdigest()
+
+def calculate_md5sums(file_paths, processes=None, cache=None):
+    """Returns the md5s of local files, in the same order as file_paths.
+    Files are hashed concurrently by a pool of processes, by default one
+    for each CPU. If an Md5Cache is given, files that are unchanged since
+    they were cached are not hashed again. New md5s are added to the cache
+    in memory, and written when cache.save() is called.
+    """
+    md5s = {}
+    stats = {}
+    paths_to_hash = []
+    for file_path in file_paths:
+        if file_path in md5s or file_path in stats:
+            continue
+        if cache is not None:
+            md5 = cache.get(file_path)
+            if md5 is not None:
+                md5s[file_path] = md5
+                continue
+            # Stat before hashing, so that a file changed while it is
+            # being hashed will not match the cache next time
+            stats[file_path] = os.stat(file_path)
+        else:
+            stats[file_path] = None
+        paths_to_hash.append(file_path)
+
+    if len(paths_to_hash) > 1 and processes != 1:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(calculate_md5sum, paths_to_hash, chunksize=1)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+    else:
+        results = [calculate_md5sum(file_path) for file_path in paths_to_hash]
+
+    for file_path, md5 in zip(paths_to_hash, results):
+        md5s[file_path] = md5
+        if cache is not None:
+            cache.set(file_path, md5, stats[file_path])
+    return [md5s[file_path] for file_path in file_paths]
+
+
+class Md5Cache(object):
+    """md5s of local files, saved as JSON in cache_path. An entry is used
+    only while the file's size, mtime and inode are unchanged.
+    """
+
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        self._entries = self._load()
+        self._changed = False
+
+    def _load(self):
+        try:
+            with open(self.cache_path) as f:
+                entries = json.load(f)
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                return {}
+            raise
+        except ValueError:
+            # Corrupt cache. It will be replaced on save.
+            return {}
+        if not isinstance(entries, dict):
+            return {}
+        return entries
+
+    def _get_key(self, stat):
+        return [stat.st_size, stat.st_mtime, stat.st_ino]
+
+    def get(self, file_path):
+        entry = self._entries.get(os.path.abspath(file_path))
+        if entry is None:
+            return None
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        if entry.get('key') != self._get_key(stat):
+            return None
+        return entry.get('md5')
+
+    def set(self, file_path, md5, stat=None):
+        if stat is None:
+            stat = os.stat(file_path)
+        self._entries[os.path.abspath(file_path)] = {
+            'key': self._get_key(stat),
+            'md5': md5,
+        }
+        self._changed = True
+
+    def _prune(self):
+        # Drop entries for files that no longer exist
+        for path in self._entries.keys():
+            if not os.path.exists(path):
+                del self._entries[path]
+                self._changed = True
+
+    def save(self):
+        """Write the cache if it changed, without entries for files that
+        no longer exist. Save once after many calls to set, since the
+        whole cache is written each time.
+        """
+        self._prune()
+        if not self._changed:
+            return
+        # Write to a temporary file and rename it, so that an interrupted
+        # save does not leave a partial cache
+        directory = os.path.dirname(os.path.abspath(self.cache_path))
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        fd, temp_path = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self._entries, f)
+            os.rename(temp_path, self.cache_path)
+        except:
+            os.remove(temp_path)
+            raise
+        self._changed = False
@@ -0,0 +1,89 @@
+import hashlib
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+from loomengine_utils.bundle import BundleReader, BundleWriter, is_bundle
+from loomengine_utils.exceptions import BundleError
+
+
+class TestBundle(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.bundle_path = os.path.join(self.tempdir, 'out', 'bundle.tar')
+        self.files = []
+        for i in range(2):
+            contents = 'contents of file%s\n' % i * (i * 1000 + 1)
+            path = os.path.join(self.tempdir, 'file%s.txt' % i)
+            with open(path, 'w') as f:
+                f.write(contents)
+            self.files.append({
+                'uuid': 'uuid%s' % i,
+                'type': 'file',
+                'value': {
+                    'filename': 'file%s.txt' % i,
+                    'md5': hashlib.md5(contents).hexdigest(),
+                    'file_url': 'file://' + path}})
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def testRoundTrip(self):
+        bundle = BundleWriter(self.bundle_path, {})
+        bundle.add_run({'name': 'run', 'uuid': 'run0'})
+        bundle.add_template({'name': 'template', 'uuid': 'template0'})
+        bundle.add_file(self.files[0])
+        bundle.add_file(self.files[1], include_contents=False)
+        bundle.add_file(self.files[0])
+        bundle.write()
+        self.assertTrue(is_bundle(self.bundle_path, {}))
+        self.assertFalse(is_bundle(self.tempdir, {}))
+
+        records = []
+        for record, contents in BundleReader(self.bundle_path, {}):
+            records.append(record)
+            if record.get('member'):
+                with open(record['data']['value']['file_url'][7:]) as f:
+                    self.assertEqual(contents.read(), f.read())
+            else:
+                self.assertIsNone(contents)
+        self.assertEqual([record['type'] for record in records],
+                         ['file', 'file', 'template', 'run'])
+        self.assertEqual(records[0]['member'], 'files/uuid0/file0.txt')
+        self.assertNotIn('member', records[1])
+
+    def testRecordsCanBeSkipped(self):
+        bundle = BundleWriter(self.bundle_path, {})
+        bundle.add_file(self.files[0])
+        bundle.add_file(self.files[1])
+        bundle.write()
+        uuids = [record['data']['uuid'] for record, contents
+                 in BundleReader(self.bundle_path, {})]
+        self.assertEqual(uuids, ['uuid0', 'uuid1'])
+
+    def testWriteWithWrongMd5(self):
+        self.files[0]['value']['md5'] = 'wrong'
+        bundle = BundleWriter(self.bundle_path, {})
+        bundle.add_file(self.files[0])
+        with self.assertRaises(BundleError):
+            bundle.write()
+        self.assertFalse(os.path.exists(self.bundle_path))
+
+    def testWriteWhenBundleExists(self):
+        os.mkdir(os.path.dirname(self.bundle_path))
+        open(self.bundle_path, 'w').close()
+        with self.assertRaises(BundleError):
+            BundleWriter(self.bundle_path, {})
+
+    def testReadTarWithoutManifest(self):
+        tar = tarfile.open(self.bundle_path.replace('out/', ''), 'w')
+        tar.add(self.files[0]['value']['file_url'][7:], 'file0.txt')
+        tar.close()
+        with self.assertRaises(BundleError):
+            list(BundleReader(self.bundle_path.replace('out/', ''), {}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,5 @@
 import datetime
+import io
 import json
 import re
 import requests
@@ -9,29 +10,35 @@ from loomengine_utils import connection
 from loomengine_utils.exceptions import ServerConnectionError, ResourceCountError, ServerConnectionHttpError
 
 class MockRoute:
-    def __init__(self, route_regex, method, response, params=None):
+    def __init__(self, route_regex, method, response, params=None,
+                 request_headers=None):
         self.route_regex = route_regex
         self.method = method
         self.params = params
         self.response = response
+        self.request_headers = request_headers
 
 
 class MockRequest:
-    def __init__(self, url, method, params=None, data=None, auth=None):
+    def __init__(self, url, method, params=None, data=None, auth=None,
+                 headers=None):
         self.url = url
         self.method = method
         self.params = params
         self.data = data
         self.auth = auth
+        self.headers = headers
 
 default_response_data = {"message": "default content"}
 
-def MockResponse(status_code=200, content=None):
+def MockResponse(status_code=200, content=None, headers=None):
     if content is None:
         content = default_response_data
     response = requests.Response()
     response.status_code = status_code
     response._content = json.dumps(content)
+    if headers:
+        response.headers.update(headers)
     return response
 
 
@@ -46,21 +53,28 @@ class MockConnection(connection.Connection):
         self.default_response = None
 
     def add_route(self, route_regex, method, content=None,
-                  status_code=200, params=None):
-        self.routes.append(
+                  status_code=200, params=None, headers=None,
+                  request_headers=None):
+        # Routes with request_headers match only requests that send
+        # those headers. Add them before routes for the same URL without.
+        self.routes.insert(
+            len(self.routes) if request_headers is None else 0,
             MockRoute(route_regex,
                       method,
-                      MockResponse(status_code=status_code, content=content),
-                      params=params))
+                      MockResponse(status_code=status_code, content=content,
+                                   headers=headers),
+                      params=params,
+                      request_headers=request_headers))
 
     def set_default_response(self, status_code, content):
         self.default_response = MockResponse(
             status_code=status_code, content=content)
         
     def _add_request(self, relative_url, method,
-                     params=None, data=None, auth=None):
+                     params=None, data=None, auth=None, headers=None):
         request = MockRequest(
-            relative_url, method, params=params, data=data, auth=auth)
+            relative_url, method, params=params, data=data, auth=auth,
+            headers=headers)
         self.requests.append(request)
         return request
 
@@ -68,7 +82,8 @@ class MockConnection(connection.Connection):
         for route in self.routes:
             if re.match(route.route_regex, request.url) \
                and route.method == request.method \
-               and route.params==request.params:
+               and route.params==request.params \
+               and self._headers_match(route, request):
                 return route.response
         # No matching route. Return Default.
         if self.default_response is not None:
@@ -79,16 +94,24 @@ class MockConnection(connection.Connection):
                 % (request.method, request.url, request.params,
                    request.data, request.auth))
 
+    def _headers_match(self, route, request):
+        if not route.request_headers:
+            return True
+        headers = request.headers or {}
+        return all(headers.get(key) == value
+                   for key, value in route.request_headers.items())
+
     def _get(self, relative_url, raise_for_status=True,
-             params=None, auth=None, timeout=30):
+             params=None, auth=None, timeout=30, headers=None):
         if params == {}:
             # For MockRoutes, it is standard to use params=None, but
             # some Connection methods  set it to {}, so we standardize it here.
             params = None
-        request = self._add_request(relative_url, 'GET', params=params, auth=auth)
+        request = self._add_request(relative_url, 'GET', params=params,
+                                    auth=auth, headers=headers)
         return self._get_response(request)
 
-    def _post(self, data, relative_url, auth=None, timeout=30):
+    def _post(self, data, relative_url, auth=None, timeout=30, stream=False):
         request = self._add_request(relative_url, 'POST', data=data, auth=auth)
         return self._get_response(request)
 
@@ -205,6 +228,28 @@ class TestConnection(unittest.TestCase):
         with self.assertRaises(ServerConnectionHttpError):
             response_data = self.connection._get_resource(url)
 
+    def testGetResourceNotModified(self):
+        url = 'widgets/001/'
+        etag = '"abc123"'
+        self.connection.add_route(url, 'GET', headers={'ETag': etag})
+        self.connection.add_route(url, 'GET', status_code=304,
+                                  request_headers={'If-None-Match': etag})
+        response_data = self.connection._get_resource(url)
+        self.assertEqual(response_data, default_response_data)
+        response_data = self.connection._get_resource(url)
+        self.assertEqual(response_data, default_response_data)
+        self.assertEqual(self.connection.requests[-1].headers,
+                         {'If-None-Match': etag})
+
+    def testGetResourceCacheSize(self):
+        self.connection.RESOURCE_CACHE_SIZE = 2
+        self.connection.add_route('widgets/', 'GET', headers={'ETag': '"1"'})
+        for url in ['widgets/001/', 'widgets/002/', 'widgets/003/']:
+            self.connection._get_resource(url)
+        self.assertEqual(
+            [key[0] for key in self.connection._resource_cache.keys()],
+            ['widgets/002/', 'widgets/003/'])
+
     def testGetIndex(self):
         url = 'widgets/'
         params = {'param1': 'value1'}
@@ -455,11 +500,31 @@ class TestConnection(unittest.TestCase):
         self.assertEqual(response_data, default_response_data)
         self.assertEqual(self.connection.requests[0].data, self.mock_request_data)
 
+    def testPostRunSubmission(self):
+        self.connection.add_route('run-submissions/', 'POST')
+        response_data = self.connection.post_run_submission(
+            self.mock_request_data)
+        self.assertEqual(response_data, default_response_data)
+        self.assertEqual(self.connection.requests[0].data, self.mock_request_data)
+
+    def testGetRunSubmission(self):
+        self.connection.add_route('run-submissions/123/', 'GET')
+        response_data = self.connection.get_run_submission('123')
+        self.assertEqual(response_data, default_response_data)
+
     def testGetRun(self):
         self.connection.add_route('runs/123/', 'GET')
         response_data = self.connection.get_run('123')
         self.assertEqual(response_data, default_response_data)
 
+    def testGetRunFields(self):
+        self.connection.add_route(
+            'runs/123/', 'GET',
+            params={'fields': 'uuid,status', 'exclude': 'tasks'})
+        response_data = self.connection.get_run(
+            '123', fields=['uuid', 'status'], exclude=['tasks'])
+        self.assertEqual(response_data, default_response_data)
+
     def testDeleteRun(self):
         self.connection.add_route('runs/123/', 'DELETE')
         response_data = self.connection.delete_run('123')
@@ -520,6 +585,20 @@ class TestConnection(unittest.TestCase):
         response_data = self.connection.get_run_dependencies('123')
         self.assertEqual(response_data, default_response_data)
 
+    def testGetExportClosure(self):
+        records = [{'type': 'data_object', 'data': {'uuid': '456'}},
+                   {'type': 'run', 'data': {'uuid': '123'}}]
+        self.connection.add_route('export-closure/', 'POST')
+        # A streamed response is read from its raw stream
+        response = self.connection.routes[0].response
+        response._content = False
+        response.raw = io.BytesIO(''.join(
+            json.dumps(record) + '\n' for record in records))
+        response_data = list(self.connection.get_export_closure(runs=['123']))
+        self.assertEqual(response_data, records)
+        self.assertEqual(self.connection.requests[0].data,
+                         {'runs': ['123'], 'templates': []})
+
     def testPostRunTag(self):
         self.connection.add_route('runs/123/add-tag/', 'POST')
         response_data = self.connection.post_run_tag('123', self.mock_request_data)
@@ -104,6 +104,53 @@ class TestExportManager(unittest.TestCase):
         dest_md5 = md5calc.calculate_md5sum(destination_file)
         self.assertEqual(dest_md5, data_object['value']['md5'])
 
+
+    def testBulkExportFilesConcurrently(self):
+        data_objects = [
+            self._get_data_object(filename, md5, file_url)
+            for filename, md5, file_url
+            in zip(self.filenames, self.md5_sums, self.file_urls)]
+        # Same contents and filename as the first file
+        data_objects.append(self._get_data_object(
+            self.filenames[0], self.md5_sums[0], self.file_urls[0]))
+        self.export_manager.bulk_export_files(
+            data_objects, destination_directory=self.destination_directory,
+            editable=True)
+        for md5 in self.md5_sums:
+            file_directory = os.path.join(
+                self.destination_directory, 'files', 'md5_'+md5)
+            self.assertEqual(sorted(os.listdir(file_directory)),
+                             ['filename', 'filename.metadata.yaml'])
+            self.assertEqual(md5calc.calculate_md5sum(
+                os.path.join(file_directory, 'filename')), md5)
+
+    def testBulkExportFilesCopiesEachMd5Once(self):
+        # Different data objects with the same contents
+        data_objects = [
+            self._get_data_object(
+                self.filenames[0], self.md5_sums[0], self.file_urls[0])
+            for i in range(3)]
+        urls = []
+        File = export_manager.File
+        def record_file(url, *args, **kwargs):
+            urls.append(url)
+            return File(url, *args, **kwargs)
+        export_manager.File = record_file
+        try:
+            self.export_manager.bulk_export_files(
+                data_objects, destination_directory=self.destination_directory)
+        finally:
+            export_manager.File = File
+        self.assertEqual(urls.count(self.file_urls[0]), 1)
+        for data_object in data_objects:
+            destination_file = os.path.join(
+                self.destination_directory, 'files',
+                'uuid_'+data_object['uuid'], 'filename')
+            self.assertEqual(md5calc.calculate_md5sum(destination_file),
+                             self.md5_sums[0])
+            self.assertEqual(data_object['value']['file_url'],
+                             'file://'+destination_file)
+
         
 if __name__=='__main__':
     unittest.main()
@@ -1,7 +1,10 @@
+import errno
 import os
 import re
 import shutil
+import StringIO
 import tempfile
+import threading
 import unittest
 from loomengine_utils import file_utils
 
@@ -121,6 +124,50 @@ class TestLocalFilePattern(unittest.TestCase):
         for file in files:
             self.assertTrue(file.get_url() in expected_files)
 
+    def testMissingNeg(self):
+        pattern = 'file://'+os.path.join(self.tempdir, 'nofile*')
+        with self.assertRaises(file_utils.NoFileError):
+            file_utils.FilePattern(pattern, {}, retry=False)
+
+    def testHiddenFilesNotMatched(self):
+        with open(os.path.join(self.tempdir, '.hidden.txt'), 'w') as f:
+            f.write('hidden')
+        pattern = 'file://'+os.path.join(self.tempdir, '*.txt')
+        file_pattern = file_utils.FilePattern(pattern, {}, retry=False)
+        self.assertEqual(sorted(file.get_filename() for file in file_pattern),
+                         ['file0.txt', 'file1.txt'])
+
+    def testWildcardDirectory(self):
+        os.mkdir(os.path.join(self.tempdir, 'subdir'))
+        subdir_file = os.path.join(self.tempdir, 'subdir', 'file3.txt')
+        with open(subdir_file, 'w') as f:
+            f.write('file3.txt')
+        pattern = 'file://'+os.path.join(self.tempdir, '*', '*.txt')
+        file_pattern = file_utils.FilePattern(pattern, {}, retry=False)
+        self.assertEqual([file.get_path() for file in file_pattern],
+                         [subdir_file])
+
+    def testFileSetOverlappingPatterns(self):
+        patterns = [os.path.join(self.tempdir, 'file0.txt'),
+                    os.path.join(self.tempdir, 'file*.txt*')]
+        file_set = file_utils.FileSet(patterns, {}, retry=False,
+                                      trim_metadata_suffix=True)
+        urls = [file.get_url() for file in file_set]
+        self.assertEqual(len(urls), 3)
+        self.assertEqual(len(set(urls)), 3)
+
+    def testFileSetRepeatedPaths(self):
+        patterns = [self.filepaths[0], self.filepaths[1], self.filepaths[0]]
+        file_set = file_utils.FileSet(patterns, {}, retry=False)
+        def matches(file):
+            raise AssertionError(
+                'Patterns without wildcards are deduplicated by URL')
+        for pattern in file_set.patterns:
+            pattern.matches = matches
+        urls = [file.get_url() for file in file_set]
+        self.assertEqual(urls, ['file://'+self.filepaths[0],
+                                'file://'+self.filepaths[1]])
+
 
 class TestFile(unittest.TestCase):
 
@@ -223,5 +270,232 @@ class TestLocalFile(unittest.TestCase):
             os.path.join(self.tempdir, subdir1, subdir2)))
 
 
+class TestLocalCopier(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.source_path = os.path.join(self.tempdir, 'source.txt')
+        self.contents = 'some contents\n' * 1000
+        with open(self.source_path, 'w') as f:
+            f.write(self.contents)
+        self.md5 = file_utils.md5calc.calculate_md5sum(self.source_path)
+        self.source = file_utils.File(self.source_path, {})
+        self.destination_path = os.path.join(
+            self.tempdir, 'subdir', 'destination.txt')
+        self.destination = file_utils.File(self.destination_path, {})
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def testCopy(self):
+        self.source.copy_to(self.destination, expected_md5=self.md5)
+        self.assertEqual(self.destination.read(), self.contents)
+        self.assertTrue(self.source.exists())
+        self.assertFalse(os.path.samefile(
+            self.source_path, self.destination_path))
+
+    def testCopyWithoutKernelCopy(self):
+        copy_file_range = file_utils._copy_file_range
+        sendfile = file_utils._sendfile
+        file_utils._copy_file_range = None
+        file_utils._sendfile = None
+        try:
+            self.source.copy_to(self.destination)
+        finally:
+            file_utils._copy_file_range = copy_file_range
+            file_utils._sendfile = sendfile
+        self.assertEqual(self.destination.read(), self.contents)
+
+    def testCopyEmptyFile(self):
+        with open(self.source_path, 'w') as f:
+            pass
+        self.source.copy_to(self.destination)
+        self.assertEqual(self.destination.read(), '')
+
+    def testCopyToExistingFileFails(self):
+        os.mkdir(os.path.dirname(self.destination_path))
+        with open(self.destination_path, 'w') as f:
+            f.write('already here')
+        for options in [{}, {'link': True}, {'move': True}]:
+            with self.assertRaises(OSError):
+                self.source.copy_to(self.destination, **options)
+        self.assertEqual(self.destination.read(), 'already here')
+        self.assertTrue(self.source.exists())
+
+    def testCopyWithLink(self):
+        self.source.copy_to(self.destination, expected_md5=self.md5,
+                            link=True)
+        self.assertTrue(os.path.samefile(
+            self.source_path, self.destination_path))
+
+    def testCopyWithMove(self):
+        self.source.copy_to(self.destination, move=True)
+        self.assertEqual(self.destination.read(), self.contents)
+        self.assertFalse(self.source.exists())
+
+    def testCopyWithMoveFallsBackToCopy(self):
+        # e.g. when the destination is on another filesystem
+        def link(source, destination):
+            raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+        os_link = os.link
+        os.link = link
+        try:
+            self.source.copy_to(self.destination, move=True)
+        finally:
+            os.link = os_link
+        self.assertEqual(self.destination.read(), self.contents)
+
+
+class FakeBlob(object):
+
+    def __init__(self, name, bucket):
+        self.name = name
+        self.bucket = bucket
+        self.size = 0
+        self.chunk_size = None
+        self.md5_hash = '1B2M2Y8AsgTpgAmY7PhCfg=='
+
+    def download_as_string(self):
+        self.bucket.requests.append(('download', self.name))
+        return 'content of %s' % self.name
+
+    def download_to_file(self, stream):
+        self.bucket.requests.append(('download', self.name))
+        stream.write('content of %s' % self.name)
+
+
+class FakeBlobIterator(object):
+
+    def __init__(self, blobs, next_page_token):
+        self.pages = iter([blobs])
+        self.next_page_token = next_page_token
+
+
+class FakeBucket(object):
+
+    PAGE_SIZE = 40
+
+    def __init__(self, blob_names):
+        self.requests = []
+        self.blobs = [FakeBlob(name, self) for name in sorted(blob_names)]
+
+    def list_blobs(self, prefix='', page_token=None):
+        self.requests.append(('list', prefix))
+        blobs = [blob for blob in self.blobs if blob.name.startswith(prefix)]
+        start = page_token or 0
+        end = start + self.PAGE_SIZE
+        if end >= len(blobs):
+            end = None
+        return FakeBlobIterator(blobs[start:end], end)
+
+    def get_blob(self, blob_id):
+        self.requests.append(('get', blob_id))
+        for blob in self.blobs:
+            if blob.name == blob_id:
+                return blob
+        return None
+
+    def blob(self, blob_id, chunk_size=None):
+        return FakeBlob(blob_id, self)
+
+
+class FakeClient(object):
+
+    buckets = {}
+    instances = []
+
+    def __init__(self, project):
+        self.requests = []
+        FakeClient.instances.append(self)
+
+    def get_bucket(self, bucket_id):
+        self.requests.append(('get_bucket', bucket_id))
+        return self.buckets[bucket_id]
+
+
+class TestGoogleStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.settings = {'GCE_PROJECT': 'project'}
+        self.blob_names = ['dir/file%s.txt' % i for i in range(100)] \
+                          + ['dir/file0.txt.metadata.yaml', 'other/file.txt']
+        self.bucket = FakeBucket(self.blob_names)
+        FakeClient.buckets = {'bucket': self.bucket}
+        FakeClient.instances = []
+        self.client_class = file_utils.google.cloud.storage.client.Client
+        file_utils.google.cloud.storage.client.Client = FakeClient
+        file_utils._google_storage_cache.clients.clear()
+        file_utils._google_storage_cache.buckets.clear()
+
+    def tearDown(self):
+        file_utils.google.cloud.storage.client.Client = self.client_class
+        file_utils._google_storage_cache.clients.clear()
+        file_utils._google_storage_cache.buckets.clear()
+
+    def testFilePatternListsOnce(self):
+        file_pattern = file_utils.FilePattern(
+            'gs://bucket/dir/*.txt', self.settings)
+        self.assertEqual(self.bucket.requests, [])
+        files = [file for file in file_pattern]
+        self.assertEqual(len(files), 100)
+        self.assertEqual(files[0].calculate_md5(),
+                         'd41d8cd98f00b204e9800998ecf8427e')
+        # One request per page of results
+        self.assertEqual(self.bucket.requests, [('list', 'dir/')] * 3)
+
+    def testFilePatternTrimMetadataSuffix(self):
+        file_pattern = file_utils.FilePattern(
+            'gs://bucket/dir/file*', self.settings,
+            trim_metadata_suffix=True)
+        urls = [file.get_url() for file in file_pattern]
+        self.assertEqual(len(urls), 100)
+        self.assertEqual(urls.count('gs://bucket/dir/file0.txt'), 1)
+
+    def testFileSetOverlappingPatterns(self):
+        file_set = file_utils.FileSet(
+            ['gs://bucket/dir/file1*', 'gs://bucket/dir/*'], self.settings)
+        urls = [file.get_url() for file in file_set]
+        self.assertEqual(len(urls), 101)
+        self.assertEqual(len(set(urls)), 101)
+
+    def testClientAndBucketAreReused(self):
+        file1 = file_utils.File('gs://bucket/dir/file1.txt', self.settings)
+        file2 = file_utils.File('gs://bucket/dir/file2.txt', self.settings)
+        self.assertEqual(len(FakeClient.instances), 1)
+        self.assertEqual(FakeClient.instances[0].requests,
+                         [('get_bucket', 'bucket')])
+        self.assertTrue(file1.bucket is file2.bucket)
+
+    def testClientIsNotSharedBetweenThreads(self):
+        thread = threading.Thread(target=file_utils.File,
+                                  args=('gs://bucket/dir/file1.txt',
+                                        self.settings))
+        thread.start()
+        thread.join()
+        self.assertEqual(len(FakeClient.instances), 1)
+        # Not cached for this thread, and freed with the other thread
+        self.assertEqual(file_utils._google_storage_cache.clients, {})
+        file_utils.File('gs://bucket/dir/file1.txt', self.settings)
+        self.assertEqual(len(FakeClient.instances), 2)
+
+    def testStreamUsesClientOfCurrentThread(self):
+        file = file_utils.File('gs://bucket/dir/file1.txt', self.settings)
+        stream = StringIO.StringIO()
+        thread = threading.Thread(target=file.stream_to, args=(stream,))
+        thread.start()
+        thread.join()
+        self.assertEqual(stream.getvalue(), 'content of dir/file1.txt')
+        self.assertEqual(len(FakeClient.instances), 2)
+        self.assertEqual(FakeClient.instances[1].requests,
+                         [('get_bucket', 'bucket')])
+
+    def testBlobIsFetchedWhenUsed(self):
+        file = file_utils.File('gs://bucket/dir/file1.txt', self.settings)
+        self.assertEqual(self.bucket.requests, [])
+        self.assertEqual(file.read(), 'content of dir/file1.txt')
+        self.assertEqual(self.bucket.requests, [
+            ('get', 'dir/file1.txt'), ('download', 'dir/file1.txt')])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -7,7 +7,7 @@ import unittest
 import yaml
 
 
-from loomengine_utils import import_manager, file_utils
+from loomengine_utils import import_manager, file_utils, md5calc
 from loomengine_utils.connection import Connection
 from loomengine_utils.exceptions import ImportManagerError
 from loomengine_utils.test.test_connection \
@@ -75,6 +75,26 @@ class TestImportManager(unittest.TestCase):
             [os.path.join(self.source_directory, '*'),], None)
         self.assertEqual(len(files), 3)
 
+    def testImportFromPatternsSavesMd5CacheOnce(self):
+        saves = []
+        class Md5Cache(md5calc.Md5Cache):
+            def save(self):
+                saves.append(self)
+                super(Md5Cache, self).save()
+        cache = Md5Cache(os.path.join(self.destination_directory, 'md5.json'))
+        self.import_manager.md5_cache = cache
+        self.import_manager.MD5_BATCH_SIZE = 1
+        def mock_import_file(self, url, comments, **kwargs):
+            return self._get_md5(file_utils.File(url, {}))
+        self.import_manager.import_file \
+            = mock_import_file.__get__(self.import_manager)
+        md5s = self.import_manager.import_from_patterns(
+            [os.path.join(self.source_directory, '*'),], None)
+        self.assertEqual(sorted(md5s), sorted(self.md5_sums))
+        self.assertEqual(len(saves), 1)
+        cache = md5calc.Md5Cache(cache.cache_path)
+        self.assertEqual(cache.get(self.file_paths[0]), self.md5_sums[0])
+
     def testGetFileMetadata(self):
         test_metadata = {'test': 'metadata'}
         metadata_path = os.path.join(self.source_directory, 'test.metadata.yaml')
@@ -0,0 +1,81 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from loomengine_utils import md5calc
+
+
+class TestCalculateMd5sums(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.file_paths = []
+        for i in range(3):
+            file_path = os.path.join(self.tempdir, 'file%s.txt' % i)
+            with open(file_path, 'w') as f:
+                f.write('contents %s' % i)
+            self.file_paths.append(file_path)
+        self.cache_path = os.path.join(self.tempdir, 'cache', 'md5.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _get_md5(self, i):
+        return hashlib.md5('contents %s' % i).hexdigest()
+
+    def testCalculateMd5sums(self):
+        file_paths = list(reversed(self.file_paths)) + [self.file_paths[0]]
+        md5s = md5calc.calculate_md5sums(file_paths, processes=2)
+        self.assertEqual(md5s, [self._get_md5(2), self._get_md5(1),
+                                self._get_md5(0), self._get_md5(0)])
+
+    def testCalculateMd5sumsWithCache(self):
+        cache = md5calc.Md5Cache(self.cache_path)
+        md5calc.calculate_md5sums(self.file_paths, processes=1, cache=cache)
+        cache.save()
+        cache = md5calc.Md5Cache(self.cache_path)
+        self.assertEqual(cache.get(self.file_paths[1]), self._get_md5(1))
+
+        # A cached md5 is used without reading the file
+        cache.set(self.file_paths[1], 'cached')
+        md5s = md5calc.calculate_md5sums(self.file_paths, cache=cache)
+        self.assertEqual(md5s[1], 'cached')
+
+    def testCacheIsWrittenOnSave(self):
+        cache = md5calc.Md5Cache(self.cache_path)
+        md5calc.calculate_md5sums(self.file_paths, processes=1, cache=cache)
+        self.assertFalse(os.path.exists(self.cache_path))
+        cache.save()
+        self.assertEqual(md5calc.Md5Cache(self.cache_path).get(
+            self.file_paths[2]), self._get_md5(2))
+
+    def testSavePrunesMissingFiles(self):
+        cache = md5calc.Md5Cache(self.cache_path)
+        md5calc.calculate_md5sums(self.file_paths, processes=1, cache=cache)
+        cache.save()
+        os.remove(self.file_paths[0])
+        cache = md5calc.Md5Cache(self.cache_path)
+        cache.save()
+        with open(self.cache_path) as f:
+            self.assertEqual(sorted(json.load(f).keys()),
+                             sorted(self.file_paths[1:]))
+
+    def testCacheMissAfterChange(self):
+        cache = md5calc.Md5Cache(self.cache_path)
+        cache.set(self.file_paths[0], self._get_md5(0))
+        with open(self.file_paths[0], 'a') as f:
+            f.write(' and more')
+        self.assertIsNone(cache.get(self.file_paths[0]))
+
+    def testCorruptCache(self):
+        os.makedirs(os.path.dirname(self.cache_path))
+        with open(self.cache_path, 'w') as f:
+            f.write('not json')
+        cache = md5calc.Md5Cache(self.cache_path)
+        self.assertIsNone(cache.get(self.file_paths[0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
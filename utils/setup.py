@@ -93,6 +93,7 @@ setup(
         'google-cloud-storage',
         'pycrypto',
         'requests>=2.5.0',
+        'scandir',
     ],
 
     # List additional groups of dependencies here (e.g. development
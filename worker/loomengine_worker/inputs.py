@@ -1,4 +1,12 @@
+import errno
+import fcntl
+import hashlib
 import os
+import threading
+import time
+import urlparse
+
+from loomengine_utils.file_utils import File
 
 
 class BaseInput(object):
@@ -8,6 +16,29 @@ class BaseInput(object):
         self.export_manager = task_monitor.export_manager
         self.working_dir = task_monitor.working_dir
         self.channel = channel
+        self.task_monitor = task_monitor
+
+    def _stage_file(self, data_object, filename):
+        source_path = self._get_mountable_path(data_object)
+        if source_path is None:
+            self.export_manager.export_file(
+                data_object,
+                destination_directory=self.working_dir,
+                destination_filename=filename,
+                retry=True)
+        else:
+            # The file in storage will be mounted read-only
+            # in the container at the same path
+            self.task_monitor.input_mounts.add(source_path)
+            os.symlink(source_path, os.path.join(self.working_dir, filename))
+
+    def _get_mountable_path(self, data_object):
+        if self.task_monitor.settings.get('INPUT_STAGING_MODE') != 'mount':
+            return None
+        url = urlparse.urlparse(data_object['value']['file_url'])
+        if url.scheme != 'file':
+            return None
+        return url.path
 
     def _index_duplicate_filenames(self, filename, duplicate_filename_counters):
         # Increment filenames if there are duplicates,
@@ -34,16 +65,110 @@ class FileInput(BaseInput):
         data_object = self.data_contents
         filename = self._index_duplicate_filenames(
             data_object['value']['filename'], duplicate_filename_counters)
-        self.export_manager.export_file(
-            data_object,
-            destination_directory=self.working_dir,
-            destination_filename=filename,
-            retry=True)
+        self._stage_file(data_object, filename)
 
     def get_filenames(self):
         return [self.data_contents['value']['filename']]
 
 
+class StreamingFileInput(FileInput):
+    """A file input that is written to a named pipe in the working dir
+    while the task runs, rather than copied before it starts.
+    """
+
+    POLL_INTERVAL_SECONDS = 0.1
+
+    def copy(self, duplicate_filename_counters):
+        data_object = self.data_contents
+        filename = self._index_duplicate_filenames(
+            data_object['value']['filename'], duplicate_filename_counters)
+        self.fifo_path = os.path.join(self.working_dir, filename)
+        os.mkfifo(self.fifo_path)
+        self._stop = threading.Event()
+        self._thread = None
+        self._error = None
+        self._md5 = None
+
+    def start_stream(self):
+        self._thread = threading.Thread(target=self._stream)
+        # Do not keep the worker alive if the task never reads the pipe
+        self._thread.daemon = True
+        self._thread.start()
+
+    def finish_stream(self):
+        """Stop streaming, remove the pipe, and raise an error if the file
+        was not written correctly. Call after the container has exited.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        # Remove the pipe so that outputs cannot match it
+        os.remove(self.fifo_path)
+        if self._error is not None:
+            raise self._error
+        expected_md5 = self.data_contents['value'].get('md5')
+        if self._md5 is not None and expected_md5 \
+           and self._md5 != expected_md5:
+            raise Exception(
+                'Streamed input "%s" had md5 %s but %s was expected'
+                % (self.fifo_path, self._md5, expected_md5))
+
+    def _stream(self):
+        try:
+            fd = self._open_fifo()
+            if fd is None:
+                return
+            # Unbuffered, so that nothing is left to write on close
+            # if the task stops reading
+            f = os.fdopen(fd, 'w', 0)
+            stream = _Md5Stream(f)
+            try:
+                File(self.data_contents['value']['file_url'],
+                     self.export_manager.storage_settings).stream_to(stream)
+            except IOError as e:
+                if e.errno != errno.EPIPE:
+                    raise
+                # The task stopped reading before the end,
+                # so the md5 cannot be checked
+                return
+            finally:
+                f.close()
+            self._md5 = stream.hexdigest()
+        except Exception as e:
+            self._error = e
+
+    def _open_fifo(self):
+        # Opening a pipe for writing blocks until it is opened for reading,
+        # so poll instead, and give up if the container exits first
+        while not self._stop.is_set():
+            try:
+                fd = os.open(self.fifo_path, os.O_WRONLY | os.O_NONBLOCK)
+            except OSError as e:
+                if e.errno != errno.ENXIO:
+                    raise
+                time.sleep(self.POLL_INTERVAL_SECONDS)
+                continue
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags & ~os.O_NONBLOCK)
+            return fd
+        return None
+
+
+class _Md5Stream(object):
+    """Wraps a file, calculating the md5 of what is written to it"""
+
+    def __init__(self, f):
+        self._file = f
+        self._md5 = hashlib.md5()
+
+    def write(self, data):
+        self._file.write(data)
+        self._md5.update(data)
+
+    def hexdigest(self):
+        return self._md5.hexdigest()
+
+
 class FileListInput(BaseInput):
 
     def copy(self, duplicate_filename_counters):
@@ -53,11 +178,7 @@ class FileListInput(BaseInput):
         for data_object in data_object_list:
             filename = self._index_duplicate_filenames(
                 data_object['value']['filename'], duplicate_filename_counters)
-            self.export_manager.export_file(
-                data_object,
-                destination_directory=self.working_dir,
-                destination_filename=filename,
-                retry=True)
+            self._stage_file(data_object, filename)
 
     def get_filenames(self):
         return [data_object['value']['filename'] for data_object in self.data_contents]
@@ -95,6 +216,9 @@ def TaskAttemptInput(input, task_attempt):
         return NoOpInput(None, channel, task_attempt)
 
     if mode == 'no_gather':
+        if input.get('staging') == 'stream':
+            return StreamingFileInput(
+                input['data']['contents'], channel, task_attempt)
         return FileInput(input['data']['contents'], channel, task_attempt)
     else:
         assert mode.startswith('gather')
@@ -133,3 +257,21 @@ class TaskAttemptInputs(object):
     def copy(self):
         for input in self.inputs:
             input.copy(self.duplicate_filename_counters)
+
+    def _get_streaming_inputs(self):
+        return [input for input in self.inputs
+                if isinstance(input, StreamingFileInput)]
+
+    def start_streams(self):
+        for input in self._get_streaming_inputs():
+            input.start_stream()
+
+    def finish_streams(self):
+        errors = []
+        for input in self._get_streaming_inputs():
+            try:
+                input.finish_stream()
+            except Exception as e:
+                errors.append(str(e))
+        if errors:
+            raise Exception('Streaming inputs failed. %s' % ' '.join(errors))
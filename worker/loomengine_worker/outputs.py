@@ -11,28 +11,51 @@ class BaseOutput(object):
         self.import_manager = task_monitor.import_manager
         self.working_dir = task_monitor.working_dir
         self.task_monitor = task_monitor
+        self._file_paths = None
+
+    def get_file_paths(self):
+        """Paths of the files in the working dir that this output reads.
+        A glob is matched only once, so these are the same files that
+        are saved.
+        """
+        if self._file_paths is None:
+            self._file_paths = [os.path.normpath(file_path)
+                                for file_path in self._find_file_paths()]
+        return self._file_paths
+
+    def _find_file_paths(self):
+        return []
+
+    def _can_move_files(self):
+        return all(self.task_monitor.is_last_file_use(file_path)
+                   for file_path in self.get_file_paths())
 
 
 class FileOutput(BaseOutput):
 
     def save(self):
-        filename = self.output['source']['filename']
-        file_path = os.path.join(
-            self.working_dir, filename)
         self.import_manager.import_result_file(
-            self.output, file_path, retry=True)
+            self.output, self.get_file_paths()[0], retry=True,
+            move=self._can_move_files())
+
+    def _find_file_paths(self):
+        filename = self.output['source']['filename']
+        return [os.path.join(self.working_dir, filename)]
 
 
 class FileListScatterOutput(BaseOutput):
 
     def save(self):
+        self.import_manager.import_result_file_list(
+            self.output, self.get_file_paths(), retry=True,
+            move=self._can_move_files())
+
+    def _find_file_paths(self):
         filename_list = self.output['source']['filenames']
-        file_path_list = [
+        return [
             os.path.join(
                 self.working_dir, filename)
             for filename in filename_list]
-        self.import_manager.import_result_file_list(
-            self.output, file_path_list, retry=True)
 
 
 class FileContentsOutput(BaseOutput):
@@ -52,6 +75,10 @@ class FileContentsOutput(BaseOutput):
             text = f.read()
         return text
 
+    def _find_file_paths(self):
+        filename = self.output['source']['filename']
+        return [os.path.join(self.working_dir, filename)]
+
 
 class FileContentsScatterOutput(FileContentsOutput):
 
@@ -69,19 +96,21 @@ class FileContentsScatterOutput(FileContentsOutput):
 class FileListContentsScatterOutput(FileContentsOutput):
 
     def save(self):
-        filename_list = self.output['source']['filenames']
-        if not isinstance(filename_list, list):
-            filename_list = filename_list.split(' ')
         contents_list = []
-        for filename in filename_list:
-            file_path = os.path.join(
-                self.working_dir, filename)
+        for file_path in self.get_file_paths():
             contents_list.append(self._read_file(file_path))
         self.output.update({'data': {'contents': contents_list}})
         self.connection.update_task_attempt_output(
             self.output['uuid'],
             self.output)
 
+    def _find_file_paths(self):
+        filename_list = self.output['source']['filenames']
+        if not isinstance(filename_list, list):
+            filename_list = filename_list.split(' ')
+        return [os.path.join(self.working_dir, filename)
+                for filename in filename_list]
+
 
 class StreamOutput(BaseOutput):
 
@@ -125,29 +154,34 @@ class StreamScatterOutput(StreamOutput):
 class GlobScatterOutput(BaseOutput):
 
     def save(self):
+        self.import_manager.import_result_file_list(
+            self.output, self.get_file_paths(), retry=True,
+            move=self._can_move_files())
+
+    def _find_file_paths(self):
         globstring = os.path.join(
             self.working_dir,
             self.output['source']['glob'])
-        file_path_list = glob.glob(globstring)
-        self.import_manager.import_result_file_list(
-            self.output, file_path_list, retry=True)
+        return glob.glob(globstring)
 
 
 class GlobContentsScatterOutput(FileContentsOutput):
 
     def save(self):
-        globstring = os.path.join(
-            self.working_dir,
-            self.output['source']['glob'])
-        file_path_list = glob.glob(globstring)
         contents_list = []
-        for file_path in file_path_list:
+        for file_path in self.get_file_paths():
             contents_list.append(self._read_file(file_path))
         self.output.update({'data': {'contents': contents_list}})
         self.connection.update_task_attempt_output(
             self.output['uuid'],
             self.output)
 
+    def _find_file_paths(self):
+        globstring = os.path.join(
+            self.working_dir,
+            self.output['source']['glob'])
+        return glob.glob(globstring)
+
 
 def _get_output_info(output):
     assert 'type' in output, 'invalid output: "type" is missing'
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 
 import argparse
+import collections
 import copy
 from datetime import datetime
 from dateutil.parser import parse
@@ -43,6 +44,9 @@ class TaskMonitor(object):
             'LOG_LEVEL': args.log_level,
         }
         self.is_failed = False
+        self.inputs = None
+        # Paths of local input files to mount read-only in the container
+        self.input_mounts = set()
 
         self.logger = get_stdout_logger(
             __name__, self.settings['LOG_LEVEL'])
@@ -145,8 +149,10 @@ class TaskMonitor(object):
             self._create_run_script()
             self._create_container()
             self._run_container()
+            self._start_streaming_inputs()
             self._stream_docker_logs()
             self._get_returncode()
+            self._finish_streaming_inputs()
             self._save_process_logs()
             if not self.is_failed:
                 self._save_outputs()
@@ -160,13 +166,29 @@ class TaskMonitor(object):
         if self.task_attempt.get('inputs') is None:
             return
         try:
-            TaskAttemptInputs(self.task_attempt['inputs'], self).copy()
+            self.inputs = TaskAttemptInputs(self.task_attempt['inputs'], self)
+            self.inputs.copy()
         except Exception as e:
             error = self._get_error_text(e)
             self._report_system_error(
                 detail='Copying inputs failed. %s' % error)
             raise
 
+    def _start_streaming_inputs(self):
+        if self.inputs is None:
+            return
+        self.inputs.start_streams()
+
+    def _finish_streaming_inputs(self):
+        if self.inputs is None:
+            return
+        try:
+            self.inputs.finish_streams()
+        except Exception as e:
+            error = self._get_error_text(e)
+            self._report_system_error(detail=error)
+            # Do not raise error. Attempt to save log files.
+
     def _create_run_script(self):
         try:
             user_command = self.task_attempt['command']
@@ -214,15 +236,23 @@ class TaskMonitor(object):
             command = interpreter.split(' ')
             command.append(self.LOOM_RUN_SCRIPT_NAME)
 
+            binds = {host_dir: {
+                'bind': container_dir,
+                'mode': 'rw',
+            }}
+            # Inputs staged as symlinks point to these paths
+            for path in self.input_mounts:
+                binds[path] = {
+                    'bind': path,
+                    'mode': 'ro',
+                }
+
             self.container = self.docker_client.create_container(
                 image=docker_image,
                 command=command,
                 volumes=[container_dir],
                 host_config=self.docker_client.create_host_config(
-                    binds={host_dir: {
-                        'bind': container_dir,
-                        'mode': 'rw',
-                    }}),
+                    binds=binds),
                 working_dir=container_dir,
                 name=self.settings['PROCESS_CONTAINER_NAME'],
             )
@@ -340,10 +370,13 @@ class TaskMonitor(object):
 
     def _import_log_file(self, filepath, retry=True):
         try:
+            # Log files are written only to be imported,
+            # so they can be moved rather than copied
             self.import_manager.import_log_file(
                 self.task_attempt,
                 filepath,
                 retry=retry,
+                move=True,
             )
         except IOError:
             message = 'Failed to upload log file %s' % filepath
@@ -352,14 +385,26 @@ class TaskMonitor(object):
     def _save_outputs(self):
         self._event('Saving outputs')
         try:
-            for output in self.task_attempt['outputs']:
-                TaskAttemptOutput(output, self).save()
+            outputs = [TaskAttemptOutput(output, self)
+                       for output in self.task_attempt['outputs']]
+            # The working dir is deleted after outputs are saved, so
+            # a result file can be moved rather than copied by the last
+            # output that reads it
+            self._remaining_file_uses = collections.Counter(
+                file_path for output in outputs
+                for file_path in output.get_file_paths())
+            for output in outputs:
+                output.save()
+                self._remaining_file_uses.subtract(output.get_file_paths())
         except Exception as e:
             error = self._get_error_text(e)
             self._report_system_error(
                 detail='Saving outputs failed. %s' % error)
             raise
 
+    def is_last_file_use(self, file_path):
+        return self._remaining_file_uses[file_path] <= 1
+
     def _finish(self):
         try:
             self._finish()
@@ -0,0 +1,124 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+from loomengine_worker.inputs import TaskAttemptInputs
+
+
+class FakeExportManager(object):
+
+    def __init__(self):
+        self.exported = []
+        self.storage_settings = {}
+
+    def export_file(self, data_object, destination_directory=None,
+                    destination_filename=None, retry=False):
+        self.exported.append(destination_filename)
+
+
+class FakeTaskMonitor(object):
+
+    def __init__(self, working_dir, input_staging_mode):
+        self.working_dir = working_dir
+        self.export_manager = FakeExportManager()
+        self.settings = {'INPUT_STAGING_MODE': input_staging_mode}
+        self.input_mounts = set()
+
+
+def get_file_input(channel, url):
+    return {
+        'channel': channel,
+        'type': 'file',
+        'mode': 'no_gather',
+        'data': {'contents': {
+            'value': {'filename': 'input.txt', 'file_url': url}}},
+    }
+
+
+class TestTaskAttemptInputs(unittest.TestCase):
+
+    def setUp(self):
+        self.working_dir = tempfile.mkdtemp()
+        self.inputs = [get_file_input('b', 'file:///storage/b/input.txt'),
+                       get_file_input('a', 'file:///storage/a/input.txt'),
+                       get_file_input('c', 'gs://bucket/c/input.txt')]
+
+    def tearDown(self):
+        shutil.rmtree(self.working_dir)
+
+    def testCopy(self):
+        task_monitor = FakeTaskMonitor(self.working_dir, 'copy')
+        TaskAttemptInputs(self.inputs, task_monitor).copy()
+        self.assertEqual(task_monitor.export_manager.exported,
+                         ['input__0__.txt', 'input__1__.txt',
+                          'input__2__.txt'])
+        self.assertEqual(task_monitor.input_mounts, set())
+
+    def testMount(self):
+        task_monitor = FakeTaskMonitor(self.working_dir, 'mount')
+        TaskAttemptInputs(self.inputs, task_monitor).copy()
+        self.assertEqual(
+            os.readlink(os.path.join(self.working_dir, 'input__0__.txt')),
+            '/storage/a/input.txt')
+        self.assertEqual(
+            os.readlink(os.path.join(self.working_dir, 'input__1__.txt')),
+            '/storage/b/input.txt')
+        self.assertEqual(task_monitor.input_mounts,
+                         set(['/storage/a/input.txt',
+                              '/storage/b/input.txt']))
+        # Google Storage inputs are still copied
+        self.assertEqual(task_monitor.export_manager.exported,
+                         ['input__2__.txt'])
+
+
+class TestStreamingFileInput(unittest.TestCase):
+
+    def setUp(self):
+        self.working_dir = tempfile.mkdtemp()
+        self.storage_dir = tempfile.mkdtemp()
+        self.contents = 'streamed contents\n' * 10000
+        self.source_path = os.path.join(self.storage_dir, 'input.txt')
+        with open(self.source_path, 'w') as f:
+            f.write(self.contents)
+        self.task_monitor = FakeTaskMonitor(self.working_dir, 'copy')
+
+    def tearDown(self):
+        shutil.rmtree(self.working_dir)
+        shutil.rmtree(self.storage_dir)
+
+    def _get_inputs(self, md5):
+        input = get_file_input('a', 'file://' + self.source_path)
+        input['staging'] = 'stream'
+        input['data']['contents']['value']['md5'] = md5
+        inputs = TaskAttemptInputs([input], self.task_monitor)
+        inputs.copy()
+        return inputs
+
+    def testStream(self):
+        inputs = self._get_inputs(hashlib.md5(self.contents).hexdigest())
+        fifo_path = os.path.join(self.working_dir, 'input.txt')
+        self.assertEqual(self.task_monitor.export_manager.exported, [])
+        inputs.start_streams()
+        with open(fifo_path) as f:
+            self.assertEqual(f.read(), self.contents)
+        inputs.finish_streams()
+        self.assertFalse(os.path.exists(fifo_path))
+
+    def testStreamWithWrongMd5(self):
+        inputs = self._get_inputs('wrong')
+        inputs.start_streams()
+        with open(os.path.join(self.working_dir, 'input.txt')) as f:
+            f.read()
+        with self.assertRaises(Exception):
+            inputs.finish_streams()
+
+    def testStreamNotRead(self):
+        inputs = self._get_inputs('wrong')
+        inputs.start_streams()
+        # Nothing was streamed, so there is nothing to check
+        inputs.finish_streams()
+
+
+if __name__ == '__main__':
+    unittest.main()